@@ -1,4 +1,5 @@
 import os
+import signal
 import joblib
 import numpy as np
 
@@ -12,6 +13,7 @@ from sandbox.gkahn.gcg.policies.mac_policy import MACPolicy
 from sandbox.gkahn.gcg.policies.rccar_mac_policy import RCcarMACPolicy
 from sandbox.gkahn.gcg.sampler.sampler import RNNCriticSampler
 from sandbox.gkahn.gcg.utils.utils import timeit
+from sandbox.gkahn.gcg.utils.checkpointer import Checkpointer
 
 class GCG(RLAlgorithm):
 
@@ -22,6 +24,14 @@ class GCG(RLAlgorithm):
         self._batch_size = kwargs['batch_size']
         self._save_rollouts = kwargs['save_rollouts']
         self._save_rollouts_observations = kwargs['save_rollouts_observations']
+        self._save_inference_graph = kwargs.get('save_inference_graph', False)
+        self._checkpoint = kwargs.get('checkpoint', 'pickle')
+        if self._checkpoint == 'pickle':
+            self._checkpointer = None
+        elif self._checkpoint == 'npz':
+            self._checkpointer = Checkpointer(logger.get_snapshot_dir(), **kwargs['checkpoint_params'])
+        else:
+            raise NotImplementedError
 
         self._sampler = RNNCriticSampler(
             policy=kwargs['policy'],
@@ -89,11 +99,17 @@ class GCG(RLAlgorithm):
 
     def _save_params(self, itr, train_rollouts, eval_rollouts):
         with self._policy.session.as_default(), self._policy.session.graph.as_default():
-            itr_params = dict(
-                itr=itr,
-                policy=self._policy,
-            )
-            logger.save_itr_params(itr, itr_params)
+            if self._checkpointer is not None:
+                self._checkpointer.save(itr, self._policy.get_checkpoint_values())
+            else:
+                itr_params = dict(
+                    itr=itr,
+                    policy=self._policy,
+                )
+                logger.save_itr_params(itr, itr_params)
+            if self._save_inference_graph:
+                self._policy.export_inference_graph(
+                    os.path.join(logger.get_snapshot_dir(), 'itr_{0}_inference.pkl'.format(itr)))
 
             self._save_rollouts_file(itr, train_rollouts)
             self._save_rollouts_file(itr, eval_rollouts, eval=True)
@@ -102,6 +118,29 @@ class GCG(RLAlgorithm):
     ### Training methods ###
     ########################
 
+    def _train(self, step, num_train_steps, use_target):
+        ### chain as many training steps per session.run as the policy supports
+        train_steps_per_run = self._policy.train_steps_per_run
+        while train_steps_per_run > 1 and num_train_steps >= train_steps_per_run:
+            timeit.start('batch')
+            batches = [self._sampler.sample(self._batch_size) for _ in range(train_steps_per_run)]
+            batches = [np.stack(x) for x in zip(*batches)]
+            timeit.stop('batch')
+            timeit.start('train')
+            self._policy.train_steps(step, *batches, use_target=use_target)
+            timeit.stop('train')
+            num_train_steps -= train_steps_per_run
+
+        for _ in range(num_train_steps):
+            timeit.start('batch')
+            batch = self._sampler.sample(self._batch_size)
+            timeit.stop('batch')
+            timeit.start('train')
+            ### an 8th element is the target network lowd cached in the replay pool
+            self._policy.train_step(step, *batch[:7], use_target=use_target,
+                                    target_embeddings=batch[7] if len(batch) > 7 else None)
+            timeit.stop('train')
+
     @overrides
     def train(self):
         save_itr = 0
@@ -142,20 +181,9 @@ class GCG(RLAlgorithm):
                 ### training step
                 if self._train_every_n_steps >= 1:
                     if step % int(self._train_every_n_steps) == 0:
-                        timeit.start('batch')
-                        batch = self._sampler.sample(self._batch_size)
-                        timeit.stop('batch')
-                        timeit.start('train')
-                        self._policy.train_step(step, *batch, use_target=target_updated)
-                        timeit.stop('train')
+                        self._train(step, 1, use_target=target_updated)
                 else:
-                    for _ in range(int(1. / self._train_every_n_steps)):
-                        timeit.start('batch')
-                        batch = self._sampler.sample(self._batch_size)
-                        timeit.stop('batch')
-                        timeit.start('train')
-                        self._policy.train_step(step, *batch, use_target=target_updated)
-                        timeit.stop('train')
+                    self._train(step, int(1. / self._train_every_n_steps), use_target=target_updated)
 
                 ### update target network
                 if step > self._update_target_after_n_steps and step % self._update_target_every_n_steps == 0:
@@ -188,6 +216,8 @@ class GCG(RLAlgorithm):
         self._save_params(save_itr,
                           train_rollouts=self._sampler.get_recent_paths(),
                           eval_rollouts=eval_rollouts)
+        if self._checkpointer is not None:
+            self._checkpointer.close()
 
 def run_gcg(params):
     # copy yaml for posterity
@@ -226,6 +256,8 @@ def run_gcg(params):
         **policy_params,
         **params['policy']
     )
+    if params['policy'].get('profile_on_signal', False):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: policy.profile_next())
 
     ########################
     ### Create algorithm ###
@@ -0,0 +1,71 @@
+import numpy as np
+
+from rllab.spaces.box import Box
+
+class BatchCarEnvExecutor(object):
+    """
+    Same interface as VecEnvExecutor, for envs that step all their cars together with
+    step_cars(actions) -> rewards, dones, env_infos and reset_cars(indices) -> observations of all cars
+    """
+    def __init__(self, env, max_path_length, normalized_env=None):
+        """
+        :param normalized_env: NormalizedEnv wrapping env (if any), applied to each car as to a single env
+        """
+        self._env = env
+        self._normalized_env = normalized_env
+        self.ts = np.zeros(env.num_cars, dtype='int')
+        self.max_path_length = max_path_length
+
+    def _normalize_actions(self, action_n):
+        if self._normalized_env is None or not isinstance(self._env.action_space, Box):
+            return action_n
+        lb, ub = self._env.action_space.bounds
+        return [np.clip(lb + (action + 1.) * 0.5 * (ub - lb), lb, ub) for action in action_n]
+
+    def _normalize_observations(self, obs):
+        if self._normalized_env is None or not self._normalized_env._normalize_obs:
+            return obs
+        return [self._normalized_env._apply_normalize_obs(o) for o in obs]
+
+    def _normalize_rewards(self, rewards):
+        if self._normalized_env is None:
+            return rewards
+        if self._normalized_env._normalize_reward:
+            rewards = [self._normalized_env._apply_normalize_reward(r) for r in rewards]
+        return [r * self._normalized_env._scale_reward for r in rewards]
+
+    def step(self, action_n):
+        rewards, dones, env_infos = self._env.step_cars(self._normalize_actions(action_n))
+        dones = np.asarray(dones)
+        rewards = np.asarray(self._normalize_rewards(rewards))
+        self.ts += 1
+        if self.max_path_length is not None:
+            dones[self.ts >= self.max_path_length] = True
+        obs = self._normalize_observations(self._env.reset_cars(np.where(dones)[0]))
+        self.ts[dones] = 0
+        return obs, rewards, dones, env_infos
+
+    def reset(self):
+        self.ts[:] = 0
+        return self._normalize_observations(self._env.reset_cars(range(self.num_envs)))
+
+    @property
+    def num_envs(self):
+        return self._env.num_cars
+
+    @property
+    def action_space(self):
+        if self._normalized_env is not None:
+            return self._normalized_env.action_space
+        return self._env.action_space
+
+    @property
+    def observation_space(self):
+        return self._env.observation_space
+
+    def terminate(self):
+        pass
+
+    @property
+    def current_episode_steps(self):
+        return np.copy(self.ts)
@@ -7,9 +7,14 @@ from rllab.envs.normalized_env import normalize
 def create_env(env_str, is_normalize=True, seed=None):
     from rllab.envs.gym_env import GymEnv, FixedIntervalVideoSchedule
 
-    from sandbox.gkahn.gcg.envs.rccar.square_env import SquareEnv
-    from sandbox.gkahn.gcg.envs.rccar.square_cluttered_env import SquareClutteredEnv
-    from sandbox.gkahn.gcg.envs.rccar.cylinder_env import CylinderEnv
+    from sandbox.gkahn.gcg.envs.kinematic_car_env import KinematicCarEnv
+    try:
+        from sandbox.gkahn.gcg.envs.rccar.square_env import SquareEnv
+        from sandbox.gkahn.gcg.envs.rccar.square_cluttered_env import SquareClutteredEnv
+        from sandbox.gkahn.gcg.envs.rccar.cylinder_env import CylinderEnv
+        from sandbox.gkahn.gcg.envs.rccar.batch_car_env import BatchCarEnv
+    except ImportError:
+        pass # no panda3d (e.g. in CI), only KinematicCarEnv
 
     inner_env = eval(env_str)
     if is_normalize:
@@ -0,0 +1,369 @@
+import os
+import re
+
+import numpy as np
+
+from rllab.spaces.box import Box
+
+from sandbox.gkahn.gcg.envs.batch_env_executor import BatchCarEnvExecutor
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rccar', 'models')
+
+##################
+### Obstacles ###
+##################
+
+def egg_obstacle_segments(model_path, min_height=0.02, max_height=0.5):
+    """
+    Reads the collision polygons of an egg (as loaded by CarEnv) and keeps those within the height of the car
+
+    :return: [num_segments, 2, 2] 2-D edges of the kept polygons
+    """
+    with open(model_path, 'r') as f:
+        egg = f.read()
+    # the collision groups of the rccar eggs each have a vertex pool of the same name
+    collide_names = set(re.findall(r'<Group>\s+(\S+)\s*\{\s*<Collide>', egg))
+
+    pools = dict()
+    for match in re.finditer(r'<VertexPool>\s+(\S+)\s*\{', egg):
+        ends = [egg.find(tag, match.end()) for tag in ('<Polygon>', '<VertexPool>')]
+        end = min([e for e in ends if e != -1] + [len(egg)])
+        vertices = re.findall(r'<Vertex>\s+(\d+)\s*\{\s*([-\d.eE+]+)\s+([-\d.eE+]+)\s+([-\d.eE+]+)',
+                              egg[match.end():end])
+        pools[match.group(1)] = dict([(int(v[0]), [float(x) for x in v[1:]]) for v in vertices])
+
+    segments = []
+    for indices, name in re.findall(r'<VertexRef>\s*\{([\d\s]+)<Ref>\s*\{\s*(\S+)\s*\}', egg):
+        if name not in collide_names:
+            continue
+        polygon = np.array([pools[name][int(i)] for i in indices.split()])
+        if polygon[:, 2].max() < min_height or polygon[:, 2].min() > max_height:
+            continue # ground, ceiling, or above the car (e.g. table tops)
+        for start, end in zip(polygon, np.roll(polygon, -1, axis=0)):
+            segments.append([start[:2], end[:2]])
+    return np.array(segments)
+
+class ObstacleMap(object):
+    """ Occupancy grid of 2-D obstacle segments, outside of the grid is free """
+    def __init__(self, segments, resolution):
+        self._resolution = resolution
+        points = segments.reshape((-1, 2))
+        self._origin = points.min(axis=0) - 2 * resolution
+        shape = np.ceil((points.max(axis=0) + 2 * resolution - self._origin) / resolution).astype(int) + 1
+        self._grid = np.zeros(shape, dtype=bool)
+
+        ### rasterize points every half cell along each segment
+        lengths = np.linalg.norm(segments[:, 1] - segments[:, 0], axis=1)
+        num_points = np.ceil(2. * lengths / resolution).astype(int) + 1
+        fractions = np.concatenate([np.linspace(0., 1., n) for n in num_points])
+        starts = np.repeat(segments[:, 0], num_points, axis=0)
+        ends = np.repeat(segments[:, 1], num_points, axis=0)
+        cells = self._cells(starts + fractions[:, np.newaxis] * (ends - starts))
+        self._grid[cells[:, 0], cells[:, 1]] = True
+
+        ### dilate by one cell, so rays marching in half cells cannot cut through diagonal walls
+        grid = self._grid.copy()
+        grid[1:] |= self._grid[:-1]
+        grid[:-1] |= self._grid[1:]
+        grid[:, 1:] |= self._grid[:, :-1]
+        grid[:, :-1] |= self._grid[:, 1:]
+        self._grid = grid
+
+    def _cells(self, points):
+        return np.floor((points - self._origin) / self._resolution).astype(int)
+
+    def occupied(self, points):
+        """
+        :param points: [..., 2]
+        :return: [...]
+        """
+        cells = self._cells(points)
+        inside = np.all((cells >= 0) & (cells < self._grid.shape), axis=-1)
+        cells = np.clip(cells, 0, np.array(self._grid.shape) - 1)
+        return inside & self._grid[cells[..., 0], cells[..., 1]]
+
+    def raycast(self, origins, directions, max_dist):
+        """
+        :param origins: [B, 2]
+        :param directions: [B, R, 2] unit vectors
+        :return: [B, R] distance to the first obstacle (max_dist if none)
+        """
+        dists = 0.5 * self._resolution * np.arange(1, int(2. * max_dist / self._resolution) + 1)
+        points = origins[:, np.newaxis, np.newaxis, :] + \
+                 dists[np.newaxis, np.newaxis, :, np.newaxis] * directions[:, :, np.newaxis, :]
+        hits = self.occupied(points)
+        return np.where(hits.any(axis=2), dists[np.argmax(hits, axis=2)], max_dist)
+
+###########
+### Env ###
+###########
+
+class KinematicCarEnv(object):
+    """
+    Pure numpy stand-in for CylinderEnv / SquareEnv / SquareClutteredEnv: a kinematic bicycle model car in the
+    2-D obstacle map of the same egg, with the same action space, rewards, dones and restart positions.
+
+    The camera is a raycast per image column against the map; each pixel sees the ground or the first obstacle
+    (treated as taller than the view) of its column, shaded by distance. This keeps the observation shape and
+    geometry of the real camera, not its appearance.
+
+    num_cars cars are simulated together (they do not collide with each other); with more than one car, step
+    through vec_env_executor like BatchCarEnv.
+    """
+    def __init__(self, params={}):
+        self._params = params
+        if 'random_seed' in params:
+            self._rng = np.random.RandomState(params['random_seed'])
+        else:
+            self._rng = np.random.RandomState(np.random.randint(2**31))
+        self._num_cars = params.get('num_cars', 1)
+        self._layout = params.get('layout', 'square_cluttered') # <cylinder/square/square_cluttered>
+        assert(self._layout in ('cylinder', 'square', 'square_cluttered'))
+        self._obs_mode = params.get('obs_mode', 'default') # <default/raycast>
+        assert(self._obs_mode in ('default', 'raycast'))
+        self._use_depth = params.get('use_depth', False)
+        self._collision_reward = params.get('collision_reward', 0.)
+        self._collision_reward_only = params.get('collision_reward_only', False)
+        self._steer_limits = params.get('steer_limits', [-30., 30.])
+        self._speed_limits = params.get('speed_limits', [2., 2.])
+        assert(self._speed_limits[0] == self._speed_limits[1])
+
+        ### layout (as in the panda3d envs)
+        if self._layout == 'cylinder':
+            self._do_back_up = params.get('do_back_up', False)
+            self._default_pos_hpr = [0.0, -6., 0.25, 0.0, 0.0, 3.14]
+            ran = np.linspace(-3.5, 3.5, 20)
+            self._rng.shuffle(ran)
+            default_restart_pos = [[val, -6.0, 0.25, 0.0, 0.0, 3.14] for val in ran]
+            self._goal_y = 6.0
+            self._horizon = 24
+        else:
+            self._do_back_up = params.get('do_back_up', True)
+            self._default_pos_hpr = [20.0, -19., 0.25, 0.0, 0.0, 3.14]
+            default_restart_pos = [
+                [ 20., -20., 0.3, 0.0, 0.0, 3.14],
+                [-20., -20., 0.3, 0.0, 0.0, 3.14],
+                [ 20.,  15., 0.3, 0.0, 0.0, 3.14],
+                [-20.,  15., 0.3, 0.0, 0.0, 3.14]
+            ]
+            self._goal_y = None
+            self._horizon = int(1e3)
+        self._restart_pos = params.get('positions', None) or default_restart_pos
+        self._back_up_params = params.get('back_up', {'steer': [-5., 5.], 'vel': -1., 'duration': 3.})
+        model_path = params.get('model_path', os.path.join(MODELS_DIR, '{0}.egg'.format(self._layout)))
+        self._map = ObstacleMap(egg_obstacle_segments(model_path), params.get('map_resolution', 0.1))
+
+        ### car
+        self._dt = params.get('dt', 0.25)
+        self._step = 0.05
+        self._p = params.get('p', 1.25)
+        self._accel_clamp = params.get('accelClamp', 2.0)
+        self._wheelbase = 1.0 # front and rear wheels at +-0.5
+        half_width, half_length = 0.6, 1.0 # as the Bullet chassis box
+        footprint = np.meshgrid(np.linspace(-half_width, half_width, 5), np.linspace(-half_length, half_length, 9))
+        self._footprint = np.stack([f.ravel() for f in footprint], axis=1) # [P, 2] (right, forward)
+
+        ### camera (as mounted on the panda3d car)
+        self._obs_shape = params.get('obs_shape', (64, 36))
+        hfov = np.deg2rad(params.get('hfov', 60))
+        near_far = params.get('near_far', [0.1, 100.])
+        self._camera_offset = 0.5 # forward
+        camera_height = 0.375
+        pitch = -np.arctan2(camera_height, 6.0 - self._camera_offset) # looks at (0, 6, 0)
+        if self._obs_mode == 'raycast':
+            raycast_params = params.get('raycast', {})
+            width, height = raycast_params.get('num_rays', 64), 1
+            self._max_dist = raycast_params.get('max_dist', near_far[1])
+            self._yaws = np.deg2rad(np.linspace(-0.5, 0.5, width) * np.rad2deg(hfov))
+        else:
+            width, height = self._obs_shape
+            self._max_dist = params.get('max_dist', 30.)
+            focal = 0.5 * width / np.tan(0.5 * hfov)
+            u = np.arange(width) + 0.5 - 0.5 * width # right
+            v = 0.5 * height - (np.arange(height) + 0.5) # up
+            self._yaws = np.arctan(u / focal)
+            elevations = pitch + np.arctan(v[:, np.newaxis] / np.sqrt(focal ** 2 + u[np.newaxis, :] ** 2)) # [H, W]
+            self._cos_elevations = np.cos(elevations)
+            with np.errstate(divide='ignore'):
+                self._ground_dists = np.where(elevations < 0, camera_height / np.tan(-elevations), np.inf)
+            self._ground_gray = params.get('ground_gray', 64)
+
+        ### spaces
+        self.action_space = Box(low=np.array([-1., 1.]), high=np.array([1., 1.]))
+        self._unnormalized_action_space = Box(low=np.array([self._steer_limits[0], self._speed_limits[0]]),
+                                              high=np.array([self._steer_limits[1], self._speed_limits[1]]))
+
+        ### state of all cars
+        self._pos = np.zeros((self._num_cars, 2))
+        self._heading = np.zeros(self._num_cars) # radians, 0 is +y
+        self._vel = np.zeros(self._num_cars)
+        self._des_vel = np.zeros(self._num_cars)
+        self._steering = np.zeros(self._num_cars) # degrees
+        self._collision = np.zeros(self._num_cars, dtype=bool)
+        self._restart_index = np.arange(self._num_cars) % len(self._restart_pos)
+        self._place_cars(np.arange(self._num_cars), [self._default_pos_hpr] * self._num_cars)
+
+        self.observation_space = Box(low=0, high=255, shape=self._get_observations().shape[1:])
+
+    @property
+    def horizon(self):
+        return self._horizon
+
+    @property
+    def num_cars(self):
+        return self._num_cars
+
+    def vec_env_executor(self, n_envs, max_path_length, normalized_env=None):
+        assert(n_envs == self._num_cars)
+        return BatchCarEnvExecutor(self, max_path_length, normalized_env=normalized_env)
+
+    ###############
+    ### Physics ###
+    ###############
+
+    def _forward(self, indices=slice(None)):
+        return np.stack([-np.sin(self._heading[indices]), np.cos(self._heading[indices])], axis=-1)
+
+    def _right(self, indices=slice(None)):
+        return np.stack([np.cos(self._heading[indices]), np.sin(self._heading[indices])], axis=-1)
+
+    def _simulate(self, duration, indices):
+        """ Bicycle model with the velocity controller of CarEnv, for the cars at indices """
+        for _ in range(int(round(duration / self._step))):
+            err = self._des_vel[indices] - self._vel[indices]
+            self._vel[indices] += np.clip(self._p * err, -self._accel_clamp, self._accel_clamp) * self._step
+            self._heading[indices] += self._vel[indices] * np.tan(np.deg2rad(self._steering[indices])) * \
+                                      self._step / self._wheelbase
+            self._pos[indices] += (self._vel[indices] * self._step)[:, np.newaxis] * self._forward(indices)
+
+    def _is_contact(self):
+        points = self._pos[:, np.newaxis, :] + \
+                 self._footprint[np.newaxis, :, 0:1] * self._right()[:, np.newaxis, :] + \
+                 self._footprint[np.newaxis, :, 1:2] * self._forward()[:, np.newaxis, :]
+        return self._map.occupied(points).any(axis=1)
+
+    def _place_cars(self, indices, pos_hprs):
+        for i, pos_hpr in zip(indices, pos_hprs):
+            self._pos[i] = pos_hpr[:2]
+            self._heading[i] = np.deg2rad(pos_hpr[3])
+        self._vel[indices] = 0.
+        self._des_vel[indices] = 0.
+        self._steering[indices] = 0.
+
+    def _back_up(self, indices):
+        self._des_vel[indices] = self._back_up_params.get('vel', -2.0)
+        self._steering[indices] = self._rng.uniform(*self._back_up_params.get('steer', (-5.0, 5.0)),
+                                                    size=len(indices))
+        duration = self._back_up_params.get('duration', 1.0)
+        self._simulate(duration, indices)
+        self._des_vel[indices] = 0.
+        self._steering[indices] = 0.
+        self._simulate(duration, indices)
+
+    ###################
+    ### Observation ###
+    ###################
+
+    def _get_observations(self):
+        """
+        :return: [num_cars] + observation shape of CylinderEnv (grayscale, depth or raycast distances)
+        """
+        camera_pos = self._pos + self._camera_offset * self._forward()
+        directions = np.cos(self._yaws)[np.newaxis, :, np.newaxis] * self._forward()[:, np.newaxis, :] + \
+                     np.sin(self._yaws)[np.newaxis, :, np.newaxis] * self._right()[:, np.newaxis, :]
+        dists = self._map.raycast(camera_pos, directions, self._max_dist) # [B, W]
+
+        if self._obs_mode == 'raycast':
+            return (255. * dists / self._max_dist).astype(np.uint8)[:, np.newaxis, :, np.newaxis]
+
+        dists = dists[:, np.newaxis, :] # [B, 1, W]
+        hits_ground = self._ground_dists[np.newaxis] < dists
+        ranges = np.minimum(dists, self._ground_dists[np.newaxis]) / self._cos_elevations[np.newaxis]
+        ranges = np.minimum(ranges, self._max_dist)
+        if self._use_depth:
+            return (255. * ranges / self._max_dist).astype(np.uint8)
+        hits_obstacle = np.logical_not(hits_ground) & (dists < self._max_dist)
+        gray = np.where(hits_ground, self._ground_gray,
+                        np.where(hits_obstacle, 255. * (1. - 0.8 * ranges / self._max_dist), 0.))
+        return gray.astype(np.uint8)[..., np.newaxis]
+
+    ###############
+    ### Batched ###
+    ###############
+
+    def reset_cars(self, indices):
+        """
+        :return: observations of all cars
+        """
+        indices = np.asarray(indices, dtype=int)
+        if self._do_back_up:
+            back_up = indices[self._collision[indices]]
+            if len(back_up) > 0:
+                self._back_up(back_up)
+        else:
+            pos_hprs = []
+            for i in indices:
+                pos_hprs.append(self._restart_pos[self._restart_index[i]])
+                self._restart_index[i] = (self._restart_index[i] + 1) % len(self._restart_pos)
+            self._place_cars(indices, pos_hprs)
+        self._collision[indices] = False
+        return self._get_observations()
+
+    def step_cars(self, actions):
+        """
+        Steps all cars together, without observing
+
+        :return: rewards, dones, env_infos
+        """
+        lb, ub = self._unnormalized_action_space.bounds
+        actions = np.reshape(actions, (self._num_cars, 2))
+        scaled_actions = np.clip(lb + (actions + 1.) * 0.5 * (ub - lb), lb, ub)
+        self._steering[:] = scaled_actions[:, 0]
+        self._des_vel[:] = self._speed_limits[0]
+        self._simulate(self._dt, slice(None))
+        self._collision = self._is_contact()
+
+        rewards = np.where(self._collision, self._collision_reward, 0. if self._collision_reward_only else self._vel)
+        dones = self._collision.copy()
+        before_goal = np.ones(self._num_cars, dtype=bool)
+        if self._goal_y is not None:
+            before_goal = self._pos[:, 1] < self._goal_y
+            dones |= np.logical_not(before_goal)
+        env_infos = [{
+            'pos': np.array([self._pos[i, 0], self._pos[i, 1], 0.25]),
+            'hpr': np.array([np.rad2deg(self._heading[i]), 0., 0.]),
+            'vel': self._vel[i],
+            'coll': self._collision[i] and before_goal[i]
+        } for i in range(self._num_cars)]
+        return list(rewards), list(dones), env_infos
+
+    ##############
+    ### Single ###
+    ##############
+
+    def reset(self):
+        return self.reset_cars(range(self._num_cars))[0]
+
+    def step(self, action):
+        assert(self._num_cars == 1) # use vec_env_executor to step several cars together
+        rewards, dones, env_infos = self.step_cars([action])
+        return self._get_observations()[0], rewards[0], dones[0], env_infos[0]
+
+if __name__ == '__main__':
+    import time
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--layout', type=str, default='square_cluttered')
+    parser.add_argument('--num_cars', type=int, default=64)
+    parser.add_argument('--steps', type=int, default=200)
+    args = parser.parse_args()
+
+    env = KinematicCarEnv(params={'layout': args.layout, 'num_cars': args.num_cars, 'hfov': 120})
+    executor = env.vec_env_executor(args.num_cars, env.horizon)
+    executor.reset()
+    start = time.time()
+    for _ in range(args.steps):
+        executor.step([env.action_space.sample() for _ in range(args.num_cars)])
+    elapsed = time.time() - start
+    print('{0} cars: {1:.0f} car steps / sec'.format(args.num_cars, args.num_cars * args.steps / elapsed))
@@ -0,0 +1,127 @@
+import copy
+import numpy as np
+
+from panda3d.core import PythonCallbackObject
+
+from sandbox.gkahn.gcg.envs.batch_env_executor import BatchCarEnvExecutor
+
+class BatchCarEnv(object):
+    """
+    num_cars cars of env_class in one Bullet world with one loaded scene. The cars do not collide with each other,
+    their cameras share one graphics engine, so all observations come from a single render per step.
+
+    The spaces are those of one car; reset and step act on all cars (e.g. step(actions[num_cars]) returns
+    observations[num_cars]). The sampler steps through vec_env_executor, which also resets the done cars.
+    """
+    def __init__(self, env_class, num_cars, params={}):
+        assert(not params.get('do_back_up', False)) # backing up one car would also move the others
+        self._cars = []
+        shared_world = None
+        for i in range(num_cars):
+            car_params = copy.deepcopy(params)
+            car_params['car_index'] = i
+            car_params['shared_world'] = shared_world
+            car = env_class(params=car_params)
+            car._render_observation = False
+            shared_world = car.shared_world
+            self._cars.append(car)
+        self._graphics_engine = shared_world['graphics_engine']
+        self._world = shared_world['world']
+        self._controller = self._cars[0]._controller
+        self._tick_controller = False
+        if self._controller == 'tick':
+            self._world.setTickCallback(PythonCallbackObject(self._tick_callback), True)
+
+        self.action_space = self._cars[0].action_space
+        self.observation_space = self._cars[0].observation_space
+
+    @property
+    def horizon(self):
+        return self._cars[0].horizon
+
+    @property
+    def num_cars(self):
+        return len(self._cars)
+
+    def vec_env_executor(self, n_envs, max_path_length, normalized_env=None):
+        assert(n_envs == self.num_cars)
+        return BatchCarEnvExecutor(self, max_path_length, normalized_env=normalized_env)
+
+    #################
+    ### All cars ###
+    #################
+
+    def reset(self):
+        """
+        :return: observations of all cars
+        """
+        return self.reset_cars(range(self.num_cars))
+
+    def step(self, actions):
+        """
+        Steps all cars together and observes them with one render
+
+        :param actions: one action per car
+        :return: observations, rewards, dones, env_infos of all cars
+        """
+        rewards, dones, env_infos = self.step_cars(actions)
+        return self._observations(), rewards, dones, env_infos
+
+    ###############
+    ### Batched ###
+    ###############
+
+    def _tick_callback(self, callback_data):
+        if self._tick_controller:
+            for car in self._cars:
+                car._apply_engine_force()
+
+    def _render(self):
+        if self._graphics_engine is None:
+            return
+        self._graphics_engine.renderFrame()
+        self._graphics_engine.syncFrame()
+
+    def _observations(self):
+        self._render()
+        return [car._get_observation() for car in self._cars]
+
+    def reset_cars(self, indices):
+        """
+        :return: observations of all cars
+        """
+        for i in indices:
+            self._cars[i]._reset()
+        return self._observations()
+
+    def step_cars(self, actions):
+        """
+        Steps the physics of all cars together, without observing
+
+        :return: rewards, dones, env_infos
+        """
+        car0 = self._cars[0]
+        for car, action in zip(self._cars, actions):
+            car._set_action(action)
+            car._apply_steering_brake()
+        num_steps = int(round(car0._dt / car0._step))
+        if self._controller == 'loop':
+            for _ in range(num_steps):
+                for car in self._cars:
+                    car._apply_engine_force()
+                self._world.doPhysics(car0._step, 1, car0._step)
+        else:
+            if self._controller == 'hold':
+                for car in self._cars:
+                    car._apply_engine_force()
+            self._tick_controller = (self._controller == 'tick')
+            self._world.doPhysics(num_steps * car0._step, num_steps, car0._step)
+            self._tick_controller = False
+
+        rewards, dones, env_infos = [], [], []
+        for car in self._cars:
+            car._collision = car._is_contact()
+            rewards.append(car._get_reward())
+            dones.append(car._get_done())
+            env_infos.append(car._get_step_info())
+        return rewards, dones, env_infos
@@ -0,0 +1,289 @@
+"""
+Times the rccar environments for each observation mode
+
+    python benchmark_envs.py --env SquareClutteredEnv --obs_modes default fast raycast --steps 500
+
+and compares the trajectories and step times of the velocity controllers on the same actions
+
+    python benchmark_envs.py --env SquareClutteredEnv --controllers loop tick hold --steps 500
+
+tick runs the same controller as loop (per substep, before each bullet tick), so it should reproduce the loop
+trajectory up to floating point; hold computes the engine force once per step, so its trajectory differs.
+
+and breaks the time of random steps down into stages (physics, render, readback, preprocess, collision, reset),
+for each env, camera size and hfov, into a csv
+
+    python benchmark_envs.py --envs CylinderEnv SquareEnv SquareClutteredEnv --sizes 160x90 320x180 --hfovs 60 120 \
+        --steps 500 --csv env_stages.csv
+
+e.g. with --env_params "{'merge_static': True, 'collision_check': 'manifold'}" to compare the collision stage.
+Physics includes the velocity controller, also when run from the tick callback (--env_params "{'controller': 'tick'}").
+
+Each run is in its own process, because every env attaches its scene to the global panda3d render.
+"""
+import argparse
+import collections
+import csv
+import multiprocessing
+import time
+from queue import Empty
+
+import numpy as np
+
+def _create_env(env_name, obs_mode, controller='loop', **params):
+    from sandbox.gkahn.gcg.envs.rccar.square_env import SquareEnv
+    from sandbox.gkahn.gcg.envs.rccar.square_cluttered_env import SquareClutteredEnv
+    from sandbox.gkahn.gcg.envs.rccar.cylinder_env import CylinderEnv
+
+    env_class = {
+        'SquareEnv': SquareEnv,
+        'SquareClutteredEnv': SquareClutteredEnv,
+        'CylinderEnv': CylinderEnv
+    }[env_name]
+    env_params = {'hfov': 120, 'do_back_up': False, 'speed_limits': [2., 2.], 'obs_mode': obs_mode,
+                  'controller': controller}
+    env_params.update(params)
+    return env_class(params=env_params)
+
+def _run_process(target, args, queue, timeout=600.):
+    """
+    Runs target(*args) in its own process
+
+    :return: what it put on queue
+    """
+    p = multiprocessing.Process(target=target, args=args)
+    p.start()
+    name = '{0}{1}'.format(target.__name__, tuple(a for a in args if a is not queue))
+    start = time.time()
+    while True:
+        try:
+            result = queue.get(timeout=1.)
+            break
+        except Empty:
+            # e.g. panda3d failed to open a window
+            if not p.is_alive():
+                raise RuntimeError('{0} exited with code {1}'.format(name, p.exitcode))
+            if time.time() - start > timeout:
+                p.terminate()
+                raise RuntimeError('{0} timed out after {1} s'.format(name, timeout))
+    p.join()
+    return result
+
+def _time(fn, num):
+    start = time.time()
+    for _ in range(num):
+        fn()
+    return 1e3 * (time.time() - start) / float(num)
+
+def benchmark(env_name, obs_mode, steps, queue):
+    from sandbox.gkahn.gcg.envs.rccar.cylinder_env import CylinderEnv
+
+    start = time.time()
+    env = _create_env(env_name, obs_mode) # the first run also fills the scene cache
+    create_ms = 1e3 * (time.time() - start)
+    env.reset()
+    sensor = env._camera_sensor
+
+    ### preprocessing only (the image was already rendered)
+    if obs_mode == 'raycast':
+        preprocess = env._get_observation_raycast # no rendering
+    elif obs_mode == 'fast':
+        sensor.render()
+        preprocess = lambda: np.expand_dims(sensor.read_gray(), 2)
+    else:
+        sensor.render()
+        def preprocess():
+            data = sensor.color_tex.getRamImageAs('RGBA')
+            image = np.frombuffer(data, np.uint8).reshape((sensor.color_tex.getYSize(), sensor.color_tex.getXSize(), 4))
+            image = np.flipud(image)[..., :-1]
+            return CylinderEnv.process_image(image, env._obs_shape)
+    preprocess_ms = _time(preprocess, steps)
+
+    ### render and preprocess
+    observation_ms = _time(env._get_observation, steps)
+
+    ### full steps
+    def step():
+        _, _, done, _ = env.step(env.action_space.sample())
+        if done:
+            env.reset()
+    step_ms = _time(step, steps)
+
+    queue.put((obs_mode, create_ms, preprocess_ms, observation_ms, step_ms, env._get_observation().shape))
+
+def trajectory(env_name, controller, steps, queue, state=None):
+    """
+    :param state: get_state to start from (None to reset, and the start state is also returned)
+    """
+    env = _create_env(env_name, 'raycast', controller=controller)
+    if state is None:
+        env.reset()
+        state = env.get_state()
+    else:
+        env.reset(state=state)
+    rng = np.random.RandomState(0)
+    positions = []
+    start = time.time()
+    for _ in range(steps):
+        _, _, done, info = env.step(rng.uniform(-1., 1., size=2))
+        positions.append(info['pos'])
+        if done:
+            break
+    step_ms = 1e3 * (time.time() - start) / float(len(positions))
+    queue.put((controller, np.array(positions), step_ms, state))
+
+def compare_controllers(env_name, controllers, steps, tol=1e-3):
+    """
+    Runs each controller on the same actions from the start state of the first one
+
+    :return: True if tick matches loop within tol (if both were run)
+    """
+    queue = multiprocessing.Queue()
+    results = []
+    state = None
+    for controller in controllers:
+        results.append(_run_process(trajectory, (env_name, controller, steps, queue, state), queue))
+        state = results[0][3]
+
+    _, positions_ref, _, _ = results[0]
+    print('{0:>10s} {1:>10s} {2:>15s} {3:>15s}'.format('controller', 'step (ms)', 'max pos err', 'mean pos err'))
+    errs = dict()
+    for controller, positions, step_ms, _ in results:
+        T = min(len(positions), len(positions_ref))
+        err = np.linalg.norm(positions[:T] - positions_ref[:T], axis=1)
+        errs[controller] = err.max()
+        print('{0:>10s} {1:>10.3f} {2:>15.5f} {3:>15.5f}'.format(controller, step_ms, err.max(), err.mean()))
+
+    if controllers[0] == 'loop' and 'tick' in errs:
+        return errs['tick'] < tol
+    return True
+
+class StageTimer(object):
+    """
+    Time spent in wrapped functions per stage, exclusive of the stages called inside them. Inside an inclusive
+    stage (e.g. reset, which also backs up and observes) nothing else is timed.
+    """
+    def __init__(self, inclusive_stages=()):
+        self.times = collections.defaultdict(float)
+        self._inclusive_stages = inclusive_stages
+        self._stack = [] # [stage, start time, time in nested stages]
+
+    def wrap(self, stage, fn):
+        def timed(*args, **kwargs):
+            if len(self._stack) > 0 and self._stack[-1][0] in self._inclusive_stages:
+                return fn(*args, **kwargs)
+            self._stack.append([stage, time.time(), 0.])
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _, start, nested = self._stack.pop()
+                elapsed = time.time() - start
+                self.times[stage] += elapsed - nested
+                if len(self._stack) > 0:
+                    self._stack[-1][2] += elapsed
+        return timed
+
+STAGES = ('physics', 'render', 'readback', 'preprocess', 'collision', 'reset')
+
+def profile_stages(env_name, obs_mode, size, hfov, steps, queue, env_params={}):
+    from sandbox.gkahn.gcg.envs.rccar.cylinder_env import CylinderEnv
+
+    params = {'size': list(size), 'hfov': hfov, 'do_back_up': env_name != 'CylinderEnv'}
+    params.update(env_params)
+    env = _create_env(env_name, obs_mode, **params)
+
+    ### wrap each stage (this process only has this env, so the class can be patched too)
+    timer = StageTimer(inclusive_stages=('reset',))
+    env._update = timer.wrap('physics', env._update)
+    env._physics_steps = timer.wrap('physics', env._physics_steps)
+    if env._controller == 'tick' and env._car_index is None:
+        # the tick callback was bound when the env was created
+        from panda3d.core import PythonCallbackObject
+        env._world.setTickCallback(PythonCallbackObject(timer.wrap('physics', env._tick_callback)), True)
+    env._render = timer.wrap('render', env._render)
+    env._is_contact = timer.wrap('collision', env._is_contact)
+    env.reset = timer.wrap('reset', env.reset)
+    if obs_mode == 'raycast':
+        env._get_observation_raycast = timer.wrap('readback', env._get_observation_raycast)
+    else:
+        for sensor in (env._camera_sensor, getattr(env, '_back_camera_sensor', None)):
+            if sensor is not None:
+                sensor.read = timer.wrap('readback', sensor.read)
+                sensor.read_gray = timer.wrap('readback', sensor.read_gray)
+    CylinderEnv.process_image = staticmethod(timer.wrap('preprocess', CylinderEnv.process_image))
+    CylinderEnv.process_depth = staticmethod(timer.wrap('preprocess', CylinderEnv.process_depth))
+
+    env.reset()
+    timer.times.clear()
+    start = time.time()
+    for _ in range(steps):
+        _, _, done, _ = env.step(env.action_space.sample())
+        if done:
+            env.reset()
+    elapsed = time.time() - start
+
+    row = collections.OrderedDict([
+        ('env', env_name),
+        ('obs_mode', obs_mode),
+        ('size', '{0}x{1}'.format(*size)),
+        ('hfov', hfov),
+        ('env_params', str(env_params)),
+        ('steps_per_sec', steps / elapsed)
+    ])
+    for stage in STAGES:
+        row[stage + '_ms'] = 1e3 * timer.times[stage] / float(steps)
+    row['other_ms'] = 1e3 * (elapsed - sum(timer.times.values())) / float(steps)
+    queue.put(row)
+
+def profile_all(env_names, obs_modes, sizes, hfovs, steps, csv_fname, env_params={}):
+    queue = multiprocessing.Queue()
+    rows = []
+    for env_name in env_names:
+        for obs_mode in obs_modes:
+            for size in sizes:
+                for hfov in hfovs:
+                    rows.append(_run_process(profile_stages,
+                                             (env_name, obs_mode, size, hfov, steps, queue, env_params), queue))
+                    print(', '.join(['{0}: {1:.3f}'.format(k, v) if isinstance(v, float) else '{0}: {1}'.format(k, v)
+                                     for k, v in rows[-1].items()]))
+
+    with open(csv_fname, 'w') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--env', type=str, default='SquareClutteredEnv')
+    parser.add_argument('--envs', nargs='+', default=['CylinderEnv', 'SquareEnv', 'SquareClutteredEnv'],
+                        help='for --csv')
+    parser.add_argument('--sizes', nargs='+', default=['160x90'], help='camera sizes for --csv')
+    parser.add_argument('--hfovs', nargs='+', type=float, default=[120.], help='for --csv')
+    parser.add_argument('--csv', type=str, default=None, help='write the stage breakdown here')
+    parser.add_argument('--env_params', type=str, default='{}', help='extra env params for --csv, as a dict')
+    parser.add_argument('--obs_modes', nargs='+', default=['default', 'fast', 'raycast'])
+    parser.add_argument('--controllers', nargs='+', default=None, help='compare these (the first is the reference)')
+    parser.add_argument('--steps', type=int, default=500)
+    args = parser.parse_args()
+
+    if args.csv is not None:
+        sizes = [tuple(int(x) for x in size.split('x')) for size in args.sizes]
+        profile_all(args.envs, args.obs_modes, sizes, args.hfovs, args.steps, args.csv,
+                    env_params=eval(args.env_params))
+        exit(0)
+
+    if args.controllers is not None:
+        if not compare_controllers(args.env, args.controllers, args.steps):
+            raise ValueError('tick controller does not reproduce the loop trajectory')
+        exit(0)
+
+    queue = multiprocessing.Queue()
+    results = []
+    for obs_mode in args.obs_modes:
+        results.append(_run_process(benchmark, (args.env, obs_mode, args.steps, queue), queue))
+
+    print('{0:>10s} {1:>12s} {2:>15s} {3:>15s} {4:>10s} {5:>15s}'.format('obs_mode', 'create (ms)', 'preprocess (ms)',
+                                                                         'observation (ms)', 'step (ms)', 'obs shape'))
+    for obs_mode, create_ms, preprocess_ms, observation_ms, step_ms, shape in results:
+        print('{0:>10s} {1:>12.1f} {2:>15.3f} {3:>15.3f} {4:>10.3f} {5:>15s}'.format(obs_mode, create_ms, preprocess_ms,
+                                                                                 observation_ms, step_ms, str(shape)))
@@ -1,4 +1,7 @@
+import os
 import time
+import hashlib
+import collections
 import numpy as np
 import sys
 from sandbox.gkahn.gcg.envs.rccar.panda3d_camera_sensor import Panda3dCameraSensor
@@ -12,6 +15,10 @@ from panda3d.core import Vec4
 from panda3d.core import Point3
 from panda3d.core import TransformState
 from panda3d.core import BitMask32
+from panda3d.core import PythonCallbackObject
+from panda3d.core import PandaSystem
+from panda3d.core import Filename
+from panda3d.core import NodePath
 from panda3d.bullet import BulletWorld
 from panda3d.bullet import BulletBoxShape
 from panda3d.bullet import BulletPlaneShape
@@ -24,16 +31,39 @@ from panda3d.bullet import ZUp
 class CarEnv(DirectObject):
     def __init__(self, params={}):
         self._params = params
+        # all randomness of the env (restart positions, back-up noise) comes from here, so it is reproducible
         if 'random_seed' in self._params:
+            # as before, the seed also seeds the global numpy state
             np.random.seed(self._params['random_seed'])
+            self._rng = np.random.RandomState(self._params['random_seed'])
+        else:
+            self._rng = np.random.RandomState(np.random.randint(2**31))
         self._use_vel = self._params.get('use_vel', True)
         self._run_as_task = self._params.get('run_as_task', False)
         self._do_back_up = self._params.get('do_back_up', False)
         self._use_depth = self._params.get('use_depth', False)
         self._use_back_cam = self._params.get('use_back_cam', False)
         self._collision_reward = self._params.get('collision_reward', 0.)
-        if not self._params.get('visualize', False):
+        self._obs_mode = self._params.get('obs_mode', 'default') # <default/fast/raycast>
+        assert(self._obs_mode in ('default', 'fast', 'raycast'))
+        assert(self._obs_mode == 'default' or not self._use_depth)
+        if self._obs_mode == 'raycast':
+            assert(not self._use_back_cam)
+            loadPrcFileData('', 'window-type none') # no graphics needed
+        elif not self._params.get('visualize', False):
             loadPrcFileData('', 'window-type offscreen')
+        # set by BatchCarEnv for cars that share the world, scene and graphics engine of the first car
+        self._shared_world = self._params.get('shared_world', None)
+        self._car_index = self._params.get('car_index', None)
+        self._render_observation = True # BatchCarEnv turns this off and renders all cars at once
+        # scenes are converted once to bam files here (keyed by the egg contents), None to always load the egg
+        self._scene_cache_dir = self._params.get('scene_cache_dir', '/tmp/gcg_scene_cache')
+        # one compound body for the whole static scene, instead of one body per collision solid
+        self._merge_static = self._params.get('merge_static', False)
+        # contact_test: a contactTest query after the physics step
+        # manifold: the contact manifolds doPhysics already computed for the broadphase pairs of the car
+        self._collision_check = self._params.get('collision_check', 'contact_test') # <contact_test/manifold>
+        assert(self._collision_check in ('contact_test', 'manifold'))
 
         # Defines base, render, loader
 
@@ -42,19 +72,26 @@ class CarEnv(DirectObject):
         except:
             pass
         
-        base.setBackgroundColor(0.0, 0.0, 0.0, 1)
+        if self._obs_mode != 'raycast':
+            base.setBackgroundColor(0.0, 0.0, 0.0, 1)
 
         # World
-        self._worldNP = render.attachNewNode('World')
-        self._world = BulletWorld()
-        self._world.setGravity(Vec3(0, 0, -9.81))
+        if self._shared_world is None:
+            self._worldNP = render.attachNewNode('World')
+            self._world = BulletWorld()
+            self._world.setGravity(Vec3(0, 0, -9.81))
+        else:
+            self._worldNP = self._shared_world['worldNP']
+            self._world = self._shared_world['world']
         self._dt = params.get('dt', 0.25)
         self._step = 0.05
 
         # Vehicle
         shape = BulletBoxShape(Vec3(0.6, 1.0, 0.25))
         ts = TransformState.makePos(Point3(0., 0., 0.25))
-        self._vehicle_node = BulletRigidBodyNode('Vehicle')
+        # unique name per car in a shared world, to find its contact manifolds
+        self._vehicle_node = BulletRigidBodyNode('Vehicle' if self._car_index is None else
+                                                 'Vehicle{0}'.format(self._car_index))
         self._vehicle_node.addShape(shape, ts)
         self._mass = self._params.get('mass', 10.) 
         self._vehicle_node.setMass(self._mass)
@@ -62,6 +99,12 @@ class CarEnv(DirectObject):
         self._vehicle_node.setCcdSweptSphereRadius(1.0)
         self._vehicle_node.setCcdMotionThreshold(1e-7)
         self._vehicle_pointer = self._worldNP.attachNewNode(self._vehicle_node)
+        if self._car_index is not None:
+            # cars in the same world only collide with the scene (which has all bits on), not each other
+            assert(self._car_index < 31)
+            self._vehicle_pointer.setCollideMask(BitMask32.bit(self._car_index))
+        elif self._obs_mode == 'raycast':
+            self._vehicle_pointer.setCollideMask(BitMask32.bit(0))
 
         self._world.attachRigidBody(self._vehicle_node)
 
@@ -74,37 +117,49 @@ class CarEnv(DirectObject):
         self._addWheel(Point3(-0.3, -0.5, 0.07), False, 0.07)
 
         # Camera
-        size = self._params.get('size', [160, 90])
         hfov = self._params.get('hfov', 60)
         near_far = self._params.get('near_far', [0.1, 100.])
-        self._camera_sensor = Panda3dCameraSensor(
-            base,
-            color=not self._use_depth,
-            depth=self._use_depth,
-            size=size,
-            hfov=hfov,
-            near_far=near_far,
-            title='front cam')
-        self._camera_node = self._camera_sensor.cam
-        self._camera_node.setPos(0.0, 0.5, 0.375)
-        self._camera_node.lookAt(0.0, 6.0, 0.0)
-        self._camera_node.reparentTo(self._vehicle_pointer)
-
-        if self._use_back_cam:
-            self._back_camera_sensor = Panda3dCameraSensor(
+        if self._obs_mode == 'raycast':
+            self._camera_sensor = None
+            self._setup_raycast(hfov, near_far)
+        else:
+            size = self._params.get('size', [160, 90])
+            multisamples = self._params.get('multisamples', 0)
+            graphics_engine = self._shared_world['graphics_engine'] if self._shared_world is not None else None
+            self._camera_sensor = Panda3dCameraSensor(
                 base,
                 color=not self._use_depth,
                 depth=self._use_depth,
                 size=size,
                 hfov=hfov,
                 near_far=near_far,
-                title='back cam')
+                title='front cam',
+                multisamples=multisamples,
+                graphics_engine=graphics_engine,
+                alpha=(self._obs_mode != 'fast'))
+            self._camera_node = self._camera_sensor.cam
+            self._camera_node.setPos(0.0, 0.5, 0.375)
+            self._camera_node.lookAt(0.0, 6.0, 0.0)
+            self._camera_node.reparentTo(self._vehicle_pointer)
+
+            if self._use_back_cam:
+                self._back_camera_sensor = Panda3dCameraSensor(
+                    base,
+                    color=not self._use_depth,
+                    depth=self._use_depth,
+                    size=size,
+                    hfov=hfov,
+                    near_far=near_far,
+                    title='back cam',
+                    multisamples=multisamples,
+                    graphics_engine=self._camera_sensor.graphics_engine if self._car_index is not None else None,
+                    alpha=(self._obs_mode != 'fast'))
+
+                self._back_camera_node = self._back_camera_sensor.cam
+                self._back_camera_node.setPos(0.0, -0.5, 0.375)
+                self._back_camera_node.lookAt(0.0, -6.0, 0.0)
+                self._back_camera_node.reparentTo(self._vehicle_pointer)
 
-            self._back_camera_node = self._back_camera_sensor.cam
-            self._back_camera_node.setPos(0.0, -0.5, 0.375)
-            self._back_camera_node.lookAt(0.0, -6.0, 0.0)
-            self._back_camera_node.reparentTo(self._vehicle_pointer)
-        
         # Car Simulator
         self._des_vel = None
         self._setup()
@@ -135,6 +190,20 @@ class CarEnv(DirectObject):
         self._accelClamp = self._params.get('accelClamp', 2.0)
         self._engineClamp = self._accelClamp * self._mass
         self._collision = False
+        # how the velocity controller is run during the physics substeps of a step
+        #   loop: in python, one doPhysics call per substep
+        #   tick: in a bullet pre-tick callback, one doPhysics call per step (same trajectory as loop)
+        #   hold: engine force computed once per step and held for all substeps, one doPhysics call per step
+        self._controller = self._params.get('controller', 'loop') # <loop/tick/hold>
+        assert(self._controller in ('loop', 'tick', 'hold'))
+        self._tick_controller = False
+        if self._controller == 'tick' and self._car_index is None:
+            self._world.setTickCallback(PythonCallbackObject(self._tick_callback), True)
+        # states of the last steps, to back up by restoring one instead of simulating
+        self._back_up_restore_steps = self._params.get('back_up', {}).get('restore_steps', 0) if self._do_back_up else 0
+        self._state_history = collections.deque(maxlen=max(self._back_up_restore_steps, 1))
+        # state at the last reset, returned in the info of the first step so rollouts can be replayed
+        self._start_state = None
         if self._run_as_task:
             self._mark_d = 0.0
             taskMgr.add(self._update_task, 'updateWorld')
@@ -198,17 +267,32 @@ class CarEnv(DirectObject):
     def _mark(self):
         self._mark_d = 0.0
 
+    @property
+    def shared_world(self):
+        """ What other cars need to be added to this car's world """
+        return {
+            'world': self._world,
+            'worldNP': self._worldNP,
+            'graphics_engine': self._camera_sensor.graphics_engine if self._camera_sensor else None
+        }
+
     # Setup
     def _setup(self):
+        if self._shared_world is not None:
+            # scene and light were already set up by the first car
+            self._place_vehicle()
+            self._setup_restart_pos()
+            return
+
         if hasattr(self, '_model_path'):
             # Collidable objects
-            visNP = loader.loadModel(self._model_path)
-            visNP.clearModelNodes()
+            visNP, bodyNPs = self._load_scene()
             visNP.reparentTo(render)
             pos = (0., 0., 0.)
             visNP.setPos(pos[0], pos[1], pos[2])
+            if self._merge_static:
+                bodyNPs = [self._merge_bodies(bodyNPs)]
 
-            bodyNPs = BulletHelper.fromCollisionSolids(visNP, True)
             for bodyNP in bodyNPs:
                 bodyNP.reparentTo(render)
                 bodyNP.setPos(pos[0], pos[1], pos[2])
@@ -228,6 +312,60 @@ class CarEnv(DirectObject):
         self._setup_light()
         self._setup_restart_pos()
 
+    def _scene_cache_fnames(self):
+        if self._scene_cache_dir is None:
+            return None
+        with open(self._model_path, 'rb') as f:
+            key = hashlib.md5(f.read() + PandaSystem.getVersionString().encode()).hexdigest()
+        name = os.path.splitext(os.path.basename(self._model_path))[0]
+        return [os.path.join(self._scene_cache_dir, '{0}_{1}_{2}.bam'.format(name, key, kind))
+                for kind in ('scene', 'collision')]
+
+    def _load_scene(self):
+        """
+        Loads the egg scene and builds its collision bodies, or loads both from the bam cache
+
+        :return: scene NodePath, list of collision body NodePaths
+        """
+        fnames = self._scene_cache_fnames()
+        if fnames is not None and all([os.path.exists(fname) for fname in fnames]):
+            visNP, collisionNP = [loader.loadModel(Filename.fromOsSpecific(fname), noCache=True) for fname in fnames]
+            return visNP, list(collisionNP.findAllMatches('**/+BulletRigidBodyNode'))
+
+        visNP = loader.loadModel(self._model_path)
+        visNP.clearModelNodes()
+        bodyNPs = BulletHelper.fromCollisionSolids(visNP, True) # also removes the collision solids from visNP
+
+        if fnames is not None:
+            collisionNP = NodePath('collision')
+            for bodyNP in bodyNPs:
+                bodyNP.reparentTo(collisionNP)
+            os.makedirs(self._scene_cache_dir, exist_ok=True)
+            for nodepath, fname in zip((visNP, collisionNP), fnames):
+                # write then rename, so other workers never load a partial file
+                tmp_fname = '{0}.{1}.tmp'.format(fname, os.getpid())
+                if nodepath.writeBamFile(Filename.fromOsSpecific(tmp_fname)):
+                    os.replace(tmp_fname, fname)
+                elif os.path.exists(tmp_fname):
+                    os.remove(tmp_fname)
+
+        return visNP, bodyNPs
+
+    def _merge_bodies(self, bodyNPs):
+        """
+        :return: one body with the shapes of all bodies. Bullet keeps the children of a compound shape in a bounding
+                 volume tree, so the broadphase has a single static proxy and the narrowphase only visits nearby shapes
+        """
+        sceneNP = NodePath(BulletRigidBodyNode('Scene'))
+        for bodyNP in bodyNPs:
+            node = bodyNP.node()
+            if not isinstance(node, BulletRigidBodyNode):
+                continue
+            transform = bodyNP.getTransform().setPos(Vec3(0., 0., 0.)) # as the bodies are placed at the origin
+            for i in range(node.getNumShapes()):
+                sceneNP.node().addShape(node.getShape(i), transform.compose(node.getShapeTransform(i)))
+        return sceneNP
+
     def _setup_restart_pos(self):
         self._restart_pos = []
         self._restart_index = 0
@@ -236,8 +374,8 @@ class CarEnv(DirectObject):
             num_pos = self._params['num_pos']
             if self._params.get('range_type', 'random') == 'random':
                 for _ in range(num_pos):
-                    ran = ranges[np.random.randint(len(ranges))]
-                    self._restart_pos.append(np.random.uniform(ran[0], ran[1]))
+                    ran = ranges[self._rng.randint(len(ranges))]
+                    self._restart_pos.append(self._rng.uniform(ran[0], ran[1]))
             elif self._params['range_type'] == 'fix_spacing':
                 num_ran = len(ranges)
                 num_per_ran = num_pos // num_ran
@@ -267,11 +405,34 @@ class CarEnv(DirectObject):
         if num == 0:
             return None, None
         else:
-            index = np.random.randint(num)
+            index = self._rng.randint(num)
             pos_hpr = self._restart_pos[index]
             self._restart_index = (self._restart_index + 1) % num
             return pos_hpr[:3], pos_hpr[3:]
 
+    def _setup_raycast(self, hfov, near_far):
+        """
+        Fan of rays from the camera position, num_rays across hfov and rows across vfov
+        """
+        raycast_params = self._params.get('raycast', {})
+        num_rays = raycast_params.get('num_rays', 64)
+        rows = raycast_params.get('rows', 1)
+        vfov = raycast_params.get('vfov', 0.)
+        max_dist = raycast_params.get('max_dist', near_far[1])
+
+        yaws = np.deg2rad(np.linspace(-0.5 * hfov, 0.5 * hfov, num_rays))
+        pitches = np.deg2rad(np.linspace(0.5 * vfov, -0.5 * vfov, rows))
+        pitches, yaws = np.meshgrid(pitches, yaws, indexing='ij')
+        directions = np.stack([np.cos(pitches) * np.sin(yaws),
+                               np.cos(pitches) * np.cos(yaws),
+                               np.sin(pitches)], axis=2).reshape((-1, 3))
+
+        # homogeneous points in the vehicle frame
+        self._ray_from = np.array([0.0, 0.5, 0.375, 1.])
+        self._ray_tos = np.hstack([self._ray_from[:3] + max_dist * directions, np.ones((len(directions), 1))])
+        self._ray_shape = (rows, num_rays, 1)
+        self._ray_mask = BitMask32.bit(31) # only the scene, which has all bits on
+
     def _setup_light(self):
         alight = AmbientLight('ambientLight')
         alight.setColor(Vec4(0.5, 0.5, 0.5, 1))
@@ -293,7 +454,7 @@ class CarEnv(DirectObject):
         vel = self._vehicle.getCurrentSpeedKmHour() / 3.6
         return vel
 
-    def _update(self, dt=1.0, coll_check=True):
+    def _apply_steering_brake(self):
         self._vehicle.setSteeringValue(self._steering, 0)
         self._vehicle.setSteeringValue(self._steering, 1)
         self._vehicle.setBrake(self._brakeForce, 0)
@@ -301,20 +462,43 @@ class CarEnv(DirectObject):
         self._vehicle.setBrake(self._brakeForce, 2)
         self._vehicle.setBrake(self._brakeForce, 3)
 
+    def _apply_engine_force(self):
+        """ Velocity control for one physics step of length self._step """
+        if self._des_vel is not None:
+            vel = self._get_speed()
+            err = self._des_vel - vel
+            d_err = (err - self._last_err) / self._step
+            self._last_err = err
+            self._engineForce = np.clip(self._p * err + self._d * d_err, -self._accelClamp, self._accelClamp) * self._mass
+        self._vehicle.applyEngineForce(self._engineForce, 0)
+        self._vehicle.applyEngineForce(self._engineForce, 1)
+        self._vehicle.applyEngineForce(self._engineForce, 2)
+        self._vehicle.applyEngineForce(self._engineForce, 3)
+
+    def _tick_callback(self, callback_data):
+        if self._tick_controller:
+            self._apply_engine_force()
+
+    def _physics_steps(self, num_steps):
+        """ num_steps substeps in one doPhysics call, with the tick or hold controller """
+        if self._controller == 'hold':
+            self._apply_engine_force()
+        self._tick_controller = (self._controller == 'tick')
+        self._world.doPhysics(num_steps * self._step, num_steps, self._step)
+        self._tick_controller = False
+
+    def _update(self, dt=1.0, coll_check=True):
+        self._apply_steering_brake()
+
         if dt >= self._step:
             # TODO maybe change number of timesteps
-            for i in range(int(dt/self._step)):
-                if self._des_vel is not None:
-                    vel = self._get_speed()
-                    err = self._des_vel - vel
-                    d_err = (err - self._last_err) / self._step
-                    self._last_err = err
-                    self._engineForce = np.clip(self._p * err + self._d * d_err, -self._accelClamp, self._accelClamp) * self._mass
-                self._vehicle.applyEngineForce(self._engineForce, 0)
-                self._vehicle.applyEngineForce(self._engineForce, 1)
-                self._vehicle.applyEngineForce(self._engineForce, 2)
-                self._vehicle.applyEngineForce(self._engineForce, 3)
-                self._world.doPhysics(self._step, 1, self._step)
+            num_steps = int(round(dt / self._step)) # not floor, e.g. 0.3 / 0.05 < 6
+            if self._controller == 'loop':
+                for i in range(num_steps):
+                    self._apply_engine_force()
+                    self._world.doPhysics(self._step, 1, self._step)
+            else:
+                self._physics_steps(num_steps)
             self._collision = self._is_contact()
         elif self._run_as_task:
             self._curr_time += dt
@@ -390,16 +574,58 @@ class CarEnv(DirectObject):
 
     # Helper functions
 
+    def _render(self):
+        if self._camera_sensor is None:
+            return
+        self._camera_sensor.render()
+        if self._use_back_cam:
+            self._back_camera_sensor.render()
+
     def _get_observation(self):
-        self._obs = self._camera_sensor.observe()
+        if self._render_observation:
+            self._render()
+        if self._obs_mode == 'fast':
+            return self._get_observation_fast()
+        if self._obs_mode == 'raycast':
+            return self._get_observation_raycast()
+
+        self._obs = self._camera_sensor.read()
         observation = []
         observation.append(self._obs[0])
         if self._use_back_cam:
-            self._back_obs = self._back_camera_sensor.observe()
+            self._back_obs = self._back_camera_sensor.read()
             observation.append(self._back_obs[0])
         observation = np.concatenate(observation, axis=2)
         return observation
 
+    def _get_observation_fast(self):
+        """
+        :return: [height, width, num cameras] uint8 grayscale, rendered at the observation size
+        """
+        observation = [self._camera_sensor.read_gray()]
+        if self._use_back_cam:
+            observation.append(self._back_camera_sensor.read_gray())
+        return np.stack(observation, axis=2)
+
+    def _get_observation_raycast(self):
+        """
+        :return: [rows, num_rays, 1] uint8 distances to the scene (255 is max_dist or no hit)
+        """
+        mat = self._vehicle_pointer.getMat(self._worldNP)
+        mat = np.array([[mat.getCell(i, j) for j in range(4)] for i in range(4)])
+        # panda3d transforms row vectors
+        ray_from = Point3(*self._ray_from.dot(mat)[:3])
+        ray_tos = self._ray_tos.dot(mat)[:, :3]
+
+        # panda3d's bullet has no multi-ray query, so this loop (one rayTestClosest per ray) is the cost of raycast
+        fractions = np.ones(len(ray_tos))
+        for i, ray_to in enumerate(ray_tos):
+            result = self._world.rayTestClosest(ray_from, Point3(*ray_to), self._ray_mask)
+            if result.hasHit():
+                fractions[i] = result.getHitFraction()
+
+        return (255. * fractions).astype(np.uint8).reshape(self._ray_shape)
+
     def _get_reward(self):
         reward = self._collision_reward if self._collision else self._get_speed()
         return reward
@@ -416,12 +642,19 @@ class CarEnv(DirectObject):
         return info
     
     def _back_up(self):
+        if self._back_up_restore_steps > 0:
+            if len(self._state_history) > 0:
+                self.set_state(self._state_history[0])
+                self._stop_car()
+            self._state_history.clear()
+            return
+
         assert(self._use_vel)
         back_up_vel = self._params['back_up'].get('vel', -2.0) 
         self._des_vel = back_up_vel
         back_up_steer = self._params['back_up'].get('steer', (-5.0, 5.0))
         # TODO
-        self._steering = np.random.uniform(*back_up_steer)
+        self._steering = self._rng.uniform(*back_up_steer)
         self._brakeForce = 0.
         duration = self._params['back_up'].get('duration', 1.0)
         self._update(dt=duration)
@@ -431,13 +664,86 @@ class CarEnv(DirectObject):
         self._brakeForce = 0.
 
     def _is_contact(self):
-        result = self._world.contactTest(self._vehicle_node)
+        if self._collision_check == 'manifold':
+            return self._is_contact_manifold()
+        # in a shared world, use the collide masks to ignore the other cars
+        result = self._world.contactTest(self._vehicle_node, self._car_index is not None)
         num_contacts = result.getNumContacts()
         return result.getNumContacts() > 0
 
+    def _is_contact_manifold(self):
+        """
+        Contacts from the last collision detection of doPhysics (before its last integration), so no new query.
+        Cars in a shared world do not collide, so they have no manifolds with each other.
+        """
+        name = self._vehicle_node.getName()
+        for manifold in self._world.getManifolds():
+            if name not in (manifold.getNode0().getName(), manifold.getNode1().getName()):
+                continue
+            for i in range(manifold.getNumManifoldPoints()):
+                if manifold.getManifoldPoint(i).getDistance() <= 0.:
+                    return True
+        return False
+
+    # State
+
+    def get_state(self):
+        """
+        :return: everything needed to continue the simulation of the car from this point
+        """
+        wheels = [self._vehicle.getWheel(i) for i in range(self._vehicle.getNumWheels())]
+        return {
+            'pos': np.array(self._vehicle_pointer.getPos()),
+            'hpr': np.array(self._vehicle_pointer.getHpr()),
+            'linear_velocity': np.array(self._vehicle_node.getLinearVelocity()),
+            'angular_velocity': np.array(self._vehicle_node.getAngularVelocity()),
+            'wheel_rotations': np.array([wheel.getRotation() for wheel in wheels]),
+            'wheel_steerings': np.array([wheel.getSteering() for wheel in wheels]),
+            'steering': self._steering,
+            'engine_force': self._engineForce,
+            'brake_force': self._brakeForce,
+            'des_vel': self._des_vel,
+            'last_err': self._last_err,
+            'curr_time': self._curr_time,
+            'collision': self._collision
+        }
+
+    def set_state(self, state):
+        """
+        :param state: from get_state
+        """
+        self._vehicle_pointer.setPos(*state['pos'])
+        self._vehicle_pointer.setHpr(*state['hpr'])
+        self._vehicle_node.clearForces()
+        self._vehicle_node.setLinearVelocity(Vec3(*state['linear_velocity']))
+        self._vehicle_node.setAngularVelocity(Vec3(*state['angular_velocity']))
+        for i in range(self._vehicle.getNumWheels()):
+            self._vehicle.setSteeringValue(state['wheel_steerings'][i], i)
+            self._vehicle.getWheel(i).setRotation(state['wheel_rotations'][i])
+        self._vehicle.resetSuspension()
+        self._steering = state['steering']
+        self._engineForce = state['engine_force']
+        self._brakeForce = state['brake_force']
+        self._des_vel = state['des_vel']
+        self._last_err = state['last_err']
+        self._curr_time = state['curr_time']
+        self._collision = state['collision']
+
     # Environment functions
 
-    def reset(self, pos=None, hpr=None, hard_reset=False, random_reset=False):
+    def reset(self, pos=None, hpr=None, hard_reset=False, random_reset=False, state=None):
+        self._reset(pos=pos, hpr=hpr, hard_reset=hard_reset, random_reset=random_reset, state=state)
+        return self._get_observation()
+
+    def _reset(self, pos=None, hpr=None, hard_reset=False, random_reset=False, state=None):
+        """ reset without observing (e.g. BatchCarEnv observes all cars after resetting) """
+        if state is not None:
+            # e.g. to branch rollouts from the same state
+            self.set_state(state)
+            self._state_history.clear()
+            self._start_state = self.get_state()
+            return
+
         if self._do_back_up and not hard_reset and \
                 pos is None and hpr is None:
             if self._collision:
@@ -449,10 +755,11 @@ class CarEnv(DirectObject):
                 else:
                     pos, hpr = self._next_restart_pos_hpr()
             self._place_vehicle(pos=pos, hpr=hpr)
+            self._state_history.clear()
         self._collision = False
-        return self._get_observation()
+        self._start_state = self.get_state()
 
-    def step(self, action):
+    def _set_action(self, action):
         self._steering = action[0]
         if action[1] == 0.0:
             self._brakeForce = 1000.
@@ -464,14 +771,26 @@ class CarEnv(DirectObject):
         else:
             self._engineForce = self._engineClamp * \
                 ((action[1] - 49.5) / 49.5)
-        
+
+    def step(self, action):
+        if self._back_up_restore_steps > 0:
+            self._state_history.append(self.get_state())
+        self._set_action(action)
         self._update(dt=self._dt)
         observation = self._get_observation()
         reward = self._get_reward() 
         done = self._get_done()
-        info = self._get_info()
+        info = self._get_step_info()
         return observation, reward, done, info
 
+    def _get_step_info(self):
+        info = self._get_info()
+        if self._start_state is not None:
+            # first step since reset (see replay_rollouts.py)
+            info['start_state'] = self._start_state
+            self._start_state = None
+        return info
+
 if __name__ == '__main__':
     params = {'visualize': True, 'run_as_task': True}
     env = CarEnv(params)
@@ -20,6 +20,10 @@ class CylinderEnv(CarEnv):
                                       os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models/cylinder.egg'))
 
         self._obs_shape = params['obs_shape']
+        if params.get('obs_mode', 'default') == 'fast':
+            # render directly at the observation size, antialiased instead of downsampled
+            params['size'] = list(self._obs_shape)
+            params.setdefault('multisamples', 4)
 
         CarEnv.__init__(
             self,
@@ -44,6 +48,8 @@ class CylinderEnv(CarEnv):
 
     def _get_observation(self):
         obs = super(CylinderEnv, self)._get_observation()
+        if self._obs_mode in ('fast', 'raycast'):
+            return obs # already grayscale at obs_shape, or distances
         if self._use_depth:
             im = CylinderEnv.process_depth(obs, self._obs_shape)
         else:
@@ -52,7 +58,7 @@ class CylinderEnv(CarEnv):
 
         return im
 
-    def step(self, action):
+    def _set_action(self, action):
         lb, ub = self._unnormalized_action_space.bounds
         scaled_action = lb + (action + 1.) * 0.5 * (ub - lb)
         scaled_action = np.clip(scaled_action, lb, ub)
@@ -60,7 +66,7 @@ class CylinderEnv(CarEnv):
         if self._fixed_speed:
             scaled_action[1] = self._speed_limits[0]
 
-        return CarEnv.step(self, scaled_action)
+        CarEnv._set_action(self, scaled_action)
 
     @staticmethod
     def process_depth(image, obs_shape):
@@ -96,7 +102,7 @@ class CylinderEnv(CarEnv):
 
     def _default_restart_pos(self):
         ran = np.linspace(-3.5, 3.5, 20)
-        np.random.shuffle(ran)
+        self._rng.shuffle(ran)
         restart_pos = []
         for val in ran:
             restart_pos.append([val, -6.0, 0.25, 0.0, 0.0, 3.14])
@@ -7,17 +7,22 @@ from rllab.misc.ext import set_seed
 import rllab.misc.logger as logger
 
 from sandbox.gkahn.gcg.policies.mac_policy import MACPolicy
+from sandbox.gkahn.gcg.policies.rccar_mac_policy import RCcarMACPolicy
+from sandbox.gkahn.gcg.policies.frozen_mac_policy import FrozenMACPolicy
 from sandbox.gkahn.gcg.sampler.sampler import RNNCriticSampler
+from sandbox.gkahn.gcg.utils.checkpointer import Checkpointer
+from sandbox.gkahn.gcg.tf.session_autotune import SessionAutotuner
 
 from sandbox.gkahn.gcg.envs.env_utils import create_env
 
 class EvalExp(object):
-    def __init__(self, folder, num_rollouts):
+    def __init__(self, folder, num_rollouts, use_frozen=False):
         """
         :param kwargs: holds random extra properties
         """
         self._folder = folder
         self._num_rollouts = num_rollouts
+        self._use_frozen = use_frozen
 
         ### load data
         self.name = os.path.basename(self._folder)
@@ -33,6 +38,12 @@ class EvalExp(object):
     def _itr_file(self, itr):
         return os.path.join(self._folder, 'itr_{0:d}.pkl'.format(itr))
 
+    def _itr_checkpoint_file(self, itr):
+        return Checkpointer.checkpoint_file(self._folder, itr)
+
+    def _itr_inference_file(self, itr):
+        return os.path.join(self._folder, 'itr_{0:d}_inference.pkl'.format(itr))
+
     @property
     def _params_file(self):
         yamls = [fname for fname in os.listdir(self._folder) if os.path.splitext(fname)[-1] == '.yaml' and os.path.basename(self._folder) in fname]
@@ -47,17 +58,48 @@ class EvalExp(object):
     ### Data loading ###
     ####################
 
+    def _policy_class_and_kwargs(self):
+        policy_class = self.params['policy']['class']
+        PolicyClass = eval(policy_class)
+        kwargs = dict(env_spec=self.env.spec,
+                      exploration_strategies=self.params['alg']['exploration_strategies'],
+                      **self.params['policy'][policy_class],
+                      **self.params['policy'])
+        return PolicyClass, kwargs
+
     def _load_itr_policy(self, itr):
-        d = joblib.load(self._itr_file(itr))
-        policy = d['policy']
+        if os.path.exists(self._itr_file(itr)):
+            d = joblib.load(self._itr_file(itr))
+            policy = d['policy']
+        else:
+            ### npz checkpoint: create the policy from the params, then restore the variables
+            PolicyClass, kwargs = self._policy_class_and_kwargs()
+            policy = PolicyClass(**kwargs)
+            policy.restore_checkpoint(Checkpointer.load(self._itr_checkpoint_file(itr)))
         return policy
 
+    def _session_params(self):
+        """ Fastest session params for acting if the policy was autotuned on this machine, else the policy's default """
+        PolicyClass, kwargs = self._policy_class_and_kwargs()
+        session_autotune = self.params['policy'].get('session_autotune', None)
+        if session_autotune is None or not session_autotune['enabled']:
+            return PolicyClass.default_session_params(kwargs)
+        fastest = SessionAutotuner(session_autotune['cache_dir'], PolicyClass.get_config_key(kwargs)).load()
+        return fastest['act'] if fastest is not None else PolicyClass.default_session_params(kwargs)
+
+    def _last_itr(self):
+        itr = 0
+        while os.path.exists(self._itr_file(itr)):
+            itr += 1
+        itr -= 1
+        ### npz checkpoints are not contiguous (older ones are removed)
+        checkpoint_itrs = [int(fname.split('_')[1]) for fname in os.listdir(self._folder)
+                           if fname.endswith('_checkpoint.npz')]
+        return max([itr] + checkpoint_itrs)
+
     def eval_policy(self, itr, gpu_device=None, gpu_frac=None):
         if itr == -1:
-            itr = 0
-            while os.path.exists(self._itr_file(itr)):
-                itr += 1
-            itr -= 1
+            itr = self._last_itr()
 
         if self.params['seed'] is not None:
             set_seed(self.params['seed'])
@@ -66,9 +108,16 @@ class EvalExp(object):
             gpu_device = self.params['policy']['gpu_device']
         if gpu_frac is None:
             gpu_frac = self.params['policy']['gpu_frac']
-        sess, graph = MACPolicy.create_session_and_graph(gpu_device=gpu_device, gpu_frac=gpu_frac)
+        if self._use_frozen:
+            assert(os.path.exists(self._itr_inference_file(itr)))
+            policy = FrozenMACPolicy(self._itr_inference_file(itr), gpu_device=gpu_device, gpu_frac=gpu_frac)
+            sess, graph = policy.session, policy.session.graph
+        else:
+            sess, graph = MACPolicy.create_session_and_graph(gpu_device=gpu_device, gpu_frac=gpu_frac,
+                                                             session_params=self._session_params())
         with graph.as_default(), sess.as_default():
-            policy = self._load_itr_policy(itr)
+            if not self._use_frozen:
+                policy = self._load_itr_policy(itr)
 
             logger.log('Evaluating policy for itr {0}'.format(itr))
             n_envs = 1
@@ -102,7 +151,8 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('folder', type=str)
     parser.add_argument('numrollouts', type=int)
+    parser.add_argument('--frozen', action='store_true', help='use the frozen inference graph (itr_*_inference.pkl)')
     args = parser.parse_args()
 
-    eval_exp = EvalExp(args.folder, args.numrollouts)
+    eval_exp = EvalExp(args.folder, args.numrollouts, use_frozen=args.frozen)
     eval_exp.eval_policy(-1)
@@ -0,0 +1,148 @@
+import joblib
+from collections import defaultdict
+import numpy as np
+
+import tensorflow as tf
+
+import rllab.misc.logger as logger
+
+from sandbox.gkahn.gcg.policies.mac_policy import MACPolicy
+from sandbox.gkahn.gcg.policies.get_action_extras import GetActionExtrasMixin
+from sandbox.gkahn.gcg.tf import tf_utils
+
+class FrozenMACPolicy(GetActionExtrasMixin):
+    """
+    Acting-only policy loaded from the file written by MACPolicy.export_inference_graph.
+    Only contains the action selection subgraph, so it cannot be trained. Runs the planner's
+    get_action_extras ops the same way RCcarMACPolicy.get_actions does (see GetActionExtrasMixin).
+    """
+    def __init__(self, fname, gpu_device=None, gpu_frac=None):
+        d = joblib.load(fname)
+
+        self._N = d['N']
+        self._gamma = d['gamma']
+        self._obs_history_len = d['obs_history_len']
+        self._only_completed_episodes = d['only_completed_episodes']
+        self._is_discrete = d['is_discrete']
+        self._gaussian_es_schedule = d['gaussian_es_schedule']
+        self._epsilon_greedy_es_schedule = d['epsilon_greedy_es_schedule']
+        self._get_action_test = d.get('get_action_test', None)
+
+        self._tf_dict = self._graph_setup(d, gpu_device, gpu_frac)
+
+        self._num_get_actions = 0
+        self._action_bank_stale = True # the bank embeddings are reinitialized on load
+        self._log_stats = defaultdict(list)
+
+    ##################
+    ### Properties ###
+    ##################
+
+    @property
+    def N(self):
+        return self._N
+
+    @property
+    def gamma(self):
+        return self._gamma
+
+    @property
+    def session(self):
+        return self._tf_dict['sess']
+
+    @property
+    def obs_history_len(self):
+        return self._obs_history_len
+
+    @property
+    def only_completed_episodes(self):
+        return self._only_completed_episodes
+
+    @property
+    def target_embedding_dim(self):
+        return None
+
+    ###########################
+    ### TF graph operations ###
+    ###########################
+
+    def _graph_setup(self, d, gpu_device, gpu_frac):
+        tf_sess, tf_graph = MACPolicy.create_session_and_graph(gpu_device=gpu_device, gpu_frac=gpu_frac)
+
+        graph_def = tf.GraphDef()
+        graph_def.ParseFromString(d['graph_def'])
+        with tf_graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+
+        tf_init_ops = [tf_graph.get_operation_by_name(name) for name in d['init_ops']]
+        tf_sess.run(tf_init_ops)
+
+        return {
+            'sess': tf_sess,
+            'graph': tf_graph,
+            'obs_ph': tf_graph.get_tensor_by_name(d['obs_ph']),
+            'episode_timesteps_ph': tf_graph.get_tensor_by_name(d['episode_timesteps_ph']),
+            'test_es_ph_dict': dict([(k, tf_graph.get_tensor_by_name(name))
+                                     for k, name in d['test_es_ph_dict'].items()]),
+            'get_action': tf_graph.get_tensor_by_name(d['get_action']),
+            'get_action_explore': tf_graph.get_tensor_by_name(d['get_action_explore']),
+            'get_action_value': tf_graph.get_tensor_by_name(d['get_action_value']),
+            'get_action_reset_ops': [tf_graph.get_operation_by_name(name) for name in d['get_action_reset_ops']],
+            'get_action_extras': tf_utils.graph_elements_by_name(d.get('get_action_extras', {}), tf_graph)
+        }
+
+    ######################
+    ### Policy methods ###
+    ######################
+
+    def get_actions(self, steps, current_episode_steps, observations, explore):
+        ret, _ = self._get_actions_with_extras(self._get_actions, steps, current_episode_steps, observations, explore)
+        return ret
+
+    def _get_actions(self, steps, current_episode_steps, observations, explore):
+        d = {}
+        feed_dict = {
+            self._tf_dict['obs_ph']: observations,
+            self._tf_dict['episode_timesteps_ph']: current_episode_steps
+        }
+        if explore:
+            if self._gaussian_es_schedule:
+                feed_dict[self._tf_dict['test_es_ph_dict']['gaussian']] = \
+                    [self._gaussian_es_schedule.value(t) for t in steps]
+            if self._epsilon_greedy_es_schedule:
+                feed_dict[self._tf_dict['test_es_ph_dict']['epsilon_greedy']] = \
+                    [self._epsilon_greedy_es_schedule.value(t) for t in steps]
+
+            actions, values = self._tf_dict['sess'].run([self._tf_dict['get_action_explore'],
+                                                         self._tf_dict['get_action_value']],
+                                                        feed_dict=feed_dict)
+        else:
+            actions, values = self._tf_dict['sess'].run([self._tf_dict['get_action'],
+                                                         self._tf_dict['get_action_value']],
+                                                        feed_dict=feed_dict)
+
+        logprobs = [np.nan] * len(steps)
+
+        if self._is_discrete:
+            actions = [int(a.argmax()) for a in actions]
+
+        return actions, values, logprobs, d
+
+    def reset_get_action(self):
+        self._tf_dict['sess'].run(self._tf_dict['get_action_reset_ops'])
+
+    @property
+    def recurrent(self):
+        return False
+
+    def terminate(self):
+        self._tf_dict['sess'].close()
+
+    ###############
+    ### Logging ###
+    ###############
+
+    def log(self):
+        for k in sorted(self._log_stats.keys()):
+            logger.record_tabular(k, np.mean(self._log_stats[k]))
+        self._log_stats.clear()
@@ -0,0 +1,69 @@
+import time
+import numpy as np
+
+class GetActionExtrasMixin(object):
+    """
+    Runs the planner's get_action_extras ops (action bank, anytime planning) around get_actions. Shared by
+    RCcarMACPolicy and FrozenMACPolicy (which runs the exported ops), which provide _tf_dict, _get_action_test,
+    _log_stats, _num_get_actions and _action_bank_stale
+    """
+    def _get_actions_with_extras(self, get_actions, steps, current_episode_steps, observations, explore):
+        """
+        :param get_actions: runs the get_action ops
+        :return: what get_actions returns, elapsed seconds
+        """
+        tf_extras = self._tf_dict['get_action_extras']
+        if 'action_bank' in tf_extras:
+            self._update_action_bank()
+
+        start = time.time()
+        if 'anytime' in tf_extras:
+            ### get_action only reads the best action found by the planning iterations
+            num_iters = self._plan_anytime(current_episode_steps, observations, start)
+        ret = get_actions(steps, current_episode_steps, observations, explore)
+        elapsed = time.time() - start
+
+        self._num_get_actions += 1
+        if 'anytime' in tf_extras:
+            self._log_stats['AnytimeIterations'].append(num_iters)
+            self._log_stats['AnytimeValue'].append(np.mean(ret[1]))
+            budget = 1e-3 * self._get_action_test['anytime']['budget_ms']
+            self._log_stats['AnytimeDeadlineMisses'].append(float(elapsed > budget))
+
+        return ret, elapsed
+
+    def _plan_anytime(self, current_episode_steps, observations, start):
+        """
+        Runs planning iterations until the next one is expected to exceed the time budget (at least one)
+
+        :return: number of iterations
+        """
+        anytime_params = self._get_action_test['anytime']
+        budget = 1e-3 * anytime_params['budget_ms']
+        tf_extras = self._tf_dict['get_action_extras']['anytime']
+
+        self._tf_dict['sess'].run(tf_extras['prepare'], feed_dict={
+            self._tf_dict['obs_ph']: observations,
+            self._tf_dict['episode_timesteps_ph']: current_episode_steps
+        })
+        num_iters = 0
+        iter_time = 0.
+        while num_iters < anytime_params['max_iters']:
+            iter_start = time.time()
+            self._tf_dict['sess'].run(tf_extras['iter'])
+            iter_time = max(iter_time, time.time() - iter_start)
+            num_iters += 1
+            if time.time() - start + iter_time > budget:
+                break
+
+        return num_iters
+
+    def _update_action_bank(self):
+        tf_extras = self._tf_dict['get_action_extras']['action_bank']
+        refresh_every_n_calls = self._get_action_test['random'].get('bank_refresh_every_n_calls', 0)
+        if refresh_every_n_calls and self._num_get_actions > 0 and self._num_get_actions % refresh_every_n_calls == 0:
+            self._tf_dict['sess'].run(tf_extras['refresh'])
+            self._action_bank_stale = False
+        elif self._action_bank_stale:
+            self._tf_dict['sess'].run(tf_extras['update_embeddings'])
+            self._action_bank_stale = False
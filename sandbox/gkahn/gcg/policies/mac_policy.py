@@ -1,10 +1,16 @@
-import os
+import os, sys
+import inspect
+import hashlib
+import json
+import pickle
+import joblib
 from collections import defaultdict
 
 import numpy as np
 from sklearn.utils.extmath import cartesian
 
 import tensorflow as tf
+from tensorflow.python.client import timeline
 
 from rllab.core.serializable import Serializable
 import rllab.misc.logger as logger
@@ -16,6 +22,7 @@ from sandbox.gkahn.tf.core import xplatform
 from sandbox.gkahn.gcg.utils import schedules
 from sandbox.gkahn.gcg.tf import tf_utils
 from sandbox.gkahn.gcg.tf import networks
+from sandbox.gkahn.gcg.tf.session_autotune import SessionAutotuner, session_params_grid
 
 ### exploration strategies
 from sandbox.gkahn.gcg.exploration_strategies.epsilon_greedy_strategy import EpsilonGreedyStrategy
@@ -28,6 +35,12 @@ class MACPolicy(Parameterized, Serializable):
         ### environment
         self._env_spec = kwargs['env_spec']
 
+        ### reuse the constructed graph from previous runs (key before graph construction modifies kwargs)
+        self._config_key = type(self).get_config_key(kwargs)
+        self._graph_cache_dir = kwargs.get('graph_cache_dir', None)
+        self._session_autotune = kwargs.get('session_autotune', None)
+        self._default_session_params = type(self).default_session_params(kwargs)
+
         ### model horizons
         self._N = kwargs['N'] # number of returns to use (N-step)
         self._H = kwargs['H'] # action planning horizon for training
@@ -46,12 +59,22 @@ class MACPolicy(Parameterized, Serializable):
         self._use_target = kwargs['use_target']
         self._separate_target_params = kwargs['separate_target_params']
         self._clip_cost_target_with_dones = kwargs['clip_cost_target_with_dones']
+        self._cache_target_embeddings = kwargs.get('cache_target_embeddings', False) # target lowd cached in replay pool
+        if self._cache_target_embeddings:
+            assert(self._use_target and self._separate_target_params)
 
         ### training
         self._only_completed_episodes = kwargs['only_completed_episodes']
         self._weight_decay = kwargs['weight_decay']
         self._lr_schedule = schedules.PiecewiseSchedule(**kwargs['lr_schedule'])
         self._grad_clip_norm = kwargs['grad_clip_norm']
+        self._train_steps_per_run = kwargs.get('train_steps_per_run', 1) # optimizer steps chained in one session.run
+        self._input_pipeline = kwargs.get('input_pipeline', {'type': 'feed_dict'})
+        if self._input_pipeline['type'] == 'staging':
+            assert(self._input_pipeline['staging']['num_prefetch'] in (1, 2))
+            assert(self._train_steps_per_run == 1)
+        assert(not self._cache_target_embeddings or
+               (self._train_steps_per_run == 1 and self._input_pipeline['type'] == 'feed_dict'))
         self._preprocess_params = kwargs['preprocess']
         self._gpu_device = kwargs['gpu_device']
         self._gpu_frac = kwargs['gpu_frac']
@@ -74,10 +97,24 @@ class MACPolicy(Parameterized, Serializable):
         ### setup the model
         self._tf_debug = dict()
         self._tf_dict = self._graph_setup()
+        if self._session_autotune is not None and self._session_autotune['enabled'] and \
+                tf.get_default_session() is None: # only if the policy created its own session
+            self._tf_dict['sess'] = self._graph_autotune_session()
 
         ### logging
         self._log_stats = defaultdict(list)
 
+        ### profiling (trace train_step and get_actions every n steps or after profile_next, e.g. on SIGUSR1)
+        self._profile_every_n_steps = kwargs.get('profile_every_n_steps', None)
+        self._profile_on_signal = kwargs.get('profile_on_signal', False)
+        self._profile_pending = set()
+        self._profile_last_period = defaultdict(int)
+
+        ### training batches currently staged
+        self._num_staged = 0
+        ### incremented whenever the target network changes
+        self._target_version = 0
+
         Parameterized.__init__(self, sess=self._tf_dict['sess'])
 
         assert((self._N == 1 and self._H == 1) or
@@ -112,34 +149,72 @@ class MACPolicy(Parameterized, Serializable):
     def only_completed_episodes(self):
         return self._only_completed_episodes
 
+    @property
+    def train_steps_per_run(self):
+        return self._train_steps_per_run
+
+    @property
+    def target_embedding_dim(self):
+        """ dimension of the target lowd to cache in the replay pool (None if not caching) """
+        return self._observation_graph['output_dim'] if self._cache_target_embeddings else None
+
+    @property
+    def target_version(self):
+        return self._target_version
+
     ###########################
     ### TF graph operations ###
     ###########################
 
     @staticmethod
-    def create_session_and_graph(gpu_device=None, gpu_frac=None):
+    def create_session_config(gpu_device=None, gpu_frac=None, session_params=None):
+        """
+        :param session_params: dict with intra_op_threads, inter_op_threads, xla, layout_optimizer (see session_autotune)
+        """
         if gpu_device is None:
             gpu_device = 0
         if gpu_frac is None:
             gpu_frac = 0.3
+        if session_params is None:
+            session_params = dict()
+        inter_op_threads = session_params.get('inter_op_threads', 1)
+        intra_op_threads = session_params.get('intra_op_threads', 1)
 
-        os.environ["CUDA_VISIBLE_DEVICES"] = str(gpu_device)
-        tf_graph = tf.Graph()
         if len(str(gpu_device)) > 0:
             gpu_options = tf.GPUOptions(per_process_gpu_memory_fraction=gpu_frac)
             config = tf.ConfigProto(gpu_options=gpu_options,
                                     log_device_placement=False,
                                     allow_soft_placement=True,
-                                    inter_op_parallelism_threads=1,
-                                    intra_op_parallelism_threads=1)
+                                    inter_op_parallelism_threads=inter_op_threads,
+                                    intra_op_parallelism_threads=intra_op_threads)
         else:
             config = tf.ConfigProto(
                 device_count={'GPU': 0},
                 log_device_placement=False,
                 allow_soft_placement=True,
-                inter_op_parallelism_threads=1,
-                intra_op_parallelism_threads=1
+                inter_op_parallelism_threads=inter_op_threads,
+                intra_op_parallelism_threads=intra_op_threads
             )
+        if session_params.get('xla', False):
+            config.graph_options.optimizer_options.global_jit_level = tf.OptimizerOptions.ON_1
+        if session_params.get('layout_optimizer', False):
+            config.graph_options.rewrite_options.optimize_tensor_layout = True
+        return config
+
+    @classmethod
+    def default_session_params(cls, kwargs):
+        """ Session params when the policy creates its session and is not autotuned """
+        return dict()
+
+    @staticmethod
+    def create_session_and_graph(gpu_device=None, gpu_frac=None, session_params=None):
+        if gpu_device is None:
+            gpu_device = 0
+
+        os.environ["CUDA_VISIBLE_DEVICES"] = str(gpu_device)
+        tf_graph = tf.Graph()
+        config = MACPolicy.create_session_config(gpu_device=gpu_device, gpu_frac=gpu_frac,
+                                                 session_params=session_params)
         tf_sess = tf.Session(graph=tf_graph, config=config)
         return tf_sess, tf_graph
 
@@ -156,6 +231,8 @@ class MACPolicy(Parameterized, Serializable):
             tf_dones_ph = tf.placeholder(tf.bool, [None, self._N], name='tf_dones_ph')
             ### policy outputs
             tf_rewards_ph = tf.placeholder(tf.float32, [None, self._N], name='tf_rewards_ph')
+            ### step each sample was collected at (identifies the sample, e.g. for the ensemble bootstrap)
+            tf_sample_steps_ph = tf.placeholder(tf.int32, [None], name='tf_sample_steps_ph')
             ### target inputs
             tf_obs_target_ph = tf.placeholder(obs_dtype, [None, self._N + self._obs_history_len - 0, obs_dim], name='tf_obs_target_ph')
             ### policy exploration
@@ -167,7 +244,8 @@ class MACPolicy(Parameterized, Serializable):
             ### episode timesteps
             tf_episode_timesteps_ph = tf.placeholder(tf.int32, [None], name='tf_episode_timesteps')
 
-        return tf_obs_ph, tf_actions_ph, tf_dones_ph, tf_rewards_ph, tf_obs_target_ph, tf_test_es_ph_dict, tf_episode_timesteps_ph
+        return tf_obs_ph, tf_actions_ph, tf_dones_ph, tf_rewards_ph, tf_sample_steps_ph, tf_obs_target_ph, \
+               tf_test_es_ph_dict, tf_episode_timesteps_ph
 
     def _graph_preprocess_placeholders(self):
         tf_preprocess = dict()
@@ -200,9 +278,20 @@ class MACPolicy(Parameterized, Serializable):
 
         return tf_preprocess
 
+    @property
+    def _obs_per_frame(self):
+        """ whether each observation frame is encoded separately by the image graph """
+        return self._image_graph is not None and self._image_graph.get('per_frame', False)
+
     def _graph_obs_to_lowd(self, tf_obs_ph, tf_preprocess, is_training):
         import tensorflow.contrib.layers as layers
 
+        if self._obs_per_frame:
+            with tf.name_scope('obs_to_lowd'):
+                tf_frame_embeddings = self._graph_obs_to_frame_embeddings(tf_obs_ph, tf_preprocess, is_training)
+                tf_obs_lowd = self._graph_frame_embeddings_to_lowd(tf_frame_embeddings, is_training)
+            return tf_obs_lowd
+
         with tf.name_scope('obs_to_lowd'):
             ### whiten observations
             obs_dim = self._env_spec.observation_space.flat_dim
@@ -237,6 +326,69 @@ class MACPolicy(Parameterized, Serializable):
 
         return tf_obs_lowd
 
+    def _graph_obs_to_frame_embeddings(self, tf_obs_ph, tf_preprocess, is_training):
+        """
+        :param tf_obs_ph: [batch_size, num_frames, obs_dim]
+        :return: [batch_size, num_frames, frame_embedding_dim], each frame encoded separately by the image graph
+        """
+        import tensorflow.contrib.layers as layers
+        assert(self._obs_per_frame)
+
+        obs_dim = self._env_spec.observation_space.flat_dim
+        num_frames = tf_obs_ph.get_shape()[1].value
+
+        ### whiten observations
+        if tf_obs_ph.dtype != tf.float32:
+            tf_obs_ph = tf.cast(tf_obs_ph, tf.float32)
+        tf_frames = tf.reshape(tf_obs_ph, (-1, obs_dim))
+        tf_frames_whitened = tf.multiply(tf_frames - tf_preprocess['observations_mean_var'],
+                                         tf_preprocess['observations_orth_var'])
+
+        ### frame --> lower dimensional space
+        frame_shape = list(self._env_spec.observation_space.shape)[:2] + [1]
+        layer = tf.reshape(tf_frames_whitened, [-1] + frame_shape)
+        layer, _ = networks.convnn(layer, self._image_graph, is_training=is_training, scope='obs_to_lowd_convnn',
+                                   global_step_tensor=self.global_step)
+        layer = layers.flatten(layer)
+
+        return tf.reshape(layer, (-1, num_frames, layer.get_shape()[1].value))
+
+    def _graph_frame_embeddings_to_lowd(self, tf_frame_embeddings, is_training):
+        """
+        :param tf_frame_embeddings: [batch_size, obs_history_len, frame_embedding_dim]
+        :return: [batch_size, rnn_state_dim]
+        """
+        assert(tf_frame_embeddings.get_shape()[1].value == self._obs_history_len)
+        frame_embedding_dim = tf_frame_embeddings.get_shape()[2].value
+        layer = tf.reshape(tf_frame_embeddings, (-1, self._obs_history_len * frame_embedding_dim))
+
+        ### obs --> internal state
+        tf_obs_lowd, _ = networks.fcnn(layer, self._observation_graph, is_training=is_training,
+                                       scope='obs_to_lowd_fcnn', global_step_tensor=self.global_step)
+
+        return tf_obs_lowd
+
+    def _graph_obs_target_to_lowd(self, tf_obs_target_ph, tf_preprocess):
+        """
+        :param tf_obs_target_ph: [batch_size, N + obs_history_len, obs_dim]
+        :return: lowd of the N+1 overlapping obs_history_len windows, packed along the batch [(N+1)*batch_size, ...]
+        """
+        L = self._obs_history_len
+        if self._obs_per_frame:
+            ### encode each unique frame once, then assemble the windows from the frame embeddings
+            with tf.name_scope('obs_to_lowd'):
+                tf_frame_embeddings = self._graph_obs_to_frame_embeddings(tf_obs_target_ph, tf_preprocess,
+                                                                          is_training=False)
+                tf_frame_embeddings_packed = xplatform.concat([tf_frame_embeddings[:, h - L:h, :]
+                                                               for h in range(L, L + self._N + 1)], 0)
+                tf_obs_lowd = self._graph_frame_embeddings_to_lowd(tf_frame_embeddings_packed, is_training=False)
+        else:
+            tf_obs_target_ph_packed = xplatform.concat([tf_obs_target_ph[:, h - L:h, :]
+                                                        for h in range(L, L + self._N + 1)], 0)
+            tf_obs_lowd = self._graph_obs_to_lowd(tf_obs_target_ph_packed, tf_preprocess, is_training=False)
+
+        return tf_obs_lowd
+
     def _graph_inference(self, tf_obs_lowd, tf_actions_ph, values_softmax, tf_preprocess, is_training, num_dp=1, N=None):
         """
         :param tf_obs_lowd: [batch_size, self._rnn_state_dim]
@@ -317,11 +469,32 @@ class MACPolicy(Parameterized, Serializable):
         :param scope_eval: which scope to select values (double Q-learning)
         :return: tf_get_action [batch_size, action_dim], tf_get_action_value [batch_size]
         """
+        ### process to lowd
+        with tf.variable_scope(scope_select, reuse=reuse_select):
+            tf_preprocess_select = self._graph_preprocess_placeholders()
+            tf_obs_lowd_select = self._graph_obs_to_lowd(tf_obs_ph, tf_preprocess_select, is_training=False)
+        with tf.variable_scope(scope_eval, reuse=reuse_eval):
+            tf_preprocess_eval = self._graph_preprocess_placeholders()
+            tf_obs_lowd_eval = self._graph_obs_to_lowd(tf_obs_ph, tf_preprocess_eval, is_training=False)
+
+        return self._graph_get_action_from_lowd(tf_obs_lowd_select, tf_obs_lowd_eval,
+                                                tf_preprocess_select, tf_preprocess_eval,
+                                                get_action_params, scope_select, reuse_select, scope_eval, reuse_eval,
+                                                tf_episode_timesteps_ph, N=N)
+
+    def _graph_get_action_from_lowd(self, tf_obs_lowd_select, tf_obs_lowd_eval, tf_preprocess_select, tf_preprocess_eval,
+                                    get_action_params, scope_select, reuse_select, scope_eval, reuse_eval,
+                                    tf_episode_timesteps_ph, N=None):
+        """
+        :param tf_obs_lowd_select: [batch_size, rnn_state_dim] in scope_select
+        :param tf_obs_lowd_eval: [batch_size, rnn_state_dim] in scope_eval
+        :return: tf_get_action [batch_size, action_dim], tf_get_action_value [batch_size]
+        """
         H = get_action_params['H']
         N = self._N if N is None else N
         assert(H <= N)
         get_action_type = get_action_params['type']
-        num_obs = tf.shape(tf_obs_ph)[0]
+        num_obs = tf.shape(tf_obs_lowd_select)[0]
         action_dim = self._env_spec.action_space.flat_dim
 
         ### create actions
@@ -347,13 +520,6 @@ class MACPolicy(Parameterized, Serializable):
         else:
             raise NotImplementedError
 
-        ### process to lowd
-        with tf.variable_scope(scope_select, reuse=reuse_select):
-            tf_preprocess_select = self._graph_preprocess_placeholders()
-            tf_obs_lowd_select = self._graph_obs_to_lowd(tf_obs_ph, tf_preprocess_select, is_training=False)
-        with tf.variable_scope(scope_eval, reuse=reuse_eval):
-            tf_preprocess_eval = self._graph_preprocess_placeholders()
-            tf_obs_lowd_eval = self._graph_obs_to_lowd(tf_obs_ph, tf_preprocess_eval, is_training=False)
         ### tile
         tf_actions = tf.tile(tf_actions, (num_obs, 1, 1))
         tf_obs_lowd_repeat_select = tf_utils.repeat_2d(tf_obs_lowd_select, K, 0)
@@ -414,8 +580,10 @@ class MACPolicy(Parameterized, Serializable):
         return tf_actions_explore
 
     def _graph_cost(self, tf_train_values, tf_train_values_softmax, tf_rewards_ph, tf_dones_ph,
-                    tf_target_get_action_values, N=None):
+                    tf_target_get_action_values, N=None, tf_sample_steps=None, tf_regularization_losses=None):
         """
+        :param tf_sample_steps: [None] step each sample was collected at
+        :param tf_regularization_losses: for the weight decay (None for the REGULARIZATION_LOSSES collection)
         :param tf_train_values: [None, self._N]
         :param tf_train_values_softmax: [None, self._N]
         :param tf_rewards_ph: [None, self._N]
@@ -464,44 +632,339 @@ class MACPolicy(Parameterized, Serializable):
         tf_mse = tf.reduce_sum(tf_weights * values_softmax * tf.square(tf_train_values - tf_values_desired))
 
         ### weight decay
-        if len(tf.get_collection(tf.GraphKeys.REGULARIZATION_LOSSES)) > 0:
-            tf_weight_decay = self._weight_decay * tf.add_n(tf.get_collection(tf.GraphKeys.REGULARIZATION_LOSSES))
+        if tf_regularization_losses is None:
+            tf_regularization_losses = tf.get_collection(tf.GraphKeys.REGULARIZATION_LOSSES)
+        if len(tf_regularization_losses) > 0:
+            tf_weight_decay = self._weight_decay * tf.add_n(tf_regularization_losses)
         else:
             tf_weight_decay = 0
         tf_cost = tf_mse + tf_weight_decay
 
         return tf_cost, tf_mse
 
-    def _graph_optimize(self, tf_cost, tf_policy_vars):
+    def _graph_optimize(self, tf_cost, tf_policy_vars, policy_scope):
         tf_lr_ph = tf.placeholder(tf.float32, (), name="learning_rate")
-        update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS)
+        tf_optimizer = tf_utils.FreshReadAdamOptimizer(learning_rate=tf_lr_ph, epsilon=1e-4)
+        tf_opt = self._graph_apply_gradients(tf_optimizer, tf_cost, tf_policy_vars, '{0}/'.format(policy_scope))
+        return tf_opt, tf_lr_ph, tf_optimizer
+
+    def _graph_apply_gradients(self, tf_optimizer, tf_cost, tf_policy_vars, update_ops_scope):
+        """
+        :param update_ops_scope: name scope of the training graph, so only its (e.g. batch norm) update ops run
+        """
+        update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS, scope=update_ops_scope)
         with tf.control_dependencies(update_ops):
-            optimizer = tf.train.AdamOptimizer(learning_rate=tf_lr_ph, epsilon=1e-4)
-            gradients = optimizer.compute_gradients(tf_cost, var_list=tf_policy_vars)
+            gradients = tf_optimizer.compute_gradients(tf_cost, var_list=tf_policy_vars)
             for i, (grad, var) in enumerate(gradients):
                 if grad is not None:
                     gradients[i] = (tf.clip_by_norm(grad, self._grad_clip_norm), var)
-            tf_opt = optimizer.apply_gradients(gradients, global_step=self.global_step)
-        return tf_opt, tf_lr_ph
+            tf_opt = tf_optimizer.apply_gradients(gradients, global_step=self.global_step)
+        return tf_opt
+
+    def _graph_get_value(self, tf_train_values_test, tf_train_values_softmax_test):
+        return tf.reduce_sum(tf_train_values_softmax_test * tf_train_values_test, reduction_indices=1)
+
+    def _graph_get_action_test(self, tf_obs_ph, policy_scope, tf_episode_timesteps_ph):
+        return self._graph_get_action(tf_obs_ph, self._get_action_test,
+                                      policy_scope, True, policy_scope, True,
+                                      tf_episode_timesteps_ph)
+
+    def _graph_get_action_target(self, tf_obs_lowd_select, tf_obs_lowd_eval, tf_preprocess_select, tf_preprocess_eval,
+                                 policy_scope, target_scope, reuse_target):
+        return self._graph_get_action_from_lowd(tf_obs_lowd_select, tf_obs_lowd_eval,
+                                                tf_preprocess_select, tf_preprocess_eval,
+                                                self._get_action_target,
+                                                scope_select=policy_scope,
+                                                reuse_select=True,
+                                                scope_eval=target_scope,
+                                                reuse_eval=reuse_target,
+                                                tf_episode_timesteps_ph=None) # TODO would need to fill in
+
+    def _graph_target_values(self, tf_obs_target_ph, tf_train_values, policy_scope, target_scope, reuse_target,
+                             tf_target_embeddings_ph=None, tf_preprocess_target=None):
+        """
+        :param tf_target_embeddings_ph: [batch_size, N+1, rnn_state_dim] precomputed target lowd (if cached)
+        :param tf_preprocess_target: target preprocess (if cached)
+        """
+        if self._use_target:
+            ### process the N+1 overlapping observation windows to lowd
+            with tf.variable_scope(policy_scope, reuse=True):
+                tf_preprocess_select = self._graph_preprocess_placeholders()
+                tf_obs_lowd_select = self._graph_obs_target_to_lowd(tf_obs_target_ph, tf_preprocess_select)
+            if tf_target_embeddings_ph is not None:
+                ### pack the same way as _graph_obs_target_to_lowd
+                tf_preprocess_eval = tf_preprocess_target
+                tf_obs_lowd_eval = tf.reshape(tf.transpose(tf_target_embeddings_ph, (1, 0, 2)),
+                                              (-1, tf_target_embeddings_ph.get_shape()[2].value))
+            else:
+                with tf.variable_scope(target_scope, reuse=reuse_target):
+                    tf_preprocess_eval = self._graph_preprocess_placeholders()
+                    tf_obs_lowd_eval = self._graph_obs_target_to_lowd(tf_obs_target_ph, tf_preprocess_eval)
+            ### action selection
+            tf_target_get_action, tf_target_get_action_values, _ = \
+                self._graph_get_action_target(tf_obs_lowd_select, tf_obs_lowd_eval,
+                                              tf_preprocess_select, tf_preprocess_eval,
+                                              policy_scope, target_scope, reuse_target)
+
+            tf_target_get_action_values = tf.transpose(tf.reshape(tf_target_get_action_values, (self._N + 1, -1)))[:, 1:]
+        else:
+            tf_target_get_action_values = tf.zeros([tf.shape(tf_train_values)[0], self._N])
+
+        return tf_target_get_action_values
+
+    def _graph_train_steps_placeholders(self):
+        obs_shape = self._env_spec.observation_space.shape
+        obs_dtype = tf.uint8 if len(obs_shape) > 1 else tf.float32
+        obs_dim = self._env_spec.observation_space.flat_dim
+        action_dim = self._env_spec.action_space.flat_dim
+        k = self._train_steps_per_run
+
+        with tf.variable_scope('train_steps_placeholders'):
+            tf_obs_ph = tf.placeholder(obs_dtype, [k, None, self._obs_history_len, obs_dim], name='tf_obs_ph')
+            tf_actions_ph = tf.placeholder(tf.float32, [k, None, self._N + 1, action_dim], name='tf_actions_ph')
+            tf_dones_ph = tf.placeholder(tf.bool, [k, None, self._N], name='tf_dones_ph')
+            tf_rewards_ph = tf.placeholder(tf.float32, [k, None, self._N], name='tf_rewards_ph')
+            tf_sample_steps_ph = tf.placeholder(tf.int32, [k, None], name='tf_sample_steps_ph')
+            tf_obs_target_ph = tf.placeholder(obs_dtype, [k, None, self._N + self._obs_history_len, obs_dim],
+                                              name='tf_obs_target_ph')
+
+        return tf_obs_ph, tf_actions_ph, tf_dones_ph, tf_rewards_ph, tf_sample_steps_ph, tf_obs_target_ph
+
+    def _graph_train_steps(self, tf_optimizer, tf_trainable_policy_vars, policy_scope, target_scope):
+        """
+        Chains train_steps_per_run optimizer steps so they run in a single session.run. Each step rebuilds the
+        training graph (with reuse) on new reads of the trainable variables (see tf_utils.FreshReadGetter), which
+        only happen after the previous step's update, and so do the weight decay and Adam's beta powers. Each step
+        only runs the update ops of its own name scope
+        """
+        tf_obs_ph, tf_actions_ph, tf_dones_ph, tf_rewards_ph, tf_sample_steps_ph, tf_obs_target_ph = \
+            self._graph_train_steps_placeholders()
+
+        tf_costs, tf_mses = [], []
+        tf_opt = None
+        for i in range(self._train_steps_per_run):
+            control_dependencies = [tf_opt] if tf_opt is not None else []
+            fresh_read_getter = tf_utils.FreshReadGetter()
+            with tf.control_dependencies(control_dependencies), \
+                 tf.variable_scope(tf.get_variable_scope(), custom_getter=fresh_read_getter), \
+                 tf.name_scope('train_steps_{0}'.format(i)) as train_steps_scope:
+                with tf.variable_scope(policy_scope, reuse=True):
+                    tf_preprocess = self._graph_preprocess_placeholders()
+                    tf_obs_lowd = self._graph_obs_to_lowd(tf_obs_ph[i], tf_preprocess, is_training=True)
+                    tf_train_values, tf_train_values_softmax, _, _ = \
+                        self._graph_inference(tf_obs_lowd, tf_actions_ph[i, :, :self._H, :],
+                                              self._values_softmax, tf_preprocess, is_training=True)
+                tf_target_get_action_values = self._graph_target_values(tf_obs_target_ph[i], tf_train_values,
+                                                                         policy_scope, target_scope, reuse_target=True)
+                tf_cost, tf_mse = self._graph_cost(tf_train_values, tf_train_values_softmax,
+                                                   tf_rewards_ph[i], tf_dones_ph[i], tf_target_get_action_values,
+                                                   tf_sample_steps=tf_sample_steps_ph[i],
+                                                   tf_regularization_losses=fresh_read_getter.regularization_losses)
+                tf_opt = self._graph_apply_gradients(tf_optimizer, tf_cost, tf_trainable_policy_vars,
+                                                     train_steps_scope)
+
+            tf_costs.append(tf_cost)
+            tf_mses.append(tf_mse)
+
+        return {
+            'obs_ph': tf_obs_ph,
+            'actions_ph': tf_actions_ph,
+            'dones_ph': tf_dones_ph,
+            'rewards_ph': tf_rewards_ph,
+            'sample_steps_ph': tf_sample_steps_ph,
+            'obs_target_ph': tf_obs_target_ph,
+            'costs': tf.stack(tf_costs),
+            'mses': tf.stack(tf_mses),
+            'opt': tf_opt
+        }
+
+    def _graph_train_inputs(self, tf_obs_ph, tf_actions_ph, tf_dones_ph, tf_rewards_ph, tf_sample_steps_ph,
+                            tf_obs_target_ph):
+        """
+        :return: op that stages the fed batch (None if feeding directly), and the training inputs
+        """
+        tf_inputs = [tf_obs_ph, tf_actions_ph, tf_dones_ph, tf_rewards_ph, tf_sample_steps_ph]
+        if self._use_target:
+            tf_inputs.append(tf_obs_target_ph)
+
+        if self._input_pipeline['type'] == 'feed_dict':
+            tf_staging_put = None
+            tf_train_inputs = tf_inputs
+        elif self._input_pipeline['type'] == 'staging':
+            ### batches are copied into the runtime when staged, and training consumes an already staged batch
+            with tf.variable_scope('staging'):
+                staging_area = tf.contrib.staging.StagingArea([t.dtype for t in tf_inputs])
+                tf_staging_put = staging_area.put(tf_inputs)
+                tf_train_inputs = staging_area.get()
+            for tf_train_input, tf_input in zip(tf_train_inputs, tf_inputs):
+                tf_train_input.set_shape(tf_input.get_shape())
+        else:
+            raise NotImplementedError
+
+        if not self._use_target:
+            tf_train_inputs = list(tf_train_inputs) + [tf_obs_target_ph]
+
+        return tf_staging_put, tf_train_inputs
 
     def _graph_init_vars(self, tf_sess):
         tf_sess.run([xplatform.global_variables_initializer()])
 
+    ### graph cache
+
+    @classmethod
+    def get_config_key(cls, kwargs):
+        """ Hash of everything that determines the constructed graph """
+        md5 = hashlib.md5()
+        graph_kwargs = dict([(k, v) for k, v in kwargs.items()
+                             if k not in ('env_spec', 'gpu_device', 'gpu_frac', 'graph_cache_dir',
+                                          'profile_every_n_steps', 'profile_on_signal', 'session_autotune')])
+        md5.update(json.dumps(graph_kwargs, sort_keys=True, default=str).encode())
+        md5.update(pickle.dumps(kwargs['env_spec'], protocol=2))
+        md5.update(tf.__version__.encode())
+        modules = set([sys.modules[c.__module__] for c in cls.__mro__
+                       if c.__module__.startswith('sandbox.gkahn')] + [networks, tf_utils, networks.rnn_cell])
+        for module in sorted(modules, key=lambda m: m.__name__):
+            with open(inspect.getsourcefile(module), 'rb') as f:
+                md5.update(f.read())
+        return md5.hexdigest()
+
+    def _graph_cache_file(self):
+        return os.path.join(self._graph_cache_dir, '{0}_{1}.pkl'.format(type(self).__name__, self._config_key))
+
+    def _graph_save_cache(self, tf_dict):
+        d = {
+            'meta_graph': tf.train.export_meta_graph(graph=tf_dict['graph'], clear_devices=True).SerializeToString(),
+            'tf_dict': tf_utils.graph_element_names(dict([(k, v) for k, v in tf_dict.items()
+                                                          if k not in ('sess', 'graph')])),
+            'global_step': tf_utils.graph_element_names(self.global_step)
+        }
+        os.makedirs(self._graph_cache_dir, exist_ok=True)
+        fname = self._graph_cache_file()
+        joblib.dump(d, fname + '.tmp')
+        os.replace(fname + '.tmp', fname) # atomic, in case of concurrent runs
+
+    def _graph_load_cache(self, tf_sess):
+        d = joblib.load(self._graph_cache_file())
+        tf_graph = tf_sess.graph
+
+        with tf_sess.as_default(), tf_graph.as_default():
+            if ext.get_seed() is not None:
+                ext.set_seed(ext.get_seed())
+
+            meta_graph_def = tf.MetaGraphDef()
+            meta_graph_def.ParseFromString(d['meta_graph'])
+            tf.train.import_meta_graph(meta_graph_def)
+
+            tf_dict = tf_utils.graph_elements_by_name(d['tf_dict'], tf_graph)
+            self.global_step = tf_utils.graph_elements_by_name(d['global_step'], tf_graph)
+
+            ### initialize
+            self._graph_init_vars(tf_sess)
+
+        tf_dict['sess'] = tf_sess
+        tf_dict['graph'] = tf_graph
+        return tf_dict
+
+    ### session autotune
+
+    def _graph_autotune_runs(self):
+        """ One iteration of acting and of training on synthetic inputs """
+        batch_size = self._session_autotune['batch_size']
+        obs_dtype = np.uint8 if self._obs_is_im else np.float32
+        obs_dim = self._env_spec.observation_space.flat_dim
+        action_dim = self._env_spec.action_space.flat_dim
+
+        act_feed_dict = {
+            self._tf_dict['obs_ph']: np.zeros((1, self._obs_history_len, obs_dim), dtype=obs_dtype),
+            self._tf_dict['episode_timesteps_ph']: [0]
+        }
+        train_feed_dict = {
+            self._tf_dict['lr_ph']: 0.,
+            self._tf_dict['obs_ph']: np.zeros((batch_size, self._obs_history_len, obs_dim), dtype=obs_dtype),
+            self._tf_dict['actions_ph']: np.zeros((batch_size, self._N + 1, action_dim), dtype=np.float32),
+            self._tf_dict['dones_ph']: np.zeros((batch_size, self._N), dtype=bool),
+            self._tf_dict['rewards_ph']: np.zeros((batch_size, self._N), dtype=np.float32),
+            self._tf_dict['sample_steps_ph']: np.arange(batch_size, dtype=np.int32),
+            self._tf_dict['obs_target_ph']: np.zeros((batch_size, self._N + self._obs_history_len, obs_dim),
+                                                     dtype=obs_dtype)
+        }
+        if self._cache_target_embeddings:
+            train_feed_dict[self._tf_dict['target_embeddings_ph']] = \
+                np.zeros((batch_size, self._N + 1, self._observation_graph['output_dim']), dtype=np.float32)
+
+        def act(sess):
+            self._autotune_act(sess, act_feed_dict)
+
+        def train(sess):
+            if self._tf_dict['staging_put'] is not None:
+                sess.run(self._tf_dict['staging_put'], feed_dict=train_feed_dict)
+            sess.run([self._tf_dict['cost'], self._tf_dict['opt']], feed_dict=train_feed_dict)
+
+        return {'act': act, 'train': train}
+
+    def _autotune_act(self, sess, feed_dict):
+        """ Runs what get_actions runs for one action (planners that run ops before get_action override this) """
+        sess.run([self._tf_dict['get_action'], self._tf_dict['get_action_value']], feed_dict=feed_dict)
+
+    def _graph_autotune_session(self):
+        """
+        :return: new session using the fastest session params for session_autotune target (acting or training)
+        """
+        tf_graph = self._tf_dict['graph']
+        autotuner = SessionAutotuner(self._session_autotune['cache_dir'], self._config_key)
+        fastest = autotuner.load()
+        if fastest is None:
+            logger.log('Autotuning session params')
+            create_session = lambda session_params: tf.Session(
+                graph=tf_graph,
+                config=MACPolicy.create_session_config(gpu_device=self._gpu_device, gpu_frac=self._gpu_frac,
+                                                       session_params=session_params))
+            ### also try the default session params
+            grid_params = dict(self._session_autotune)
+            for k, v in self._default_session_params.items():
+                grid_params[k] = sorted(set(list(grid_params[k]) + [v]))
+            fastest = autotuner.tune(tf_graph, create_session, self._graph_autotune_runs(),
+                                     session_params_grid(grid_params),
+                                     self._session_autotune['num_runs'])
+        for name, session_params in sorted(fastest.items()):
+            logger.log('Fastest session params for {0}: {1}'.format(name, session_params))
+
+        self._tf_dict['sess'].close()
+        tf_sess = tf.Session(graph=tf_graph,
+                             config=MACPolicy.create_session_config(
+                                 gpu_device=self._gpu_device, gpu_frac=self._gpu_frac,
+                                 session_params=fastest[self._session_autotune['target']]))
+        with tf_sess.as_default(), tf_graph.as_default():
+            self._graph_init_vars(tf_sess)
+        return tf_sess
+
     def _graph_setup(self):
         ### create session and graph
         tf_sess = tf.get_default_session()
         if tf_sess is None:
-            tf_sess, tf_graph = MACPolicy.create_session_and_graph(gpu_device=self._gpu_device, gpu_frac=self._gpu_frac)
+            tf_sess, tf_graph = MACPolicy.create_session_and_graph(gpu_device=self._gpu_device, gpu_frac=self._gpu_frac,
+                                                                   session_params=self._default_session_params)
         tf_graph = tf_sess.graph
 
+        ### the cached graph can only be used if it will be the whole graph
+        use_graph_cache = self._graph_cache_dir is not None and len(tf_graph.get_operations()) == 0
+        if use_graph_cache and os.path.exists(self._graph_cache_file()):
+            logger.log('Loading cached graph {0}'.format(self._graph_cache_file()))
+            return self._graph_load_cache(tf_sess)
+
         with tf_sess.as_default(), tf_graph.as_default():
             if ext.get_seed() is not None:
                 ext.set_seed(ext.get_seed())
 
             ### create input output placeholders
-            tf_obs_ph, tf_actions_ph, tf_dones_ph, tf_rewards_ph, tf_obs_target_ph, \
+            tf_obs_ph, tf_actions_ph, tf_dones_ph, tf_rewards_ph, tf_sample_steps_ph, tf_obs_target_ph, \
                 tf_test_es_ph_dict, tf_episode_timesteps_ph = self._graph_input_output_placeholders()
             self.global_step = tf.Variable(0, trainable=False, name='global_step')
+            ### training inputs
+            tf_staging_put, (tf_train_obs, tf_train_actions, tf_train_dones, tf_train_rewards, tf_train_sample_steps,
+                             tf_train_obs_target) = \
+                self._graph_train_inputs(tf_obs_ph, tf_actions_ph, tf_dones_ph, tf_rewards_ph, tf_sample_steps_ph,
+                                         tf_obs_target_ph)
 
             ### policy
             policy_scope = 'policy'
@@ -509,50 +972,51 @@ class MACPolicy(Parameterized, Serializable):
                 ### create preprocess placeholders
                 tf_preprocess = self._graph_preprocess_placeholders()
                 ### process obs to lowd
-                tf_obs_lowd = self._graph_obs_to_lowd(tf_obs_ph, tf_preprocess, is_training=True)
+                tf_obs_lowd = self._graph_obs_to_lowd(tf_train_obs, tf_preprocess, is_training=True)
                 ### create training policy
                 tf_train_values, tf_train_values_softmax, _, _ = \
-                    self._graph_inference(tf_obs_lowd, tf_actions_ph[:, :self._H, :],
+                    self._graph_inference(tf_obs_lowd, tf_train_actions[:, :self._H, :],
                                           self._values_softmax, tf_preprocess, is_training=True)
 
             with tf.variable_scope(policy_scope, reuse=True):
+                if tf_staging_put is not None:
+                    ### the training lowd is computed from the staged batch, not from the obs placeholder
+                    tf_obs_lowd = self._graph_obs_to_lowd(tf_obs_ph, tf_preprocess, is_training=False)
                 tf_train_values_test, tf_train_values_softmax_test, _, _ = \
                     self._graph_inference(tf_obs_lowd, tf_actions_ph[:, :self._get_action_test['H'], :],
                                           self._values_softmax, tf_preprocess, is_training=False)
-                tf_get_value = tf.reduce_sum(tf_train_values_softmax_test * tf_train_values_test, reduction_indices=1)
+                tf_get_value = self._graph_get_value(tf_train_values_test, tf_train_values_softmax_test)
 
-            ### action selection
-            tf_get_action, tf_get_action_value, tf_get_action_reset_ops = \
-                self._graph_get_action(tf_obs_ph, self._get_action_test,
-                                       policy_scope, True, policy_scope, True,
-                                       tf_episode_timesteps_ph)
-            ### exploration strategy and logprob
-            tf_get_action_explore = self._graph_get_action_explore(tf_get_action, tf_test_es_ph_dict)
-
-            ### get policy variables
+            ### get policy variables (not the planner state of action selection, which has no target copy)
             tf_policy_vars = sorted(tf.get_collection(xplatform.global_variables_collection_name(),
                                                       scope=policy_scope), key=lambda v: v.name)
             tf_trainable_policy_vars = sorted(tf.get_collection(xplatform.trainable_variables_collection_name(),
                                                                 scope=policy_scope), key=lambda v: v.name)
 
+            ### action selection (planners can add their own ops to get_action_extras)
+            self._tf_get_action_extras = dict()
+            tf_get_action, tf_get_action_value, tf_get_action_reset_ops = \
+                self._graph_get_action_test(tf_obs_ph, policy_scope, tf_episode_timesteps_ph)
+            ### exploration strategy and logprob
+            tf_get_action_explore = self._graph_get_action_explore(tf_get_action, tf_test_es_ph_dict)
+
             ### create target network
-            if self._use_target:
-                target_scope = 'target' if self._separate_target_params else 'policy'
-                ### action selection
-                tf_obs_target_ph_packed = xplatform.concat([tf_obs_target_ph[:, h - self._obs_history_len:h, :]
-                                                     for h in range(self._obs_history_len, self._obs_history_len + self._N + 1)],
-                                                    0)
-                tf_target_get_action, tf_target_get_action_values, _ = self._graph_get_action(tf_obs_target_ph_packed,
-                                                                                              self._get_action_target,
-                                                                                              scope_select=policy_scope,
-                                                                                              reuse_select=True,
-                                                                                              scope_eval=target_scope,
-                                                                                              reuse_eval=(target_scope == policy_scope),
-                                                                                              tf_episode_timesteps_ph=None) # TODO would need to fill in
-
-                tf_target_get_action_values = tf.transpose(tf.reshape(tf_target_get_action_values, (self._N + 1, -1)))[:, 1:]
+            target_scope = 'target' if self._separate_target_params else 'policy'
+            if self._cache_target_embeddings:
+                ### target lowd is computed separately and cached in the replay pool
+                with tf.variable_scope(target_scope):
+                    tf_preprocess_target = self._graph_preprocess_placeholders()
+                    tf_get_target_embeddings = self._graph_obs_to_lowd(tf_obs_ph, tf_preprocess_target, is_training=False)
+                tf_target_embeddings_ph = tf.placeholder(tf.float32,
+                                                         [None, self._N + 1, self._observation_graph['output_dim']],
+                                                         name='tf_target_embeddings_ph')
             else:
-                tf_target_get_action_values = tf.zeros([tf.shape(tf_train_values)[0], self._N])
+                tf_preprocess_target, tf_get_target_embeddings, tf_target_embeddings_ph = None, None, None
+            tf_target_get_action_values = self._graph_target_values(tf_train_obs_target, tf_train_values,
+                                                                     policy_scope, target_scope,
+                                                                     reuse_target=(target_scope == policy_scope),
+                                                                     tf_target_embeddings_ph=tf_target_embeddings_ph,
+                                                                     tf_preprocess_target=tf_preprocess_target)
 
             ### update target network
             if self._use_target and self._separate_target_params:
@@ -571,21 +1035,29 @@ class MACPolicy(Parameterized, Serializable):
                 tf_update_target_fn = None
 
             ### optimization
-            tf_cost, tf_mse = self._graph_cost(tf_train_values, tf_train_values_softmax, tf_rewards_ph, tf_dones_ph,
-                                               tf_target_get_action_values)
-            tf_opt, tf_lr_ph = self._graph_optimize(tf_cost, tf_trainable_policy_vars)
+            tf_cost, tf_mse = self._graph_cost(tf_train_values, tf_train_values_softmax, tf_train_rewards, tf_train_dones,
+                                               tf_target_get_action_values, tf_sample_steps=tf_train_sample_steps)
+            tf_opt, tf_lr_ph, tf_optimizer = self._graph_optimize(tf_cost, tf_trainable_policy_vars, policy_scope)
+
+            ### multiple optimization steps per session.run
+            if self._train_steps_per_run > 1:
+                tf_train_steps = self._graph_train_steps(tf_optimizer, tf_trainable_policy_vars,
+                                                         policy_scope, target_scope)
+            else:
+                tf_train_steps = None
 
             ### initialize
             self._graph_init_vars(tf_sess)
 
         ### what to return
-        return {
+        tf_dict = {
             'sess': tf_sess,
             'graph': tf_graph,
             'obs_ph': tf_obs_ph,
             'actions_ph': tf_actions_ph,
             'dones_ph': tf_dones_ph,
             'rewards_ph': tf_rewards_ph,
+            'sample_steps_ph': tf_sample_steps_ph,
             'obs_target_ph': tf_obs_target_ph,
             'test_es_ph_dict': tf_test_es_ph_dict,
             'episode_timesteps_ph': tf_episode_timesteps_ph,
@@ -595,15 +1067,25 @@ class MACPolicy(Parameterized, Serializable):
             'get_action_explore': tf_get_action_explore,
             'get_action_value': tf_get_action_value,
             'get_action_reset_ops': tf_get_action_reset_ops,
+            'get_action_extras': self._tf_get_action_extras,
+            'get_target_embeddings': tf_get_target_embeddings,
+            'target_embeddings_ph': tf_target_embeddings_ph,
             'update_target_fn': tf_update_target_fn,
             'cost': tf_cost,
             'mse': tf_mse,
             'opt': tf_opt,
             'lr_ph': tf_lr_ph,
+            'staging_put': tf_staging_put,
+            'train_steps': tf_train_steps,
             'policy_vars': tf_policy_vars,
             'target_vars': tf_target_vars
         }
 
+        if use_graph_cache:
+            self._graph_save_cache(tf_dict)
+
+        return tf_dict
+
     ################
     ### Training ###
     ################
@@ -638,18 +1120,105 @@ class MACPolicy(Parameterized, Serializable):
                               #                                        scipy.linalg.block_diag(
                               #                                            *([rewards_orth] * self.N_output))
                           })
+        if len(tf_assigns) > 0:
+            ### the target network lowd depends on the preprocessing (e.g. cached in the replay pool)
+            self._target_version += 1
 
     def update_target(self):
         if self._use_target and self._separate_target_params and self._tf_dict['update_target_fn']:
             self._tf_dict['sess'].run(self._tf_dict['update_target_fn'])
+            self._target_version += 1
+
+    #################
+    ### Profiling ###
+    #################
+
+    PROFILE_CATEGORIES = ('Conv', 'ObsFcnn', 'ActionFcnn', 'Rnn', 'OutputFcnn', 'RepeatTile', 'Cem',
+                          'Gradients', 'Optimizer', 'Other')
 
-    def train_step(self, step, steps, observations, actions, rewards, values, dones, logprobs, use_target):
+    @property
+    def _profile_enabled(self):
+        return self._profile_every_n_steps is not None or self._profile_on_signal
+
+    def profile_next(self):
+        """ Traces the next train_step and get_actions (the gcg entry point calls this on SIGUSR1) """
+        self._profile_pending.update(('train_step', 'get_actions'))
+
+    def _profile_run_kwargs(self, name, step):
+        """ session.run kwargs to trace this run (empty if not profiling it) """
+        if self._profile_every_n_steps is None and len(self._profile_pending) == 0:
+            return {}
+
+        profile = name in self._profile_pending
+        if self._profile_every_n_steps is not None:
+            period = int(step) // int(self._profile_every_n_steps)
+            if period > self._profile_last_period[name]:
+                self._profile_last_period[name] = period
+                profile = True
+        if not profile:
+            return {}
+
+        self._profile_pending.discard(name)
+        return {
+            'options': tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE),
+            'run_metadata': tf.RunMetadata()
+        }
+
+    def _profile_category(self, node_name, op_type):
+        scopes = node_name.split('/')
+        if 'gradients' in scopes:
+            return 'Gradients'
+        if op_type.startswith('Apply') or op_type.startswith('ResourceApply'):
+            return 'Optimizer'
+        if op_type == 'Tile':
+            return 'RepeatTile'
+        for scope, category in (('obs_to_lowd_convnn', 'Conv'),
+                                ('obs_to_lowd_fcnn', 'ObsFcnn'),
+                                ('fcnn_actions', 'ActionFcnn'),
+                                ('rnn', 'Rnn'),
+                                ('fcnn_values', 'OutputFcnn'),
+                                ('fcnn_rewards', 'OutputFcnn')):
+            if scope in scopes:
+                return category
+        if 'cem' in scopes:
+            return 'Cem'
+        return 'Other'
+
+    def _profile_save(self, name, step, run_kwargs):
+        """ Writes the chrome trace timeline and records the time per category """
+        if len(run_kwargs) == 0:
+            return
+        step_stats = run_kwargs['run_metadata'].step_stats
+
+        snapshot_dir = logger.get_snapshot_dir()
+        if snapshot_dir is not None:
+            fname = os.path.join(snapshot_dir, 'timeline_{0}_{1:d}.json'.format(name, int(step)))
+            with open(fname, 'w') as f:
+                f.write(timeline.Timeline(step_stats).generate_chrome_trace_format())
+
+        category_micros = defaultdict(float)
+        for node_name, op_type, micros in tf_utils.step_stats_op_times(step_stats):
+            category_micros[self._profile_category(node_name, op_type)] += micros
+        for category in MACPolicy.PROFILE_CATEGORIES:
+            self._log_stats['Profile/{0}/{1}Ms'.format(name, category)].append(1e-3 * category_micros[category])
+
+    def get_target_embeddings(self, observations):
+        """
+        :param observations: [batch_size, obs_history_len, obs_dim]
+        :return: target network lowd [batch_size, rnn_state_dim]
+        """
+        return self._tf_dict['sess'].run(self._tf_dict['get_target_embeddings'],
+                                         feed_dict={self._tf_dict['obs_ph']: observations})
+
+    def train_step(self, step, steps, observations, actions, rewards, values, dones, logprobs, use_target,
+                   target_embeddings=None):
         """
         :param steps: [batch_size, N+1]
         :param observations: [batch_size, N+1 + obs_history_len-1, obs_dim]
         :param actions: [batch_size, N+1, action_dim]
         :param rewards: [batch_size, N+1]
         :param dones: [batch_size, N+1]
+        :param target_embeddings: [batch_size, N+1, rnn_state_dim] cached target lowd (if caching)
         """
         feed_dict = {
             ### parameters
@@ -659,24 +1228,74 @@ class MACPolicy(Parameterized, Serializable):
             self._tf_dict['actions_ph']: actions,
             self._tf_dict['dones_ph']: np.logical_or(not use_target, dones[:, :self._N]),
             self._tf_dict['rewards_ph']: rewards[:, :self._N],
+            self._tf_dict['sample_steps_ph']: steps[:, 0],
         }
         if self._use_target:
             feed_dict[self._tf_dict['obs_target_ph']] = observations
-
-        cost, mse, _ = self._tf_dict['sess'].run([self._tf_dict['cost'],
-                                                  self._tf_dict['mse'],
-                                                  self._tf_dict['opt']],
-                                                 feed_dict=feed_dict)
+        if self._cache_target_embeddings:
+            feed_dict[self._tf_dict['target_embeddings_ph']] = target_embeddings
+
+        if self._tf_dict['staging_put'] is not None:
+            ### stage this batch, and train on the oldest staged batch once enough are staged
+            if self._num_staged < self._input_pipeline['staging']['num_prefetch']:
+                self._tf_dict['sess'].run(self._tf_dict['staging_put'], feed_dict=feed_dict)
+                self._num_staged += 1
+                return
+
+            run_kwargs = self._profile_run_kwargs('train_step', step)
+            cost, mse, _, _ = self._tf_dict['sess'].run([self._tf_dict['cost'],
+                                                         self._tf_dict['mse'],
+                                                         self._tf_dict['opt'],
+                                                         self._tf_dict['staging_put']],
+                                                        feed_dict=feed_dict, **run_kwargs)
+        else:
+            run_kwargs = self._profile_run_kwargs('train_step', step)
+            cost, mse, _ = self._tf_dict['sess'].run([self._tf_dict['cost'],
+                                                      self._tf_dict['mse'],
+                                                      self._tf_dict['opt']],
+                                                     feed_dict=feed_dict, **run_kwargs)
         assert(np.isfinite(cost))
+        self._profile_save('train_step', step, run_kwargs)
 
         self._log_stats['Cost'].append(cost)
         self._log_stats['mse/cost'].append(mse / cost)
 
+    def train_steps(self, step, steps, observations, actions, rewards, values, dones, logprobs, use_target):
+        """
+        Runs train_steps_per_run training steps in one session.run. Each input is a stack of batches
+        (leading dimension train_steps_per_run) with the same layout as in train_step
+        """
+        assert(self._tf_dict['train_steps'] is not None)
+        assert(len(observations) == self._train_steps_per_run)
+
+        feed_dict = {
+            ### parameters
+            self._tf_dict['lr_ph']: self._lr_schedule.value(step),
+            ### policy
+            self._tf_dict['train_steps']['obs_ph']: observations[:, :, :self._obs_history_len, :],
+            self._tf_dict['train_steps']['actions_ph']: actions,
+            self._tf_dict['train_steps']['dones_ph']: np.logical_or(not use_target, dones[:, :, :self._N]),
+            self._tf_dict['train_steps']['rewards_ph']: rewards[:, :, :self._N],
+            self._tf_dict['train_steps']['sample_steps_ph']: steps[:, :, 0],
+        }
+        if self._use_target:
+            feed_dict[self._tf_dict['train_steps']['obs_target_ph']] = observations
+
+        costs, mses, _ = self._tf_dict['sess'].run([self._tf_dict['train_steps']['costs'],
+                                                    self._tf_dict['train_steps']['mses'],
+                                                    self._tf_dict['train_steps']['opt']],
+                                                   feed_dict=feed_dict)
+        assert(np.all(np.isfinite(costs)))
+
+        self._log_stats['Cost'] += list(costs)
+        self._log_stats['mse/cost'] += list(mses / costs)
+
     def reset_weights(self):
         tf_sess = self._tf_dict['sess']
         tf_graph = tf_sess.graph
         with tf_sess.as_default(), tf_graph.as_default():
             self._graph_init_vars(tf_sess)
+        self._target_version += 1
 
     ######################
     ### Policy methods ###
@@ -693,6 +1312,7 @@ class MACPolicy(Parameterized, Serializable):
             self._tf_dict['obs_ph']: observations,
             self._tf_dict['episode_timesteps_ph']: current_episode_steps
         }
+        run_kwargs = self._profile_run_kwargs('get_actions', steps[0])
         if explore:
             if self._gaussian_es:
                 feed_dict[self._tf_dict['test_es_ph_dict']['gaussian']] = [self._gaussian_es.schedule.value(t) for t in steps]
@@ -702,11 +1322,12 @@ class MACPolicy(Parameterized, Serializable):
 
             actions, values = self._tf_dict['sess'].run([self._tf_dict['get_action_explore'],
                                                          self._tf_dict['get_action_value']],
-                                                        feed_dict=feed_dict)
+                                                        feed_dict=feed_dict, **run_kwargs)
         else:
             actions, values = self._tf_dict['sess'].run([self._tf_dict['get_action'],
                                                          self._tf_dict['get_action_value']],
-                                                        feed_dict=feed_dict)
+                                                        feed_dict=feed_dict, **run_kwargs)
+        self._profile_save('get_actions', steps[0], run_kwargs)
 
         logprobs = [np.nan] * len(steps)
 
@@ -733,11 +1354,86 @@ class MACPolicy(Parameterized, Serializable):
         with self._tf_dict['graph'].as_default():
             return sorted(tf.get_collection(xplatform.global_variables_collection_name()), key=lambda v: v.name)
 
+    def get_checkpoint_values(self):
+        """
+        :return: dict of variable name to value of every variable (a snapshot, so can be written asynchronously)
+        """
+        tf_vars = self.get_params_internal()
+        return dict(zip([v.name for v in tf_vars], self._tf_dict['sess'].run(tf_vars)))
+
+    def restore_checkpoint(self, values):
+        """
+        :param values: dict from get_checkpoint_values
+        """
+        tf_vars = self.get_params_internal()
+        assert(set([v.name for v in tf_vars]) == set(values.keys()))
+        for tf_var in tf_vars:
+            tf_var.load(values[tf_var.name], self._tf_dict['sess'])
+        self._target_version += 1
+
+    def export_inference_graph(self, fname):
+        """
+        Saves only the action selection subgraph with the variables folded into constants and the
+        assertions stripped, to be loaded by FrozenMACPolicy. Variables that the action selection
+        (including the get_action_extras ops of the planner) assigns to, e.g. warm starts, are kept
+        as variables and reinitialized on load.
+        """
+        tf_sess = self._tf_dict['sess']
+        tf_graph = self._tf_dict['graph']
+        tf_extras = self._tf_dict['get_action_extras']
+
+        with tf_graph.as_default():
+            tf_outputs = [self._tf_dict['get_action'], self._tf_dict['get_action_explore'], self._tf_dict['get_action_value']]
+            tf_extra_outputs = [x for planner_extras in tf_extras.values() for x in planner_extras.values()]
+            output_node_names = [t.op.name for t in tf_outputs] + \
+                                [op.name for op in self._tf_dict['get_action_reset_ops']] + \
+                                [x.name if isinstance(x, tf.Operation) else x.op.name for x in tf_extra_outputs]
+
+            ### the variables the action selection assigns to are kept, with their initializers as outputs
+            graph_def = tf_graph.as_graph_def()
+            stateful_var_names = tf_utils.assigned_variable_names(
+                tf.graph_util.extract_sub_graph(graph_def, output_node_names))
+            init_op_names = [v.initializer.name for v in tf.global_variables() if v.op.name in stateful_var_names]
+            output_node_names += init_op_names
+            graph_def = tf_utils.strip_assert_dependencies(graph_def, output_node_names)
+            graph_def = tf.graph_util.convert_variables_to_constants(tf_sess, graph_def, output_node_names,
+                                                                     variable_names_blacklist=stateful_var_names)
+
+        d = {
+            'graph_def': graph_def.SerializeToString(),
+            'obs_ph': self._tf_dict['obs_ph'].name,
+            'episode_timesteps_ph': self._tf_dict['episode_timesteps_ph'].name,
+            'test_es_ph_dict': dict([(k, v.name) for k, v in self._tf_dict['test_es_ph_dict'].items()]),
+            'get_action': self._tf_dict['get_action'].name,
+            'get_action_explore': self._tf_dict['get_action_explore'].name,
+            'get_action_value': self._tf_dict['get_action_value'].name,
+            'get_action_reset_ops': [op.name for op in self._tf_dict['get_action_reset_ops']],
+            'get_action_extras': tf_utils.graph_element_names(tf_extras),
+            'get_action_test': self._get_action_test,
+            'init_ops': init_op_names,
+            'N': self._N,
+            'gamma': self._gamma,
+            'obs_history_len': self._obs_history_len,
+            'only_completed_episodes': self._only_completed_episodes,
+            'is_discrete': isinstance(self._env_spec.action_space, Discrete),
+            'gaussian_es_schedule': self._gaussian_es.schedule if self._gaussian_es else None,
+            'epsilon_greedy_es_schedule': self._epsilon_greedy_es.schedule if self._epsilon_greedy_es else None
+        }
+        joblib.dump(d, fname, compress=3)
+
     ###############
     ### Logging ###
     ###############
 
     def log(self):
+        if self._profile_enabled:
+            ### always record the same columns, even if nothing was profiled since the last log
+            for name in ('train_step', 'get_actions'):
+                for category in MACPolicy.PROFILE_CATEGORIES:
+                    key = 'Profile/{0}/{1}Ms'.format(name, category)
+                    if len(self._log_stats[key]) == 0:
+                        self._log_stats[key].append(np.nan)
+
         for k in sorted(self._log_stats.keys()):
             if k == 'Depth':
                 logger.record_tabular(k+'Mean', np.mean(self._log_stats[k]))
@@ -1,17 +1,18 @@
+import time
 import numpy as np
 import tensorflow as tf
 
 from rllab.core.serializable import Serializable
-from rllab.misc import ext
 
 from sandbox.gkahn.gcg.policies.mac_policy import MACPolicy
+from sandbox.gkahn.gcg.policies.get_action_extras import GetActionExtrasMixin
 from sandbox.gkahn.gcg.tf import tf_utils
 from sandbox.gkahn.tf.core import xplatform
 from sandbox.gkahn.gcg.tf import networks
 
 from sandbox.rocky.tf.spaces.discrete import Discrete
 
-class RCcarMACPolicy(MACPolicy, Serializable):
+class RCcarMACPolicy(MACPolicy, GetActionExtrasMixin, Serializable):
     def __init__(self, **kwargs):
         Serializable.quick_init(self, locals())
 
@@ -19,22 +20,69 @@ class RCcarMACPolicy(MACPolicy, Serializable):
         self._is_classification = kwargs['is_classification']
         self._probcoll_strictly_increasing = kwargs['probcoll_strictly_increasing']
         self._coll_weight_pct = kwargs['coll_weight_pct']
+        self._ensemble = kwargs.get('ensemble', None) or {'size': 1}
+        self._ensemble_size = self._ensemble['size']
+        if self._ensemble_size > 1:
+            ### checked before MACPolicy builds the graph
+            assert(not kwargs.get('cache_target_embeddings', False))
+            assert(kwargs['image_graph'] is None or not kwargs['image_graph'].get('per_frame', False))
+            assert(not kwargs['get_action_test'].get('random', {}).get('bank_size', 0))
 
         MACPolicy.__init__(self, **kwargs)
 
         assert(self._H == self._N)
 
+        self._num_get_actions = 0
+        self._action_bank_stale = True
+
+    @classmethod
+    def default_session_params(cls, kwargs):
+        """ The ensemble members' subgraphs are independent, so run them in parallel """
+        ensemble = kwargs.get('ensemble', None) or {'size': 1}
+        if ensemble['size'] > 1:
+            return {'inter_op_threads': ensemble['size']}
+        return dict()
+
     ###########################
     ### TF graph operations ###
     ###########################
 
-    def _graph_inference(self, tf_obs_lowd, tf_actions_ph, values_softmax, tf_preprocess, is_training, num_dp=1):
+    def _graph_action_embeddings(self, tf_actions, is_training, num_dp=1):
+        """
+        :param tf_actions: [batch_size, H, action_dim]
+        :return: [batch_size, H, action embedding dim]
+        """
+        H = tf_actions.get_shape()[1].value
+        action_dim = tf_actions.get_shape()[2].value
+
+        self._action_graph.update({'output_dim': self._observation_graph['output_dim']})
+        actions = tf.reshape(tf_actions, (-1, action_dim))
+        tf_embeddings, _ = networks.fcnn(actions, self._action_graph, is_training=is_training, scope='fcnn_actions',
+                                         T=H, global_step_tensor=self.global_step, num_dp=num_dp)
+        return tf.reshape(tf_embeddings, (-1, H, self._action_graph['output_dim']))
+
+    def _graph_obs_to_lowd(self, tf_obs_ph, tf_preprocess, is_training):
+        """
+        :return: [batch_size, rnn_state_dim], or for an ensemble the members' concatenated [batch_size, E*rnn_state_dim]
+        """
+        if self._ensemble_size == 1:
+            return MACPolicy._graph_obs_to_lowd(self, tf_obs_ph, tf_preprocess, is_training)
+
+        tf_obs_lowds = []
+        for i in range(self._ensemble_size):
+            with tf.variable_scope('member_{0}'.format(i)):
+                tf_obs_lowds.append(MACPolicy._graph_obs_to_lowd(self, tf_obs_ph, tf_preprocess, is_training))
+        return tf.concat(tf_obs_lowds, axis=1)
+
+    def _graph_inference(self, tf_obs_lowd, tf_actions_ph, values_softmax, tf_preprocess, is_training, num_dp=1,
+                         tf_action_embeddings=None):
         """
         :param tf_obs_lowd: [batch_size, self._rnn_state_dim]
         :param tf_actions_ph: [batch_size, H, action_dim]
         :param values_softmax: string
         :param tf_preprocess:
-        :return: tf_values: [batch_size, H]
+        :param tf_action_embeddings: precomputed fcnn_actions output for tf_actions_ph (optional)
+        :return: tf_values: [batch_size, H], or for an ensemble while training the members' [batch_size, H, E]
         """
         batch_size = tf.shape(tf_obs_lowd)[0]
         H = tf_actions_ph.get_shape()[1].value
@@ -42,14 +90,74 @@ class RCcarMACPolicy(MACPolicy, Serializable):
         assert(self._H == self._N)
         # tf.assert_equal(tf.shape(tf_obs_lowd)[0], tf.shape(tf_actions_ph)[0])
 
-        self._action_graph.update({'output_dim': self._observation_graph['output_dim']})
-        action_dim = tf_actions_ph.get_shape()[2].value
-        actions = tf.reshape(tf_actions_ph, (-1, action_dim))
-        rnn_inputs, _ = networks.fcnn(actions, self._action_graph, is_training=is_training, scope='fcnn_actions',
-                                      T=H, global_step_tensor=self.global_step, num_dp=num_dp)
-        rnn_inputs = tf.reshape(rnn_inputs, (-1, H, self._action_graph['output_dim']))
+        tf_values, _ = self._graph_values_and_state(tf_obs_lowd, tf_actions_ph, is_training, num_dp,
+                                                    tf_action_embeddings=tf_action_embeddings)
+        if self._ensemble_size > 1 and not is_training:
+            tf_values = self._graph_ensemble_aggregate(tf_values)
+        tf_values_softmax = self._values_softmax_weights(values_softmax) * tf.ones([batch_size, N])
+
+        assert(tf_values.get_shape()[1].value == H)
+
+        return tf_values, tf_values_softmax, None, None
 
-        rnn_outputs, _ = networks.rnn(rnn_inputs, self._rnn_graph, initial_state=tf_obs_lowd, num_dp=num_dp)
+    def _values_softmax_weights(self, values_softmax):
+        """
+        :return: weight of each of the N values [N]
+        """
+        N = self._N
+        if values_softmax['type'] == 'final':
+            weights = np.zeros(N, dtype=np.float32)
+            weights[-1] = 1.
+        elif values_softmax['type'] == 'mean':
+            weights = (1. / float(N)) * np.ones(N, dtype=np.float32)
+        elif values_softmax['type'] == 'exponential':
+            lam = values_softmax['exponential']['lambda']
+            lams = (1 - lam) * np.power(lam, np.arange(N - 1))
+            weights = np.array(list(lams) + [np.power(lam, N - 1)], dtype=np.float32)
+        else:
+            raise NotImplementedError
+
+        return weights
+
+    def _graph_values_and_state(self, tf_obs_lowd, tf_actions_ph, is_training, num_dp, tf_action_embeddings=None,
+                                tf_prev_values=None):
+        """
+        :param tf_obs_lowd: [batch_size, rnn_state_dim], either the observation lowd or the rnn state returned by a
+                            previous call (to continue an action sequence from where that call stopped)
+        :param tf_prev_values: when continuing, the values of the previous call's last step
+        :return: tf_values: [batch_size, H], or for an ensemble the members' [batch_size, H, E] (not aggregated)
+                 rnn state after the H steps [batch_size, rnn_state_dim]
+        """
+        if self._ensemble_size == 1:
+            return self._graph_member_values(tf_obs_lowd, tf_actions_ph, is_training, num_dp,
+                                             tf_action_embeddings=tf_action_embeddings,
+                                             tf_prev_values=tf_prev_values)
+
+        assert(tf_action_embeddings is None)
+        tf_values_members, tf_states = [], []
+        for i, tf_obs_lowd_i in enumerate(tf.split(tf_obs_lowd, self._ensemble_size, axis=1)):
+            with tf.variable_scope('member_{0}'.format(i)):
+                tf_values_i, tf_state_i = self._graph_member_values(
+                    tf_obs_lowd_i, tf_actions_ph, is_training, num_dp,
+                    tf_prev_values=tf_prev_values[:, i] if tf_prev_values is not None else None)
+            tf_values_members.append(tf_values_i)
+            tf_states.append(tf_state_i)
+        return tf.stack(tf_values_members, axis=2), tf.concat(tf_states, axis=1)
+
+    def _graph_member_values(self, tf_obs_lowd, tf_actions_ph, is_training, num_dp, tf_action_embeddings=None,
+                             tf_prev_values=None):
+        """
+        :return: tf_values: [batch_size, H], rnn state after the H steps [batch_size, rnn_state_dim]
+        """
+        H = tf_actions_ph.get_shape()[1].value
+
+        if tf_action_embeddings is None:
+            rnn_inputs = self._graph_action_embeddings(tf_actions_ph, is_training, num_dp=num_dp)
+        else:
+            rnn_inputs = tf_action_embeddings
+
+        rnn_outputs, _, tf_state = networks.rnn(rnn_inputs, self._rnn_graph, initial_state=tf_obs_lowd,
+                                                num_dp=num_dp, return_final_state=True)
         rnn_output_dim = rnn_outputs.get_shape()[2].value
         rnn_outputs = tf.reshape(rnn_outputs, (-1, rnn_output_dim))
 
@@ -59,24 +167,42 @@ class RCcarMACPolicy(MACPolicy, Serializable):
         tf_values = tf.reshape(tf_values, (-1, H))
 
         if self._probcoll_strictly_increasing:
-            tf_values = tf_utils.cumulative_increasing_sum(tf_values)
+            if tf_prev_values is None:
+                tf_values = tf_utils.cumulative_increasing_sum(tf_values)
+            else:
+                ### same as cumulative_increasing_sum over the whole sequence, since no step here is the first
+                tf_values = tf.expand_dims(tf_prev_values, 1) + tf.cumsum(tf.nn.relu(tf_values), axis=1)
 
-        if values_softmax['type'] == 'final':
-            tf_values_softmax = tf.zeros([batch_size, N])
-            tf_values_softmax[:, -1] = 1.
-        elif values_softmax['type'] == 'mean':
-            tf_values_softmax = (1. / float(N)) * tf.ones([batch_size, N])
-        elif values_softmax['type'] == 'exponential':
-            lam = values_softmax['exponential']['lambda']
-            lams = (1 - lam) * np.power(lam, np.arange(N - 1))
-            lams = np.array(list(lams) + [np.power(lam, N - 1)])
-            tf_values_softmax = lams * tf.ones(tf.shape(tf_values))
+        return tf_values, tf_state
+
+    def _graph_ensemble_aggregate(self, tf_values_members):
+        """
+        Combines the members' predictions (collision probabilities if classification) by their mean, max or
+        mean plus std_weight times std, and returns them in the same form as a single member (i.e. logits)
+
+        :param tf_values_members: [batch_size, H, E]
+        :return: [batch_size, H]
+        """
+        if self._is_classification:
+            tf_values_members = tf.sigmoid(tf_values_members)
+
+        aggregate = self._ensemble['aggregate']
+        if aggregate == 'mean':
+            tf_values = tf.reduce_mean(tf_values_members, axis=2)
+        elif aggregate == 'max':
+            tf_values = tf.reduce_max(tf_values_members, axis=2)
+        elif aggregate == 'std':
+            tf_mean, tf_var = tf.nn.moments(tf_values_members, axes=[2])
+            tf_values = tf_mean + self._ensemble['std_weight'] * tf.sqrt(tf_var)
         else:
             raise NotImplementedError
 
-        assert(tf_values.get_shape()[1].value == H)
+        if self._is_classification:
+            eps = 1e-6
+            tf_values = tf.clip_by_value(tf_values, eps, 1. - eps)
+            tf_values = tf.log(tf_values) - tf.log(1. - tf_values) # back to logits
 
-        return tf_values, tf_values_softmax, None, None
+        return tf_values
 
     def _graph_get_action(self, tf_obs_ph, get_action_params, scope_select, reuse_select, scope_eval, reuse_eval,
                           tf_episode_timesteps_ph, add_speed_cost):
@@ -95,6 +221,14 @@ class RCcarMACPolicy(MACPolicy, Serializable):
             tf_preprocess_eval = self._graph_preprocess_placeholders()
             tf_obs_lowd_eval = self._graph_obs_to_lowd(tf_obs_ph, tf_preprocess_eval, is_training=False)
 
+        return self._graph_get_action_from_lowd(tf_obs_lowd_select, tf_obs_lowd_eval,
+                                                tf_preprocess_select, tf_preprocess_eval,
+                                                get_action_params, scope_select, reuse_select, scope_eval, reuse_eval,
+                                                tf_episode_timesteps_ph, add_speed_cost)
+
+    def _graph_get_action_from_lowd(self, tf_obs_lowd_select, tf_obs_lowd_eval, tf_preprocess_select, tf_preprocess_eval,
+                                    get_action_params, scope_select, reuse_select, scope_eval, reuse_eval,
+                                    tf_episode_timesteps_ph, add_speed_cost):
         get_action_type = get_action_params['type']
         if get_action_type == 'random':
             tf_get_action, tf_get_value, tf_get_action_reset_ops = self._graph_get_action_random(
@@ -103,13 +237,25 @@ class RCcarMACPolicy(MACPolicy, Serializable):
                 get_action_params, get_action_type,
                 scope_select, reuse_select,
                 scope_eval, reuse_eval,
-                add_speed_cost)
+                add_speed_cost, tf_episode_timesteps_ph=tf_episode_timesteps_ph)
         elif get_action_type == 'cem':
-            tf_get_action, tf_get_value, tf_get_action_reset_ops = self._graph_get_action_cem(
+            with tf.name_scope('cem'): # profiling categorizes the cem ops by this scope
+                tf_get_action, tf_get_value, tf_get_action_reset_ops = self._graph_get_action_cem(
+                    tf_obs_lowd_select, tf_obs_lowd_eval,
+                    tf_preprocess_select, tf_preprocess_eval,
+                    get_action_params, get_action_type, scope_select, reuse_select, scope_eval, reuse_eval,
+                    tf_episode_timesteps_ph, add_speed_cost)
+        elif get_action_type == 'successive_halving':
+            tf_get_action, tf_get_value, tf_get_action_reset_ops = self._graph_get_action_successive_halving(
                 tf_obs_lowd_select, tf_obs_lowd_eval,
                 tf_preprocess_select, tf_preprocess_eval,
-                get_action_params, get_action_type, scope_select, reuse_select, scope_eval, reuse_eval,
-                tf_episode_timesteps_ph, add_speed_cost)
+                get_action_params, scope_select, reuse_select, scope_eval, reuse_eval,
+                add_speed_cost)
+        elif get_action_type == 'anytime':
+            assert(get_action_params is self._get_action_test)
+            tf_get_action, tf_get_value, tf_get_action_reset_ops = self._graph_get_action_anytime(
+                tf_obs_lowd_select, tf_preprocess_select, get_action_params, scope_select, reuse_select,
+                add_speed_cost)
         else:
             raise NotImplementedError
 
@@ -117,7 +263,7 @@ class RCcarMACPolicy(MACPolicy, Serializable):
 
     def _graph_get_action_random(self, tf_obs_lowd_select, tf_obs_lowd_eval, tf_preprocess_select, tf_preprocess_eval,
                                  get_action_params, get_action_type, scope_select, reuse_select, scope_eval, reuse_eval,
-                                 add_speed_cost):
+                                 add_speed_cost, tf_episode_timesteps_ph=None):
         H = get_action_params['H']
         assert (H <= self._N)
 
@@ -127,28 +273,41 @@ class RCcarMACPolicy(MACPolicy, Serializable):
 
         ### create actions
         K = get_action_params[get_action_type]['K']
-        if isinstance(self._env_spec.action_space, Discrete):
-            tf_actions = tf.one_hot(tf.random_uniform([K, H], minval=0, maxval=action_dim, dtype=tf.int32),
-                                    depth=action_dim,
-                                    axis=2)
+        bank_size = get_action_params[get_action_type].get('bank_size', 0)
+        warm_start_M = get_action_params[get_action_type].get('warm_start_M', 0)
+        if get_action_params is not self._get_action_test:
+            warm_start_M = 0 # needs the episode timesteps
+        assert(warm_start_M < K)
+        assert(not (bank_size and warm_start_M))
+        if bank_size and get_action_params is self._get_action_test:
+            tf_actions, tf_action_embeddings = self._graph_action_bank(K, H, bank_size, scope_select)
+            tf_action_embeddings = tf.tile(tf_action_embeddings, (num_obs, 1, 1))
         else:
-            action_lb = np.expand_dims(self._env_spec.action_space.low, 0)
-            action_ub = np.expand_dims(self._env_spec.action_space.high, 0)
-            tf_actions = (action_ub - action_lb) * tf.random_uniform([K, H, action_dim]) + action_lb
+            tf_actions = self._graph_sample_actions(K - warm_start_M, H)
+            tf_action_embeddings = None
 
         ### tile
         tf_actions = tf.tile(tf_actions, (num_obs, 1, 1))
+        if warm_start_M > 0:
+            tf_warm_actions_var, tf_warm_actions = self._graph_warm_start_actions(num_obs, warm_start_M, H,
+                                                                                  tf_episode_timesteps_ph)
+            tf_actions = tf.reshape(tf.concat([tf_warm_actions,
+                                               tf.reshape(tf_actions, (num_obs, K - warm_start_M, H, action_dim))],
+                                              axis=1),
+                                    (-1, H, action_dim)) # [num_obs*K, H, action_dim]
         tf_obs_lowd_repeat_select = tf_utils.repeat_2d(tf_obs_lowd_select, K, 0)
         tf_obs_lowd_repeat_eval = tf_utils.repeat_2d(tf_obs_lowd_eval, K, 0)
         ### inference to get values
         with tf.variable_scope(scope_select, reuse=reuse_select):
             tf_values_all_select, tf_values_softmax_all_select, _, _ = \
                 self._graph_inference(tf_obs_lowd_repeat_select, tf_actions, get_action_params['values_softmax'],
-                                      tf_preprocess_select, is_training=False, num_dp=K)  # [num_obs*k, H]
+                                      tf_preprocess_select, is_training=False, num_dp=K,
+                                      tf_action_embeddings=tf_action_embeddings)  # [num_obs*k, H]
         with tf.variable_scope(scope_eval, reuse=reuse_eval):
             tf_values_all_eval, tf_values_softmax_all_eval, _, _ = \
                 self._graph_inference(tf_obs_lowd_repeat_eval, tf_actions, get_action_params['values_softmax'],
-                                      tf_preprocess_eval, is_training=False, num_dp=K)  # [num_obs*k, H]
+                                      tf_preprocess_eval, is_training=False, num_dp=K,
+                                      tf_action_embeddings=tf_action_embeddings if scope_eval == scope_select else None)  # [num_obs*k, H]
         if self._is_classification:
             ### convert pre-activation to post-activation
             tf_values_all_select = -tf.sigmoid(tf_values_all_select)
@@ -176,6 +335,17 @@ class RCcarMACPolicy(MACPolicy, Serializable):
         tf_get_action_value = tf.reduce_sum(tf_values_argmax_select * tf_values_eval, reduction_indices=1)
         tf_get_action_reset_ops = []
 
+        ### keep the best warm_start_M sequences of each observation for the next step
+        if warm_start_M > 0:
+            _, tf_top_indices = tf.nn.top_k(tf_values_select, k=warm_start_M) # [num_obs, M]
+            tf_top_indices += tf.expand_dims(tf.range(num_obs) * K, 1)
+            tf_top_actions = tf.gather(tf_actions, tf.reshape(tf_top_indices, (-1,)))
+            tf_update_warm = tf.assign(tf_warm_actions_var,
+                                       tf.reshape(tf_top_actions, (num_obs, warm_start_M, H, action_dim)),
+                                       validate_shape=False)
+            with tf.control_dependencies([tf_update_warm]):
+                tf_get_action = tf.identity(tf_get_action)
+
         ### check shapes
         tf.assert_equal(tf.shape(tf_get_action)[0], num_obs)
         tf.assert_equal(tf.shape(tf_get_action_value)[0], num_obs)
@@ -183,6 +353,243 @@ class RCcarMACPolicy(MACPolicy, Serializable):
 
         return tf_get_action, tf_get_action_value, tf_get_action_reset_ops
 
+    def _graph_warm_start_actions(self, num_obs, M, H, tf_episode_timesteps_ph):
+        """
+        The best M sequences of the previous step for each observation, shifted by one action with a random final
+        action. Observations at the start of an episode (or if the number of observations changed) get random ones.
+
+        :return: variable holding the sequences for the next step, warm start sequences [num_obs, M, H, action_dim]
+        """
+        action_dim = self._env_spec.action_space.flat_dim
+        with tf.variable_scope('random_warm_start', reuse=False):
+            tf_warm_actions_var = tf.Variable(np.zeros((0, M, H, action_dim), dtype=np.float32), name='actions',
+                                              trainable=False, validate_shape=False)
+
+        tf_valid = tf.equal(tf.shape(tf_warm_actions_var)[0], num_obs)
+        tf_prev_actions = tf.cond(tf_valid,
+                                  lambda: tf.reshape(tf_warm_actions_var, (num_obs, M, H, action_dim)),
+                                  lambda: tf.zeros((num_obs, M, H, action_dim)))
+        tf_shifted_actions = tf.concat([tf_prev_actions[:, :, 1:],
+                                        tf.reshape(self._graph_sample_actions(num_obs * M, 1),
+                                                   (num_obs, M, 1, action_dim))],
+                                       axis=2)
+        tf_random_actions = tf.reshape(self._graph_sample_actions(num_obs * M, H), (num_obs, M, H, action_dim))
+        tf_warm_actions = tf.where(tf.logical_and(tf_valid, tf.greater(tf_episode_timesteps_ph, 0)),
+                                   tf_shifted_actions, tf_random_actions)
+
+        return tf_warm_actions_var, tf_warm_actions
+
+    def _graph_sample_actions(self, K, H):
+        """
+        :return: K (int or tensor) uniformly random action sequences [K, H, action_dim]
+        """
+        action_dim = self._env_spec.action_space.flat_dim
+        if isinstance(self._env_spec.action_space, Discrete):
+            tf_actions = tf.one_hot(tf.random_uniform([K, H], minval=0, maxval=action_dim, dtype=tf.int32),
+                                    depth=action_dim,
+                                    axis=2)
+        else:
+            action_lb = np.expand_dims(self._env_spec.action_space.low, 0)
+            action_ub = np.expand_dims(self._env_spec.action_space.high, 0)
+            tf_actions = (action_ub - action_lb) * tf.random_uniform([K, H, action_dim]) + action_lb
+        return tf_actions
+
+    def _graph_action_bank(self, K, H, bank_size, scope):
+        """
+        Bank of candidate action sequences with their fcnn_actions embeddings stored in variables,
+        so acting only gathers K of them instead of embedding freshly sampled actions
+
+        :return: actions [K, H, action_dim], action embeddings [K, H, embedding dim]
+        """
+        ### under the policy scope, so they are saved and restored with it
+        with tf.variable_scope(scope), tf.variable_scope('action_bank', reuse=False):
+            tf_bank_actions = tf.get_variable('actions', initializer=self._graph_sample_actions(bank_size, H),
+                                              trainable=False)
+            tf_bank_embeddings = tf.get_variable('embeddings', [bank_size, H, self._observation_graph['output_dim']],
+                                                 initializer=tf.zeros_initializer(), trainable=False)
+
+        ### recompute the embeddings (after the weights change)
+        with tf.variable_scope(scope, reuse=True):
+            tf_update_embeddings = tf.assign(tf_bank_embeddings,
+                                             self._graph_action_embeddings(tf_bank_actions, is_training=False))
+        ### resample the bank and recompute the embeddings
+        tf_resample = tf.assign(tf_bank_actions, self._graph_sample_actions(bank_size, H))
+        with tf.variable_scope(scope, reuse=True):
+            tf_refresh = tf.assign(tf_bank_embeddings,
+                                   self._graph_action_embeddings(tf_resample, is_training=False))
+
+        self._tf_get_action_extras['action_bank'] = {
+            'update_embeddings': tf_update_embeddings,
+            'refresh': tf_refresh
+        }
+
+        tf_indices = tf.random_uniform([K], minval=0, maxval=bank_size, dtype=tf.int32)
+        return tf.gather(tf_bank_actions, tf_indices), tf.gather(tf_bank_embeddings, tf_indices)
+
+    def _graph_action_values(self, tf_obs_lowd, tf_actions, tf_preprocess, values_softmax, scope, reuse,
+                             add_speed_cost, num_dp):
+        """
+        :param tf_obs_lowd: [batch_size, rnn_state_dim] (already repeated for each action sequence)
+        :param tf_actions: [batch_size, h, action_dim], if h < N the first h values_softmax weights are renormalized
+        :return: value of each action sequence [batch_size]
+        """
+        h = tf_actions.get_shape()[1].value
+        max_speed = self._env_spec.action_space.high[1]
+        with tf.variable_scope(scope, reuse=reuse):
+            tf_values_all, tf_values_softmax_all, _, _ = \
+                self._graph_inference(tf_obs_lowd, tf_actions, values_softmax, tf_preprocess,
+                                      is_training=False, num_dp=num_dp)  # [batch_size, h]
+        tf_values_all = self._graph_get_value(tf_values_all, tf_values_softmax_all)
+        weights = self._values_softmax_weights(values_softmax)[:h]
+        assert(weights.sum() > 0)
+        tf_values = tf.reduce_sum(tf_values_all * (weights / weights.sum()), reduction_indices=1)
+        if add_speed_cost:
+            tf_values -= self._speed_weight * tf.reduce_mean(tf.square(tf_actions[:, :, 1] - max_speed),
+                                                             reduction_indices=1)
+        return tf_values
+
+    def _graph_get_action_successive_halving(self, tf_obs_lowd_select, tf_obs_lowd_eval, tf_preprocess_select,
+                                             tf_preprocess_eval, get_action_params, scope_select, reuse_select,
+                                             scope_eval, reuse_eval, add_speed_cost):
+        """
+        Random shooting that evaluates all K candidates for a short horizon, keeps the best fraction,
+        and evaluates those for a longer horizon, and so on until the full horizon. Each stage continues the
+        kept candidates' rnn from where the previous stage stopped, and scores them like _graph_action_values
+        """
+        H = get_action_params['H']
+        assert (H <= self._N)
+        sh_params = get_action_params['successive_halving']
+        K = sh_params['K']
+        horizons = sh_params['horizons']
+        assert(horizons[-1] == H and len(sh_params['keep']) == len(horizons) - 1)
+        assert(all([h0 < h1 for h0, h1 in zip(horizons[:-1], horizons[1:])]))
+        Ks = [K]
+        for keep in sh_params['keep']:
+            Ks.append(max(int(keep * Ks[-1]), 1))
+
+        num_obs = tf.shape(tf_obs_lowd_select)[0]
+        action_dim = self._env_spec.action_space.flat_dim
+        values_softmax = get_action_params['values_softmax']
+
+        tf_actions_all = tf.tile(self._graph_sample_actions(K, H), (num_obs, 1, 1)) # [num_obs*K, H, action_dim]
+        weights = self._values_softmax_weights(values_softmax)
+        max_speed = self._env_spec.action_space.high[1]
+
+        ### stages
+        tf_actions = tf_actions_all
+        tf_rnn_state = tf_utils.repeat_2d(tf_obs_lowd_select, K, 0)
+        tf_prev_values = None # last step's values (before aggregating the ensemble)
+        tf_values_sum = 0. # weighted sum of the values so far
+        h_prev = 0
+        for i, (h, K_i) in enumerate(zip(horizons, Ks)):
+            assert(weights[:h].sum() > 0)
+            with tf.variable_scope(scope_select, reuse=reuse_select):
+                tf_values_all, tf_rnn_state = self._graph_values_and_state(tf_rnn_state, tf_actions[:, h_prev:h],
+                                                                           is_training=False, num_dp=K_i,
+                                                                           tf_prev_values=tf_prev_values)
+            tf_prev_values = tf_values_all[:, -1]
+            if self._ensemble_size > 1:
+                tf_values_all = self._graph_ensemble_aggregate(tf_values_all)
+            tf_values_sum += tf.reduce_sum(self._graph_get_value(tf_values_all, None) * weights[h_prev:h],
+                                           reduction_indices=1)
+            tf_values_select = tf_values_sum / weights[:h].sum()
+            if add_speed_cost:
+                tf_values_select -= self._speed_weight * tf.reduce_mean(tf.square(tf_actions[:, :h, 1] - max_speed),
+                                                                        reduction_indices=1)
+            tf_values_select = tf.reshape(tf_values_select, (num_obs, K_i))
+            if i == len(horizons) - 1:
+                break
+            ### keep the best K_{i+1} of each observation
+            _, tf_top_indices = tf.nn.top_k(tf_values_select, k=Ks[i+1]) # [num_obs, K_{i+1}]
+            tf_top_indices = tf.reshape(tf_top_indices + tf.expand_dims(tf.range(num_obs) * K_i, 1), (-1,))
+            tf_actions, tf_rnn_state, tf_prev_values, tf_values_sum = \
+                [tf.gather(t, tf_top_indices) for t in (tf_actions, tf_rnn_state, tf_prev_values, tf_values_sum)]
+            h_prev = h
+
+        ### get_action based on select (policy)
+        tf_actions = tf.reshape(tf_actions, (num_obs, Ks[-1], H, action_dim))
+        tf_argmax = tf.cast(tf.argmax(tf_values_select, 1), tf.int32) # [num_obs]
+        tf_argmax_indices = tf.stack((tf.range(num_obs), tf_argmax), axis=1)
+        tf_get_action_seq = tf.gather_nd(tf_actions, tf_argmax_indices) # [num_obs, H, action_dim]
+        tf_get_action = tf_get_action_seq[:, 0, :]
+
+        ### get_action_value based on eval (target)
+        tf_get_action_value = self._graph_action_values(tf_obs_lowd_eval, tf_get_action_seq, tf_preprocess_eval,
+                                                        values_softmax, scope_eval, reuse_eval, add_speed_cost,
+                                                        num_dp=1)
+
+        ### evaluating all candidates for the full horizon, to check the pruning
+        if get_action_params is self._get_action_test:
+            tf_values_full = self._graph_action_values(tf_utils.repeat_2d(tf_obs_lowd_select, K, 0),
+                                                       tf_actions_all, tf_preprocess_select, values_softmax,
+                                                       scope_select, reuse_select, add_speed_cost, num_dp=K)
+            tf_argmax_full = tf.cast(tf.argmax(tf.reshape(tf_values_full, (num_obs, K)), 1), tf.int32)
+            tf_get_action_full = tf.gather(tf_actions_all, tf.range(num_obs) * K + tf_argmax_full)[:, 0, :]
+            self._tf_get_action_extras['successive_halving'] = {
+                'get_action': tf_get_action,
+                'get_action_full': tf_get_action_full
+            }
+
+        return tf_get_action, tf_get_action_value, []
+
+    def _graph_get_action_anytime(self, tf_obs_lowd_select, tf_preprocess_select, get_action_params,
+                                  scope_select, reuse_select, add_speed_cost):
+        """
+        Random shooting split into a prepare op (stores the observation encoding and resets the best action)
+        and an iteration op (evaluates a chunk of K sequences and keeps the best action so far), which get_actions
+        runs until its time budget is spent. The returned action and value only read the best so far.
+        """
+        H = get_action_params['H']
+        assert (H <= self._N)
+        K = get_action_params['anytime']['K']
+        action_dim = self._env_spec.action_space.flat_dim
+        obs_lowd_dim = tf_obs_lowd_select.get_shape()[1].value
+        num_obs = tf.shape(tf_obs_lowd_select)[0]
+
+        with tf.variable_scope('anytime', reuse=False):
+            tf_obs_lowd_var = tf.Variable(np.zeros((0, obs_lowd_dim), dtype=np.float32), name='obs_lowd',
+                                          trainable=False, validate_shape=False)
+            tf_best_value_var = tf.Variable(np.zeros(0, dtype=np.float32), name='best_value',
+                                            trainable=False, validate_shape=False)
+            tf_best_action_var = tf.Variable(np.zeros((0, action_dim), dtype=np.float32), name='best_action',
+                                             trainable=False, validate_shape=False)
+
+        ### prepare
+        tf_prepare = tf.group(
+            tf.assign(tf_obs_lowd_var, tf_obs_lowd_select, validate_shape=False),
+            tf.assign(tf_best_value_var, -np.inf * tf.ones([num_obs]), validate_shape=False),
+            tf.assign(tf_best_action_var, tf.zeros([num_obs, action_dim]), validate_shape=False)
+        )
+
+        ### iteration
+        tf_obs_lowd = tf.reshape(tf_obs_lowd_var, (-1, obs_lowd_dim))
+        tf_best_value = tf.reshape(tf_best_value_var, (-1,))
+        tf_best_action = tf.reshape(tf_best_action_var, (-1, action_dim))
+        num_obs_iter = tf.shape(tf_obs_lowd)[0]
+        tf_actions = tf.tile(self._graph_sample_actions(K, H), (num_obs_iter, 1, 1))
+        tf_values = self._graph_action_values(tf_utils.repeat_2d(tf_obs_lowd, K, 0), tf_actions,
+                                              tf_preprocess_select, get_action_params['values_softmax'],
+                                              scope_select, reuse_select, add_speed_cost, num_dp=K)
+        tf_values = tf.reshape(tf_values, (num_obs_iter, K))
+        tf_chunk_value = tf.reduce_max(tf_values, axis=1)
+        tf_chunk_argmax = tf.cast(tf.argmax(tf_values, 1), tf.int32)
+        tf_chunk_action = tf.gather(tf_actions, tf.range(num_obs_iter) * K + tf_chunk_argmax)[:, 0, :]
+        tf_better = tf.greater(tf_chunk_value, tf_best_value)
+        tf_iter = tf.group(
+            tf.assign(tf_best_value_var, tf.where(tf_better, tf_chunk_value, tf_best_value), validate_shape=False),
+            tf.assign(tf_best_action_var, tf.where(tf_better, tf_chunk_action, tf_best_action), validate_shape=False)
+        )
+
+        self._tf_get_action_extras['anytime'] = {
+            'prepare': tf_prepare,
+            'iter': tf_iter
+        }
+
+        tf_get_action = tf.reshape(tf_best_action_var.read_value(), (-1, action_dim))
+        tf_get_action_value = tf.reshape(tf_best_value_var.read_value(), (-1,))
+
+        return tf_get_action, tf_get_action_value, []
+
     def _graph_get_action_cem(self, tf_obs_lowd_select, tf_obs_lowd_eval, tf_preprocess_select, tf_preprocess_eval,
                               get_action_params, get_action_type, scope_select, reuse_select, scope_eval, reuse_eval,
                               tf_episode_timesteps_ph, add_speed_cost):
@@ -299,7 +706,7 @@ class RCcarMACPolicy(MACPolicy, Serializable):
             return tf_get_action, tf_get_action_value, tf_get_action_reset_ops
 
     def _graph_cost(self, tf_train_values, tf_train_values_softmax, tf_rewards_ph, tf_dones_ph,
-                    tf_target_get_action_values):
+                    tf_target_get_action_values, tf_sample_steps=None, tf_regularization_losses=None):
         tf_dones = tf.cast(tf_dones_ph, tf.int32)
         tf_labels = tf.cast(tf.cumsum(tf_rewards_ph, axis=1) < -0.5, tf.float32)
 
@@ -335,6 +742,14 @@ class RCcarMACPolicy(MACPolicy, Serializable):
                 tf_labels = tf.cast(tf_dones_ph, tf.float32) * tf_labels + \
                             (1 - tf.cast(tf_dones_ph, tf.float32)) * tf.maximum(tf_labels, target_labels)
 
+        ### ensemble: each member trains on its own bootstrap subset of the replay pool
+        if self._ensemble_size > 1:
+            E = self._ensemble_size
+            tf_bootstrap = self._graph_bootstrap_mask(tf_sample_steps) # [batch_size, E]
+            mask = tf.expand_dims(mask, 2) * tf.expand_dims(tf_bootstrap, 1) # [batch_size, H, E]
+            mask /= E * tf.maximum(tf.reduce_sum(mask, axis=[0, 1], keep_dims=True), 1e-8)
+            tf_labels = tf.tile(tf.expand_dims(tf_labels, 2), (1, 1, E))
+
         ### cost
         control_dependencies = []
         control_dependencies += [tf.assert_greater_equal(tf_labels, 0., name='cost_assert_2')]
@@ -346,138 +761,130 @@ class RCcarMACPolicy(MACPolicy, Serializable):
             else:
                 mses = tf.square(tf_train_values - tf_labels)
                 cost = tf.reduce_sum(mask * mses)
-            weight_decay = self._weight_decay * tf.add_n(tf.get_collection(tf.GraphKeys.REGULARIZATION_LOSSES))
+            if tf_regularization_losses is None:
+                tf_regularization_losses = tf.get_collection(tf.GraphKeys.REGULARIZATION_LOSSES)
+            weight_decay = self._weight_decay * tf.add_n(tf_regularization_losses)
 
         return cost + weight_decay, cost
 
-    def _graph_setup(self):
-        ### create session and graph
-        tf_sess = tf.get_default_session()
-        if tf_sess is None:
-            tf_sess, tf_graph = MACPolicy.create_session_and_graph(gpu_device=self._gpu_device, gpu_frac=self._gpu_frac)
-        tf_graph = tf_sess.graph
-
-        with tf_sess.as_default(), tf_graph.as_default():
-            if ext.get_seed() is not None:
-                ext.set_seed(ext.get_seed())
-
-            ### create input output placeholders
-            tf_obs_ph, tf_actions_ph, tf_dones_ph, tf_rewards_ph, tf_obs_target_ph, \
-                tf_test_es_ph_dict, tf_episode_timesteps_ph = self._graph_input_output_placeholders()
-            self.global_step = tf.Variable(0, trainable=False, name='global_step')
-
-            ### policy
-            policy_scope = 'policy'
-            with tf.variable_scope(policy_scope):
-                ### create preprocess placeholders
-                tf_preprocess = self._graph_preprocess_placeholders()
-                ### process obs to lowd
-                tf_obs_lowd = self._graph_obs_to_lowd(tf_obs_ph, tf_preprocess, is_training=True)
-                ### create training policy
-                tf_train_values, tf_train_values_softmax, _, _ = \
-                    self._graph_inference(tf_obs_lowd, tf_actions_ph[:, :self._H, :],
-                                          self._values_softmax, tf_preprocess, is_training=True)
-
-            with tf.variable_scope(policy_scope, reuse=True):
-                tf_train_values_test, tf_train_values_softmax_test, _, _ = \
-                    self._graph_inference(tf_obs_lowd, tf_actions_ph[:, :self._get_action_test['H'], :],
-                                          self._values_softmax, tf_preprocess, is_training=False)
-                # tf_get_value = tf.reduce_sum(tf_train_values_softmax_test * tf_train_values_test, reduction_indices=1)
-                tf_get_value = -tf.sigmoid(tf_train_values_test) if self._is_classification else -tf_train_values_test
-
-            ### action selection
-            tf_get_action, tf_get_action_value, tf_get_action_reset_ops = \
-                self._graph_get_action(tf_obs_ph, self._get_action_test,
-                                       policy_scope, True, policy_scope, True,
-                                       add_speed_cost=True,
-                                       tf_episode_timesteps_ph=tf_episode_timesteps_ph)
-            ### exploration strategy and logprob
-            tf_get_action_explore = self._graph_get_action_explore(tf_get_action, tf_test_es_ph_dict)
-
-            ### get policy variables
-            tf_policy_vars = sorted(tf.get_collection(xplatform.global_variables_collection_name(),
-                                                      scope=policy_scope), key=lambda v: v.name)
-            tf_trainable_policy_vars = sorted(tf.get_collection(xplatform.trainable_variables_collection_name(),
-                                                                scope=policy_scope), key=lambda v: v.name)
-
-            ### create target network
-            if self._use_target:
-                target_scope = 'target' if self._separate_target_params else 'policy'
-                ### action selection
-                tf_obs_target_ph_packed = xplatform.concat([tf_obs_target_ph[:, h - self._obs_history_len:h, :]
-                                                            for h in range(self._obs_history_len, self._obs_history_len + self._N + 1)],
-                                                           0)
-                tf_target_get_action, tf_target_get_action_values, _ = self._graph_get_action(tf_obs_target_ph_packed,
-                                                                                              self._get_action_target,
-                                                                                              scope_select=policy_scope,
-                                                                                              reuse_select=True,
-                                                                                              scope_eval=target_scope,
-                                                                                              reuse_eval=(target_scope == policy_scope),
-                                                                                              tf_episode_timesteps_ph=None, # TODO: would need to fill in
-                                                                                              add_speed_cost=False)
-
-                tf_target_get_action_values = tf.transpose(tf.reshape(tf_target_get_action_values, (self._N + 1, -1)))[:, 1:]
-            else:
-                tf_target_get_action_values = tf.zeros([tf.shape(tf_train_values)[0], self._N])
-
-            ### update target network
-            if self._use_target and self._separate_target_params:
-                tf_policy_vars_nobatchnorm = list(
-                    filter(lambda v: 'biased' not in v.name and 'local_step' not in v.name,
-                           tf_policy_vars))
-                tf_target_vars = sorted(tf.get_collection(xplatform.global_variables_collection_name(),
-                                                          scope=target_scope), key=lambda v: v.name)
-                assert (len(tf_policy_vars_nobatchnorm) == len(tf_target_vars))
-                tf_update_target_fn = []
-                for var, var_target in zip(tf_policy_vars_nobatchnorm, tf_target_vars):
-                    assert (var.name.replace(policy_scope, '') == var_target.name.replace(target_scope, ''))
-                    tf_update_target_fn.append(var_target.assign(var))
-                tf_update_target_fn = tf.group(*tf_update_target_fn)
-            else:
-                tf_target_vars = None
-                tf_update_target_fn = None
-
-            ### optimization
-            tf_cost, tf_mse = self._graph_cost(tf_train_values, tf_train_values_softmax, tf_rewards_ph, tf_dones_ph,
-                                               tf_target_get_action_values)
-            tf_opt, tf_lr_ph = self._graph_optimize(tf_cost, tf_trainable_policy_vars)
-
-            ### initialize
-            self._graph_init_vars(tf_sess)
-
-        ### what to return
-        return {
-            'sess': tf_sess,
-            'graph': tf_graph,
-            'obs_ph': tf_obs_ph,
-            'actions_ph': tf_actions_ph,
-            'dones_ph': tf_dones_ph,
-            'rewards_ph': tf_rewards_ph,
-            'obs_target_ph': tf_obs_target_ph,
-            'test_es_ph_dict': tf_test_es_ph_dict,
-            'episode_timesteps_ph': tf_episode_timesteps_ph,
-            'preprocess': tf_preprocess,
-            'get_value': tf_get_value,
-            'get_action': tf_get_action,
-            'get_action_explore': tf_get_action_explore,
-            'get_action_value': tf_get_action_value,
-            'get_action_reset_ops': tf_get_action_reset_ops,
-            'update_target_fn': tf_update_target_fn,
-            'cost': tf_cost,
-            'mse': tf_mse,
-            'opt': tf_opt,
-            'lr_ph': tf_lr_ph,
-            'policy_vars': tf_policy_vars,
-            'target_vars': tf_target_vars
+    def _graph_bootstrap_mask(self, tf_sample_steps):
+        """
+        Whether each member trains on each sample, fixed per sample (a hash of the step it was collected at),
+        so each member sees the same subset of the replay pool every time a sample is drawn
+
+        :param tf_sample_steps: [batch_size]
+        :return: [batch_size, E]
+        """
+        P = 2147483647 # prime, so each member's hash is a permutation of the steps mod P
+        rng = np.random.RandomState(0)
+        multipliers = rng.randint(1, P, size=self._ensemble_size).astype(np.int64)
+        offsets = rng.randint(0, P, size=self._ensemble_size).astype(np.int64)
+        tf_hashes = tf.floormod(tf.expand_dims(tf.cast(tf_sample_steps, tf.int64), 1) * multipliers + offsets, P)
+        return tf.cast(tf.cast(tf_hashes, tf.float32) < self._ensemble['bootstrap_prob'] * P, tf.float32)
+
+    def _graph_get_value(self, tf_train_values_test, tf_train_values_softmax_test):
+        # return tf.reduce_sum(tf_train_values_softmax_test * tf_train_values_test, reduction_indices=1)
+        return -tf.sigmoid(tf_train_values_test) if self._is_classification else -tf_train_values_test
+
+    def _graph_get_action_test(self, tf_obs_ph, policy_scope, tf_episode_timesteps_ph):
+        return self._graph_get_action(tf_obs_ph, self._get_action_test,
+                                      policy_scope, True, policy_scope, True,
+                                      add_speed_cost=True,
+                                      tf_episode_timesteps_ph=tf_episode_timesteps_ph)
+
+    def _graph_get_action_target(self, tf_obs_lowd_select, tf_obs_lowd_eval, tf_preprocess_select, tf_preprocess_eval,
+                                 policy_scope, target_scope, reuse_target):
+        return self._graph_get_action_from_lowd(tf_obs_lowd_select, tf_obs_lowd_eval,
+                                                tf_preprocess_select, tf_preprocess_eval,
+                                                self._get_action_target,
+                                                scope_select=policy_scope,
+                                                reuse_select=True,
+                                                scope_eval=target_scope,
+                                                reuse_eval=reuse_target,
+                                                tf_episode_timesteps_ph=None, # TODO: would need to fill in
+                                                add_speed_cost=False)
+
+    ######################
+    ### Policy methods ###
+    ######################
+
+    def get_actions(self, steps, current_episode_steps, observations, explore):
+        ret, elapsed = self._get_actions_with_extras(lambda *args: MACPolicy.get_actions(self, *args),
+                                                     steps, current_episode_steps, observations, explore)
+        if self._get_action_test['type'] == 'successive_halving':
+            check_every_n_calls = self._get_action_test['successive_halving']['check_every_n_calls']
+            if check_every_n_calls and self._num_get_actions % check_every_n_calls == 0:
+                self._check_successive_halving(current_episode_steps, observations, elapsed)
+
+        return ret
+
+    def _autotune_act(self, sess, feed_dict):
+        tf_extras = self._tf_dict['get_action_extras']
+        if 'action_bank' in tf_extras:
+            ### as after a target update
+            sess.run(tf_extras['action_bank']['update_embeddings'])
+        if 'anytime' in tf_extras:
+            sess.run(tf_extras['anytime']['prepare'], feed_dict=feed_dict)
+            for _ in range(self._get_action_test['anytime']['max_iters']):
+                sess.run(tf_extras['anytime']['iter'])
+        MACPolicy._autotune_act(self, sess, feed_dict)
+
+    def _check_successive_halving(self, current_episode_steps, observations, elapsed):
+        """ Compare against evaluating all candidates for the full horizon """
+        tf_extras = self._tf_dict['get_action_extras']['successive_halving']
+        feed_dict = {
+            self._tf_dict['obs_ph']: observations,
+            self._tf_dict['episode_timesteps_ph']: current_episode_steps
         }
+        ### same candidates, so the pruned choice should be the best of all
+        action, action_full = self._tf_dict['sess'].run([tf_extras['get_action'], tf_extras['get_action_full']],
+                                                        feed_dict=feed_dict)
+        ### time of full evaluation
+        start = time.time()
+        self._tf_dict['sess'].run(tf_extras['get_action_full'], feed_dict=feed_dict)
+        elapsed_full = time.time() - start
+
+        sh_params = self._get_action_test['successive_halving']
+        Ks = [sh_params['K']]
+        for keep in sh_params['keep']:
+            Ks.append(max(int(keep * Ks[-1]), 1))
+        flops_fraction = np.sum(np.array(Ks) * np.array(sh_params['horizons'])) / \
+                         float(sh_params['K'] * sh_params['horizons'][-1])
+
+        self._log_stats['SuccessiveHalvingAgreement'].append(np.mean(np.all(action == action_full, axis=1)))
+        self._log_stats['SuccessiveHalvingSpeedup'].append(elapsed_full / elapsed)
+        self._log_stats['SuccessiveHalvingFlopsFraction'].append(flops_fraction)
 
     ################
     ### Training ###
     ################
 
-    def train_step(self, step, steps, observations, actions, rewards, values, dones, logprobs, use_target):
+    def train_step(self, step, steps, observations, actions, rewards, values, dones, logprobs, use_target,
+                   target_embeddings=None):
         # always True use_target so dones is passed in
         # assert(not self._use_target)
         return MACPolicy.train_step(self, step, steps, observations, actions, rewards, values, dones, logprobs,
-                                    use_target=self._use_target) # True: to keep dones to true
+                                    use_target=self._use_target, # True: to keep dones to true
+                                    target_embeddings=target_embeddings)
+
+    def train_steps(self, step, steps, observations, actions, rewards, values, dones, logprobs, use_target):
+        return MACPolicy.train_steps(self, step, steps, observations, actions, rewards, values, dones, logprobs,
+                                     use_target=self._use_target)
+
+    ### the action bank embeddings are recomputed lazily, at most once per target update (not every train step)
+
+    def update_preprocess(self, preprocess_stats):
+        MACPolicy.update_preprocess(self, preprocess_stats)
+        self._action_bank_stale = True
+
+    def update_target(self):
+        MACPolicy.update_target(self)
+        self._action_bank_stale = True
+
+    def reset_weights(self):
+        MACPolicy.reset_weights(self)
+        self._action_bank_stale = True
 
+    def restore_checkpoint(self, values):
+        MACPolicy.restore_checkpoint(self, values)
+        self._action_bank_stale = True
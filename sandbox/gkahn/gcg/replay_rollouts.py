@@ -0,0 +1,82 @@
+"""
+Regenerates the observations of saved rollouts (e.g. saved with save_rollouts_observations: False) by replaying
+their actions from the start state of each rollout
+
+    python replay_rollouts.py <exp folder> itr_10_rollouts.pkl --num_workers 8
+
+Writes itr_10_rollouts_replayed.pkl with the observations filled in. The car envs step deterministically
+(fixed physics step, seeded randomness), so the replayed rewards and dones match the saved ones.
+"""
+import os
+import yaml
+import argparse
+import multiprocessing
+
+import joblib
+import numpy as np
+
+### one env per worker process (panda3d envs attach to the global render of their process)
+_env = None
+
+def _init_worker(env_str, normalize_env):
+    global _env
+    from sandbox.gkahn.gcg.envs.env_utils import create_env
+    _env = create_env(env_str, is_normalize=normalize_env)
+
+def _replay(rollout):
+    """
+    :return: observations, number of steps whose reward or done differ from the saved ones
+    """
+    from sandbox.gkahn.gcg.utils.utils import inner_env
+
+    assert(rollout['start_state'] is not None)
+    observation_space = _env.observation_space
+    observation = inner_env(_env).reset(state=rollout['start_state'])
+    observations = [observation_space.flatten(observation)]
+    num_mismatches = 0
+    for t, action in enumerate(rollout['actions']):
+        observation, reward, done, _ = _env.step(action)
+        # saved dones can also come from max_path_length, so only an env done the rollout did not have differs
+        if not np.isclose(reward, rollout['rewards'][t]) or (done and not rollout['dones'][t]):
+            num_mismatches += 1
+        if t < len(rollout['actions']) - 1:
+            observations.append(observation_space.flatten(observation))
+    return np.array(observations, dtype=np.uint8), num_mismatches
+
+def replay_rollouts(env_str, normalize_env, rollouts, num_workers=1):
+    """
+    :return: rollouts with observations, total number of steps that did not replay identically
+    """
+    pool = multiprocessing.Pool(num_workers, initializer=_init_worker, initargs=(env_str, normalize_env))
+    results = pool.map(_replay, rollouts, chunksize=max(len(rollouts) // (4 * num_workers), 1))
+    pool.close()
+    pool.join()
+
+    replayed_rollouts = []
+    for rollout, (observations, _) in zip(rollouts, results):
+        rollout = dict(rollout)
+        rollout['observations'] = observations
+        replayed_rollouts.append(rollout)
+    return replayed_rollouts, sum([num_mismatches for _, num_mismatches in results])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('folder', type=str)
+    parser.add_argument('rollouts', type=str, help='file in folder, e.g. itr_10_rollouts.pkl')
+    parser.add_argument('--num_workers', type=int, default=multiprocessing.cpu_count())
+    args = parser.parse_args()
+
+    yamls = [fname for fname in os.listdir(args.folder)
+             if os.path.splitext(fname)[-1] == '.yaml' and os.path.basename(args.folder) in fname]
+    assert(len(yamls) == 1)
+    with open(os.path.join(args.folder, yamls[0]), 'r') as f:
+        params = yaml.load(f)
+    env_str = params['alg']['env_eval'] if '_eval' in args.rollouts else params['alg']['env']
+
+    fname = os.path.join(args.folder, args.rollouts)
+    rollouts = joblib.load(fname)['rollouts']
+    rollouts, num_mismatches = replay_rollouts(env_str, params['alg']['normalize_env'], rollouts,
+                                               num_workers=args.num_workers)
+    print('Replayed {0} rollouts, {1} steps differ from the saved rewards/dones'.format(len(rollouts),
+                                                                                       num_mismatches))
+    joblib.dump({'rollouts': rollouts}, os.path.splitext(fname)[0] + '_replayed.pkl', compress=3)
@@ -10,7 +10,8 @@ from sandbox.gkahn.gcg.utils.utils import timeit
 class RNNCriticReplayPool(object):
 
     def __init__(self, env_spec, env_horizon, N, gamma, size, obs_history_len, sampling_method,
-                 save_rollouts=False, save_rollouts_observations=True, save_env_infos=False, replay_pool_params={}):
+                 save_rollouts=False, save_rollouts_observations=True, save_env_infos=False, replay_pool_params={},
+                 target_embedding_dim=None):
         """
         :param env_spec: for observation/action dimensions
         :param N: horizon length
@@ -19,6 +20,7 @@ class RNNCriticReplayPool(object):
         :param obs_history_len: how many previous obs to include when sampling? (= 1 is only current observation)
         :param sampling_method: how to sample the replay pool
         :param save_rollouts: for debugging
+        :param target_embedding_dim: if not None, cache the target network lowd of each observation window
         """
         self._env_spec = env_spec
         self._env_horizon = env_horizon
@@ -46,9 +48,18 @@ class RNNCriticReplayPool(object):
         self._values = np.nan * np.ones((self._size,), dtype=np.float32)
         self._logprobs = np.nan * np.ones((self._size,), dtype=np.float32)
         self._sampling_indices = np.zeros((self._size,), dtype=bool)
+        self._episode_start_state = None # from the env info of the first step, to replay the rollout
         self._index = 0
         self._curr_size = 0
 
+        ### target network lowd of the window ending at each index, valid if version matches the target network
+        if target_embedding_dim is not None:
+            self._target_embeddings = np.zeros((self._size, target_embedding_dim), dtype=np.float32)
+            self._target_embeddings_version = -1 * np.ones((self._size,), dtype=np.int64)
+        else:
+            self._target_embeddings = None
+            self._target_embeddings_version = None
+
         ### keep track of statistics
         self._stats = defaultdict(int)
         if self.obs_is_im:
@@ -148,6 +159,7 @@ class RNNCriticReplayPool(object):
 
         self._steps[self._index] = step
         self._observations[self._index, :] = self._env_spec.observation_space.flatten(observation)
+        self._invalidate_target_embeddings([self._index])
 
     def _encode_observation(self, index):
         """ Encodes observation starting at index by concatenating obs_history_len previous """
@@ -170,7 +182,10 @@ class RNNCriticReplayPool(object):
         self._actions[self._index, :] = self._env_spec.action_space.flatten(action) if flatten_action else action
         self._rewards[self._index] = reward
         self._dones[self._index] = done
+        self._invalidate_target_embeddings([self._index])
         self._env_infos[self._index] = env_info if self._save_env_infos else None
+        if env_info is not None and 'start_state' in env_info:
+            self._episode_start_state = env_info['start_state']
         self._est_values[self._index] = est_value
         self._logprobs[self._index] = logprob
         if self._sampling_method == 'uniform':
@@ -229,6 +244,7 @@ class RNNCriticReplayPool(object):
         self._rewards[indices] = rollout['rewards']
         self._dones[indices] = rollout['dones']
         self._logprobs[indices] = rollout['logprobs']
+        self._invalidate_target_embeddings(indices)
         # np.copyto(self._steps[indices], list(range(start_step, start_step + r_len)))
         # np.copyto(self._observations[indices, :], rollout['observations'])
         # np.copyto(self._actions[indices, :], rollout['actions'])
@@ -238,6 +254,13 @@ class RNNCriticReplayPool(object):
 
         self._last_done_index = self._index
 
+    def _invalidate_target_embeddings(self, indices):
+        """ Windows that contain a changed index are no longer valid """
+        if self._target_embeddings is None:
+            return
+        window_indices = np.add.outer(np.asarray(indices, dtype=np.int64), np.arange(self._obs_history_len))
+        self._target_embeddings_version[window_indices.ravel() % self._size] = -1
+
     ########################
     ### Sample from pool ###
     ########################
@@ -278,19 +301,55 @@ class RNNCriticReplayPool(object):
 
         return start_indices
 
-    def sample(self, batch_size, only_completed_episodes=False):
+    def _sample_target_embeddings(self, window_indices, observations, target_embeddings_fn, target_version):
+        """
+        :param window_indices: [batch_size, N+1] index of the last observation of each window
+        :param observations: [batch_size, N + obs_history_len, obs_dim] as sampled, the target network
+                             otherwise embeds its N+1 overlapping windows
+        :param target_embeddings_fn: computes the target network lowd of encoded observations
+        :param target_version: windows cached with a different version are recomputed
+        :return: [batch_size, N+1, target_embedding_dim]
         """
+        assert(self._target_embeddings is not None)
+        stale_indices = np.unique(window_indices[self._target_embeddings_version[window_indices] != target_version])
+        if len(stale_indices) > 0:
+            encoded_observations = np.array([self._encode_observation(index) for index in stale_indices])
+            self._target_embeddings[stale_indices] = target_embeddings_fn(encoded_observations)
+            self._target_embeddings_version[stale_indices] = target_version
+        target_embeddings = self._target_embeddings[window_indices]
+
+        ### the sampled windows after a done in the sample are not encoded like _encode_observation (the frames
+        ### before the done are not zeroed), so embed those as sampled (not cached, they depend on the start index)
+        batch_indices, window_nums = [], []
+        for i, indices in enumerate(window_indices):
+            dones = self._dones[indices[:-1]]
+            if np.any(dones):
+                for j in range(np.argmax(dones) + 1, len(indices)):
+                    batch_indices.append(i)
+                    window_nums.append(j)
+        if len(batch_indices) > 0:
+            sampled_observations = np.array([observations[i, j:j + self._obs_history_len]
+                                             for i, j in zip(batch_indices, window_nums)])
+            target_embeddings[batch_indices, window_nums] = target_embeddings_fn(sampled_observations)
+
+        return target_embeddings
+
+    def sample(self, batch_size, only_completed_episodes=False, target_embeddings_fn=None, target_version=None):
+        """
+        :param target_embeddings_fn: if not None, also return the (cached) target network lowd of the N+1 windows
         :return observations, actions, and rewards of horizon H+1
         """
         if not self.can_sample():
             return None
 
         steps, observations, actions, rewards, values, dones, logprobs = [], [], [], [], [], [], []
+        window_indices = []
 
         start_indices = self._sample_start_indices(batch_size, only_completed_episodes)
 
         for start_index in start_indices:
             indices = self._get_indices(start_index, (start_index + self._N + 1) % self._curr_size)
+            window_indices.append(indices)
             steps_i = self._steps[indices]
             observations_i = np.vstack([self._encode_observation(start_index), self._observations[indices[1:]]])
             actions_i = self._actions[indices]
@@ -344,15 +403,22 @@ class RNNCriticReplayPool(object):
         #     assert(arr.shape[1] == self._N + 1)
         # timeit.stop('replay_pool:isfinite')
 
+        if target_embeddings_fn is not None:
+            target_embeddings = self._sample_target_embeddings(np.array(window_indices), observations,
+                                                               target_embeddings_fn, target_version)
+            return steps, observations, actions, rewards, values, dones, logprobs, target_embeddings
+
         return steps, observations, actions, rewards, values, dones, logprobs
 
     @staticmethod
-    def sample_pools(replay_pools, batch_size, only_completed_episodes=False):
+    def sample_pools(replay_pools, batch_size, only_completed_episodes=False,
+                     target_embeddings_fn=None, target_version=None):
         """ Sample from replay pools (treating them as one big replay pool) """
         if not np.any([replay_pool.can_sample() for replay_pool in replay_pools]):
             return None
 
         steps, observations, actions, rewards, values, dones, logprobs = [], [], [], [], [], [], []
+        target_embeddings = []
 
         # calculate ratio of pool sizes
         pool_lens = np.array([replay_pool.can_sample() * len(replay_pool) for replay_pool in replay_pools]).astype(float)
@@ -365,8 +431,11 @@ class RNNCriticReplayPool(object):
             if batch_sizes[i] == 0:
                 continue
 
-            steps_i, observations_i, actions_i, rewards_i, values_i, dones_i, logprobs_i = \
-                replay_pool.sample(batch_sizes[i], only_completed_episodes=only_completed_episodes)
+            sample_i = replay_pool.sample(batch_sizes[i], only_completed_episodes=only_completed_episodes,
+                                          target_embeddings_fn=target_embeddings_fn, target_version=target_version)
+            steps_i, observations_i, actions_i, rewards_i, values_i, dones_i, logprobs_i = sample_i[:7]
+            if target_embeddings_fn is not None:
+                target_embeddings.append(sample_i[7])
             steps.append(steps_i)
             observations.append(observations_i)
             actions.append(actions_i)
@@ -386,6 +455,11 @@ class RNNCriticReplayPool(object):
         for arr in (steps, observations, actions, rewards, values, dones, logprobs):
             assert(len(arr) == batch_size)
 
+        if target_embeddings_fn is not None:
+            target_embeddings = np.vstack(target_embeddings)
+            assert(len(target_embeddings) == batch_size)
+            return steps, observations, actions, rewards, values, dones, logprobs, target_embeddings
+
         return steps, observations, actions, rewards, values, dones, logprobs
 
     ###############
@@ -418,8 +492,10 @@ class RNNCriticReplayPool(object):
                 'env_infos': self._env_infos[indices],
                 'est_values': self._est_values[indices],
                 'values': self._values[indices],
-                'logprobs': self._logprobs[indices]
+                'logprobs': self._logprobs[indices],
+                'start_state': self._episode_start_state
             })
+        self._episode_start_state = None
 
         self._last_done_index = self._index
 
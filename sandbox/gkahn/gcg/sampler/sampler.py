@@ -24,8 +24,6 @@ class RNNCriticSampler(object):
         self._policy = policy
         self._n_envs = n_envs
 
-        assert(self._n_envs == 1) # b/c policy reset
-
         self._replay_pools = [RNNCriticReplayPool(env.spec,
                                                   env.horizon,
                                                   policy.N,
@@ -36,22 +34,30 @@ class RNNCriticSampler(object):
                                                   save_rollouts=save_rollouts,
                                                   save_rollouts_observations=save_rollouts_observations,
                                                   save_env_infos=save_env_infos,
-                                                  replay_pool_params=replay_pool_params)
+                                                  replay_pool_params=replay_pool_params,
+                                                  target_embedding_dim=policy.target_embedding_dim)
                               for _ in range(n_envs)]
 
-        try:
-            envs = [pickle.loads(pickle.dumps(env)) for _ in range(self._n_envs)] if self._n_envs > 1 else [env]
-        except:
-            envs = [create_env(env_str) for _ in range(self._n_envs)] if self._n_envs > 1 else [env]
-        ### need to seed each environment if it is GymEnv
-        seed = get_seed()
-        if seed is not None and isinstance(utils.inner_env(env), GymEnv):
-            for i, env in enumerate(envs):
-                utils.inner_env(env).env.seed(seed + i)
-        self._vec_env = VecEnvExecutor(
-            envs=envs,
-            max_path_length=max_path_length
-        )
+        if hasattr(utils.inner_env(env), 'vec_env_executor'):
+            ### env that steps all n_envs together (e.g. BatchCarEnv)
+            self._vec_env = utils.inner_env(env).vec_env_executor(n_envs=n_envs, max_path_length=max_path_length,
+                                                                  normalized_env=utils.normalized_env(env))
+        else:
+            assert(self._n_envs == 1) # b/c policy reset
+
+            try:
+                envs = [pickle.loads(pickle.dumps(env)) for _ in range(self._n_envs)] if self._n_envs > 1 else [env]
+            except:
+                envs = [create_env(env_str) for _ in range(self._n_envs)] if self._n_envs > 1 else [env]
+            ### need to seed each environment if it is GymEnv
+            seed = get_seed()
+            if seed is not None and isinstance(utils.inner_env(env), GymEnv):
+                for i, env in enumerate(envs):
+                    utils.inner_env(env).env.seed(seed + i)
+            self._vec_env = VecEnvExecutor(
+                envs=envs,
+                max_path_length=max_path_length
+            )
         self._curr_observations = self._vec_env.reset()
 
     @property
@@ -103,7 +109,9 @@ class RNNCriticSampler(object):
         ### take step
         next_observations, rewards, dones, env_infos = self._vec_env.step(actions)
 
-        if np.any(dones):
+        ### the reset ops only hold the state of a single env (e.g. the cem warm start), with several envs the
+        ### action selection state of each env restarts with its episode (current_episode_steps == 0)
+        if self._n_envs == 1 and np.any(dones):
             self._policy.reset_get_action()
 
         ### add to replay pool
@@ -156,6 +164,12 @@ class RNNCriticSampler(object):
         return np.any([replay_pool.can_sample() for replay_pool in self._replay_pools])
 
     def sample(self, batch_size):
+        if self._policy.target_embedding_dim is not None:
+            ### also return the target network lowd, cached in the replay pools
+            return RNNCriticReplayPool.sample_pools(self._replay_pools, batch_size,
+                                                    only_completed_episodes=self._policy.only_completed_episodes,
+                                                    target_embeddings_fn=self._policy.get_target_embeddings,
+                                                    target_version=self._policy.target_version)
         return RNNCriticReplayPool.sample_pools(self._replay_pools, batch_size,
                                                 only_completed_episodes=self._policy.only_completed_episodes)
 
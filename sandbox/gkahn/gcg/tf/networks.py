@@ -254,6 +254,54 @@ def fcnn(
     return output, dp_return_masks
 
 
+def _fused_rnn(cells, inputs, initial_state, dtype):
+    """
+    Same as dynamic_rnn with MultiRNNCell(cells), but the input projections of all time steps are computed
+    in one matmul per layer and the recurrence is statically unrolled (so T must be known).
+    Variable scopes match dynamic_rnn/MultiRNNCell so the variables are the same.
+    """
+    T = inputs.get_shape()[1].value
+    assert(T is not None)
+    batch_size = tf.shape(inputs)[0]
+    if initial_state is None:
+        initial_state = [cell.zero_state(batch_size, dtype) for cell in cells]
+
+    layer_inputs = inputs
+    final_states = []
+    with tf.variable_scope('rnn'):
+        with tf.variable_scope('multi_rnn_cell'):
+            for i, cell in enumerate(cells):
+                with tf.variable_scope('cell_{0}'.format(i)) as cell_scope:
+                    num_inputs = layer_inputs.get_shape()[2].value
+                    projected_inputs = cell.input_projection(tf.reshape(layer_inputs, (-1, num_inputs)))
+                    projected_inputs = tf.reshape(projected_inputs,
+                                                  tf.stack((batch_size, T, projected_inputs.get_shape()[1].value)))
+
+                    state = initial_state[i]
+                    layer_outputs = []
+                    for t in range(T):
+                        if t > 0:
+                            cell_scope.reuse_variables()
+                        output, state = cell.call_projected(projected_inputs[:, t, :], state)
+                        layer_outputs.append(output)
+                    layer_inputs = tf.stack(layer_outputs, axis=1)
+                    final_states.append(state)
+
+    return layer_inputs, tuple(final_states)
+
+def _pack_rnn_state(state):
+    """
+    :param state: tuple of each cell's state (a tensor, or an LSTMStateTuple)
+    :return: [batch_size, state dim] in the same layout as the rnn initial_state
+    """
+    tensors = []
+    for cell_state in state:
+        if isinstance(cell_state, tuple):
+            tensors += list(cell_state)
+        else:
+            tensors.append(cell_state)
+    return tf.concat(tensors, axis=1)
+
 def rnn(
         inputs,
         params,
@@ -262,12 +310,16 @@ def rnn(
         num_dp=1,
         dtype=tf.float32,
         scope='rnn',
-        reuse=False):
+        reuse=False,
+        return_final_state=False):
     """
     inputs is shape [batch_size x T x features].
+    If return_final_state, also returns the state after the last step in the same layout as initial_state
+    (so another rnn call can continue from it).
     """
     num_cells = params['num_cells']
     cell_args = params.get('cell_args', {})
+    fused = params.get('fused', False)
     if params['cell_type'] == 'rnn':
         cell_type = rnn_cell.DpRNNCell
         if initial_state is not None:
@@ -351,12 +403,18 @@ def rnn(
 
             cells.append(cell)
 
-        multi_cell = tf.nn.rnn_cell.MultiRNNCell(cells)
-        outputs, state = tf.nn.dynamic_rnn(
-            multi_cell,
-            tf.cast(inputs, dtype),
-            initial_state=initial_state,
-            dtype=dtype,
-            time_major=False)
+        if fused:
+            assert(cell_type != tf.contrib.rnn.LayerNormBasicLSTMCell)
+            outputs, state = _fused_rnn(cells, tf.cast(inputs, dtype), initial_state, dtype)
+        else:
+            multi_cell = tf.nn.rnn_cell.MultiRNNCell(cells)
+            outputs, state = tf.nn.dynamic_rnn(
+                multi_cell,
+                tf.cast(inputs, dtype),
+                initial_state=initial_state,
+                dtype=dtype,
+                time_major=False)
 
+    if return_final_state:
+        return outputs, dp_return_masks, _pack_rnn_state(state)
     return outputs, dp_return_masks
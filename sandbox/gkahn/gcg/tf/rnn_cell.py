@@ -162,6 +162,7 @@ class DpRNNCell(tf.nn.rnn_cell.BasicRNNCell):
         self._dropout_mask = dropout_mask
         self._activation = activation
         self._dtype = dtype
+        self._num_inputs = int(num_inputs)
 
         with tf.variable_scope(weights_scope or type(self).__name__):
             self._weights = tf.get_variable(
@@ -187,6 +188,24 @@ class DpRNNCell(tf.nn.rnn_cell.BasicRNNCell):
 
         return output, output
 
+    def input_projection(self, inputs):
+        """ W * input, which does not depend on the state so can be computed for all time steps at once """
+        return tf.matmul(inputs, self._weights[:self._num_inputs])
+
+    def call_projected(
+            self,
+            projected_inputs,
+            state,
+            scope=None):
+        """Same as __call__, but given input_projection(inputs)."""
+        with tf.variable_scope(scope or type(self).__name__):
+            output = self._activation(projected_inputs + tf.matmul(state, self._weights[self._num_inputs:]))
+
+            if self._dropout_mask is not None:
+                output = output * self._dropout_mask
+
+        return output, output
+
 
 class DpMulintRNNCell(DpRNNCell):
     def __init__(
@@ -204,6 +223,7 @@ class DpMulintRNNCell(DpRNNCell):
         self._activation = activation
         self._dtype = dtype
         self._use_layer_norm = use_layer_norm
+        self._num_inputs = int(num_inputs)
 
         with tf.variable_scope(weights_scope or type(self).__name__):
             self._weights_W = tf.get_variable(
@@ -226,8 +246,20 @@ class DpMulintRNNCell(DpRNNCell):
             state,
             scope=None):
         """Most basic RNN: output = new_state = tanh(W * input + U * state + B)."""
+        return self.call_projected(self.input_projection(inputs), state, scope=scope)
+
+    def input_projection(self, inputs):
+        """ W * input, which does not depend on the state so can be computed for all time steps at once """
+        return tf.matmul(inputs, self._weights_W)
+
+    def call_projected(
+            self,
+            projected_inputs,
+            state,
+            scope=None):
+        """Same as __call__, but given input_projection(inputs)."""
         with tf.variable_scope(scope or type(self).__name__):  # "BasicRNNCell"
-            Wx = tf.matmul(inputs, self._weights_W)
+            Wx = projected_inputs
             Uz = tf.matmul(state, self._weights_U)
             if self._use_layer_norm:
                 Wx = tf.contrib.layers.layer_norm(
@@ -267,6 +299,7 @@ class DpLSTMCell(tf.nn.rnn_cell.BasicLSTMCell):
         self._activation = activation
         self._dtype = dtype
         self._state_is_tuple = True
+        self._num_inputs = int(num_inputs)
 
         with tf.variable_scope(weights_scope or type(self).__name__):
             self._weights = tf.get_variable(
@@ -288,18 +321,41 @@ class DpLSTMCell(tf.nn.rnn_cell.BasicLSTMCell):
             ins = tf.concat([inputs, h], axis=1)
             output = self._activation(tf.matmul(ins, self._weights))
 
-            i, j, f, o = tf.split(output, 4, axis=1)
+            new_h, new_state = self._gates_to_state(output, c)
 
-            forget = c * tf.nn.sigmoid(f + self._forget_bias)
-            new = tf.nn.sigmoid(i) * self._activation(j)
-            new_c = forget + new
+        return new_h, new_state
 
-            # TODO make sure this is correct
-            if self._dropout_mask is not None:
-                new_c = new_c * self._dropout_mask
+    def _gates_to_state(self, output, c):
+        i, j, f, o = tf.split(output, 4, axis=1)
 
-            new_h = self._activation(new_c) * tf.nn.sigmoid(o)
-            new_state = tf.nn.rnn_cell.LSTMStateTuple(new_c, new_h)
+        forget = c * tf.nn.sigmoid(f + self._forget_bias)
+        new = tf.nn.sigmoid(i) * self._activation(j)
+        new_c = forget + new
+
+        # TODO make sure this is correct
+        if self._dropout_mask is not None:
+            new_c = new_c * self._dropout_mask
+
+        new_h = self._activation(new_c) * tf.nn.sigmoid(o)
+        new_state = tf.nn.rnn_cell.LSTMStateTuple(new_c, new_h)
+
+        return new_h, new_state
+
+    def input_projection(self, inputs):
+        """ W * input, which does not depend on the state so can be computed for all time steps at once """
+        return tf.matmul(inputs, self._weights[:self._num_inputs])
+
+    def call_projected(
+            self,
+            projected_inputs,
+            state,
+            scope=None):
+        """Same as __call__, but given input_projection(inputs)."""
+        with tf.variable_scope(scope or type(self).__name__):
+            c, h = state
+            output = self._activation(projected_inputs + tf.matmul(h, self._weights[self._num_inputs:]))
+
+            new_h, new_state = self._gates_to_state(output, c)
 
         return new_h, new_state
 
@@ -323,6 +379,7 @@ class DpMulintLSTMCell(DpLSTMCell):
         self._dtype = dtype
         self._use_layer_norm = use_layer_norm
         self._state_is_tuple = True
+        self._num_inputs = int(num_inputs)
 
         with tf.variable_scope(weights_scope or type(self).__name__):
             self._weights_W = tf.get_variable(
@@ -345,11 +402,23 @@ class DpMulintLSTMCell(DpLSTMCell):
             state,
             scope=None):
         """Most basic RNN: output = new_state = tanh(W * input + U * state + B)."""
+        return self.call_projected(self.input_projection(inputs), state, scope=scope)
+
+    def input_projection(self, inputs):
+        """ W * input, which does not depend on the state so can be computed for all time steps at once """
+        return tf.matmul(inputs, self._weights_W)
+
+    def call_projected(
+            self,
+            projected_inputs,
+            state,
+            scope=None):
+        """Same as __call__, but given input_projection(inputs)."""
         with tf.variable_scope(scope or type(self).__name__):  # "BasicRNNCell"
 
             c, h = state
 
-            Wx = tf.matmul(inputs, self._weights_W)
+            Wx = projected_inputs
             Uz = tf.matmul(h, self._weights_U)
             if self._use_layer_norm:
                 Wx = tf.contrib.layers.layer_norm(
@@ -0,0 +1,77 @@
+import os
+import json
+import time
+import hashlib
+import platform
+import itertools
+import multiprocessing
+
+import tensorflow as tf
+
+def machine_id():
+    return '{0}_{1}_{2}'.format(platform.node(), platform.processor(), multiprocessing.cpu_count())
+
+def session_params_grid(params):
+    """
+    :param params: dict with lists of values for each session param
+    :return: list of all combinations
+    """
+    keys = ('intra_op_threads', 'inter_op_threads', 'xla', 'layout_optimizer')
+    return [dict(zip(keys, values)) for values in itertools.product(*[params[k] for k in keys])]
+
+class SessionAutotuner(object):
+    """
+    Benchmarks session configs on a graph and caches the fastest for each workload (e.g. acting and training),
+    per machine and config key
+    """
+    def __init__(self, cache_dir, config_key):
+        self._cache_dir = cache_dir
+        key = hashlib.md5((machine_id() + config_key).encode()).hexdigest()
+        self._fname = os.path.join(cache_dir, 'session_autotune_{0}.json'.format(key))
+
+    def load(self):
+        """
+        :return: dict of workload name to fastest session params (None if not tuned yet)
+        """
+        if not os.path.exists(self._fname):
+            return None
+        with open(self._fname, 'r') as f:
+            return json.load(f)['fastest']
+
+    def tune(self, graph, create_session, runs, grid, num_runs):
+        """
+        :param create_session: session params -> tf.Session on graph
+        :param runs: dict of workload name -> function(sess) that runs one iteration
+        :param grid: list of session params
+        :return: dict of workload name to fastest session params
+        """
+        with graph.as_default():
+            init_op = tf.global_variables_initializer()
+
+        timings = dict([(name, []) for name in runs.keys()])
+        for session_params in grid:
+            sess = create_session(session_params)
+            for name, run in runs.items():
+                sess.run(init_op)
+                run(sess) # warm up (and XLA compilation)
+                start = time.time()
+                for _ in range(num_runs):
+                    run(sess)
+                timings[name].append((time.time() - start) / float(num_runs))
+            sess.close()
+
+        fastest = dict()
+        for name, times in timings.items():
+            fastest[name] = grid[min(range(len(grid)), key=lambda i: times[i])]
+
+        os.makedirs(self._cache_dir, exist_ok=True)
+        with open(self._fname + '.tmp', 'w') as f:
+            json.dump({
+                'machine': machine_id(),
+                'fastest': fastest,
+                'timings': [dict(params, **dict([(name, timings[name][i]) for name in runs.keys()]))
+                            for i, params in enumerate(grid)]
+            }, f, indent=2)
+        os.replace(self._fname + '.tmp', self._fname)
+
+        return fastest
@@ -15,6 +15,58 @@ def minimize_and_clip(optimizer, objective, var_list, clip_val=10):
             gradients[i] = (tf.clip_by_norm(grad, clip_val), var)
     return optimizer.apply_gradients(gradients)
 
+class FreshReadGetter(object):
+    """
+    Custom getter that returns a new read of each trainable variable, so the read runs after the control
+    dependencies active where the variable is gotten (instead of reusing the variable's own read, which is only
+    evaluated once per session.run). Needed to chain several updates of the same variables in one session.run.
+
+    Variables gotten with reuse do not add their regularization losses, so these are computed on the new reads
+    (once per variable) and kept in regularization_losses
+    """
+    def __init__(self):
+        self.regularization_losses = []
+        self._regularized = set()
+
+    def __call__(self, getter, *args, **kwargs):
+        var = getter(*args, **kwargs)
+        if not kwargs.get('trainable', True):
+            return var
+        read = var.read_value()
+        regularizer = kwargs.get('regularizer', None)
+        if regularizer is not None and var.name not in self._regularized:
+            self._regularized.add(var.name)
+            with tf.name_scope(var.op.name + '/Regularizer/'):
+                loss = regularizer(read)
+            if loss is not None:
+                self.regularization_losses.append(loss)
+        return read
+
+class FreshReadAdamOptimizer(tf.train.AdamOptimizer):
+    """
+    Adam that reads its beta powers where they are used (see FreshReadGetter), so updates chained in one
+    session.run each advance the bias correction
+    """
+    def _apply_dense(self, grad, var):
+        beta1_power, beta2_power = self._beta1_power, self._beta2_power
+        self._beta1_power, self._beta2_power = beta1_power.read_value(), beta2_power.read_value()
+        try:
+            return super(FreshReadAdamOptimizer, self)._apply_dense(grad, var)
+        finally:
+            self._beta1_power, self._beta2_power = beta1_power, beta2_power
+
+    def _apply_sparse(self, grad, var):
+        raise NotImplementedError
+
+    def _finish(self, update_ops, name_scope):
+        with tf.control_dependencies(update_ops):
+            with tf.colocate_with(self._beta1_power):
+                update_beta1 = self._beta1_power.assign(self._beta1_power.read_value() * self._beta1_t,
+                                                        use_locking=self._use_locking)
+                update_beta2 = self._beta2_power.assign(self._beta2_power.read_value() * self._beta2_t,
+                                                        use_locking=self._use_locking)
+        return tf.group(*update_ops + [update_beta1, update_beta2], name=name_scope)
+
 ##################
 ### Operations ###
 ##################
@@ -168,6 +220,102 @@ def block_diagonal(matrices, dtype=tf.float32):
     blocked.set_shape(batch_shape.concatenate((blocked_rows, blocked_cols)))
     return blocked
 
+#################
+### Exporting ###
+#################
+
+def _node_name(input_name):
+    return input_name.lstrip('^').split(':')[0]
+
+def strip_assert_dependencies(graph_def, output_node_names):
+    """
+    Removes control dependencies on assertion ops (tf.assert_* and their cond guards)
+    and prunes the graph to only what is needed to compute output_node_names
+    """
+    stripped_graph_def = tf.GraphDef()
+    stripped_graph_def.versions.CopyFrom(graph_def.versions)
+    stripped_graph_def.library.CopyFrom(graph_def.library)
+    for node in graph_def.node:
+        stripped_node = stripped_graph_def.node.add()
+        stripped_node.CopyFrom(node)
+        del stripped_node.input[:]
+        stripped_node.input.extend([name for name in node.input
+                                    if not (name.startswith('^') and 'Assert' in _node_name(name).split('/'))])
+    return tf.graph_util.extract_sub_graph(stripped_graph_def, output_node_names)
+
+def assigned_variable_names(graph_def):
+    """
+    :return: names of the variables that are assigned to by ops in graph_def
+    """
+    variable_names = set([node.name for node in graph_def.node if node.op in ('Variable', 'VariableV2')])
+    assigned_names = set()
+    for node in graph_def.node:
+        if node.op in ('Assign', 'AssignAdd', 'AssignSub') and _node_name(node.input[0]) in variable_names:
+            assigned_names.add(_node_name(node.input[0]))
+    return sorted(assigned_names)
+
+def graph_element_names(x):
+    """
+    :param x: (nested dicts/lists of) tensors, operations and variables
+    :return: same structure with each graph element replaced by a tagged name (see graph_elements_by_name)
+    """
+    if x is None:
+        return None
+    elif isinstance(x, dict):
+        return dict([(k, graph_element_names(v)) for k, v in x.items()])
+    elif isinstance(x, (list, tuple)):
+        return [graph_element_names(v) for v in x]
+    elif isinstance(x, tf.Variable):
+        return 'variable:' + x.name
+    elif isinstance(x, tf.Tensor):
+        return 'tensor:' + x.name
+    elif isinstance(x, tf.Operation):
+        return 'operation:' + x.name
+    else:
+        raise NotImplementedError('Cannot name {0}'.format(x))
+
+def graph_elements_by_name(names, graph):
+    """
+    Inverse of graph_element_names, looking up the elements in graph
+    """
+    if names is None:
+        return None
+    elif isinstance(names, dict):
+        return dict([(k, graph_elements_by_name(v, graph)) for k, v in names.items()])
+    elif isinstance(names, list):
+        return [graph_elements_by_name(v, graph) for v in names]
+
+    tag, name = names.split(':', 1)
+    if tag == 'variable':
+        variables = [v for v in graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES) if v.name == name]
+        assert(len(variables) == 1)
+        return variables[0]
+    elif tag == 'tensor':
+        return graph.get_tensor_by_name(name)
+    elif tag == 'operation':
+        return graph.get_operation_by_name(name)
+    else:
+        raise NotImplementedError('Unknown tag {0}'.format(tag))
+
+#################
+### Profiling ###
+#################
+
+def step_stats_op_times(step_stats):
+    """
+    :param step_stats: from the RunMetadata of a traced session.run
+    :return: list of (node name, op type, microseconds)
+    """
+    op_times = []
+    for dev_stats in step_stats.dev_stats:
+        if '/stream:' in dev_stats.device and not dev_stats.device.endswith('/stream:all'):
+            continue # each gpu stream is also included in stream:all
+        for node_stats in dev_stats.node_stats:
+            label = node_stats.timeline_label
+            op_type = label.split(' = ')[1].split('(')[0] if ' = ' in label else node_stats.node_name
+            op_times.append((_node_name(node_stats.node_name), op_type, node_stats.all_end_rel_micros))
+    return op_times
+
 ###############
 ### Asserts ###
 ###############
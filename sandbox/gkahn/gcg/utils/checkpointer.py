@@ -0,0 +1,81 @@
+import os
+import threading
+import queue
+import numpy as np
+
+class Checkpointer(object):
+    """
+    Writes checkpoints (dicts of variable name to numpy array) as npz files in a background thread.
+    Keeps the last keep_last checkpoints and every keep_every-th checkpoint.
+    An error while writing is raised from the next save or close.
+    """
+    def __init__(self, folder, keep_last=5, keep_every=10):
+        self._folder = folder
+        self._keep_last = keep_last
+        self._keep_every = keep_every
+
+        self._saved_itrs = []
+        self._error = None
+        self._queue = queue.Queue(maxsize=2) # blocks training if writing falls behind
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @staticmethod
+    def checkpoint_file(folder, itr):
+        return os.path.join(folder, 'itr_{0:d}_checkpoint.npz'.format(itr))
+
+    @staticmethod
+    def load(fname):
+        with np.load(fname) as d:
+            return dict([(k, d[k]) for k in d.keys()])
+
+    def save(self, itr, values):
+        """
+        :param values: dict of variable name to numpy array, must not be modified afterwards
+        """
+        self._raise_error()
+        self._queue.put((itr, values))
+
+    def close(self):
+        """ Waits until all checkpoints are written """
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    ########################
+    ### Writing (thread) ###
+    ########################
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if self._error is not None:
+                continue # keep emptying the queue so save and close never block
+            itr, values = item
+            try:
+                self._write(itr, values)
+                self._remove_old(itr)
+            except Exception as e:
+                self._error = e
+
+    def _write(self, itr, values):
+        fname = Checkpointer.checkpoint_file(self._folder, itr)
+        with open(fname + '.tmp', 'wb') as f:
+            np.savez(f, **values)
+        os.replace(fname + '.tmp', fname) # so a checkpoint is never read partially written
+
+    def _remove_old(self, itr):
+        self._saved_itrs.append(itr)
+        keep_itrs = self._saved_itrs[-self._keep_last:]
+        for saved_itr in list(self._saved_itrs):
+            if saved_itr in keep_itrs or saved_itr % self._keep_every == 0:
+                continue
+            os.remove(Checkpointer.checkpoint_file(self._folder, saved_itr))
+            self._saved_itrs.remove(saved_itr)
@@ -52,6 +52,17 @@ def inner_env(env):
         env = env.wrapped_env
     return env
 
+def normalized_env(env):
+    """
+    :return: the NormalizedEnv wrapper of env (None if not normalized)
+    """
+    from rllab.envs.normalized_env import NormalizedEnv
+    while hasattr(env, 'wrapped_env'):
+        if isinstance(env, NormalizedEnv):
+            return env
+        env = env.wrapped_env
+    return None
+
 ##############
 ### Images ###
 ##############
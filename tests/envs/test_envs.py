@@ -1,3 +1,5 @@
+import unittest
+
 import numpy as np
 from nose2 import tools
 
@@ -100,3 +102,110 @@ def test_env(env):
     else:
         env.render()
     env.terminate()
+
+
+### KinematicCarEnv (pure numpy stand-in for the panda3d rccar envs)
+
+def test_kinematic_car_env_spaces():
+    try:
+        import panda3d
+    except ImportError:
+        raise unittest.SkipTest('panda3d is not installed')
+    from sandbox.gkahn.gcg.envs.kinematic_car_env import KinematicCarEnv
+    from sandbox.gkahn.gcg.envs.rccar.cylinder_env import CylinderEnv
+
+    for obs_mode in ('default', 'raycast'):
+        params = {'hfov': 120, 'obs_mode': obs_mode}
+        kinematic_env = KinematicCarEnv(params=dict(params, layout='cylinder'))
+        cylinder_env = CylinderEnv(params=params)
+        assert kinematic_env.observation_space.shape == cylinder_env.observation_space.shape
+        assert np.allclose(kinematic_env.observation_space.bounds, cylinder_env.observation_space.bounds)
+        assert np.allclose(kinematic_env.action_space.bounds, cylinder_env.action_space.bounds)
+        assert kinematic_env.horizon == cylinder_env.horizon
+        assert kinematic_env.observation_space.contains(kinematic_env.reset())
+
+
+def test_kinematic_car_env_step_cars():
+    from sandbox.gkahn.gcg.envs.kinematic_car_env import KinematicCarEnv
+
+    params = {'layout': 'cylinder', 'random_seed': 0, 'collision_reward': -1., 'obs_mode': 'raycast'}
+    num_cars = 4
+    env = KinematicCarEnv(params=dict(params, num_cars=num_cars))
+    single_env = KinematicCarEnv(params=params)
+    observations = env.reset_cars(range(num_cars))
+    assert observations.shape == (num_cars,) + env.observation_space.shape
+    single_env.reset()
+
+    rng = np.random.RandomState(0)
+    is_done = np.zeros(num_cars, dtype=bool)
+    for _ in range(4 * env.horizon):
+        actions = np.array([[rng.uniform(-1., 1.), 1.] for _ in range(num_cars)])
+        rewards, dones, env_infos = env.step_cars(actions)
+        assert len(rewards) == len(dones) == len(env_infos) == num_cars
+        for reward, done, env_info in zip(rewards, dones, env_infos):
+            if env_info['coll']:
+                assert done and reward == -1.
+            elif not done:
+                assert np.isclose(reward, env_info['vel']) and env_info['pos'][1] < 6.
+            else:
+                assert env_info['pos'][1] >= 6. # reached the goal
+        ### the first car steps as it would alone
+        _, reward, done, env_info = single_env.step(actions[0])
+        assert np.isclose(reward, rewards[0]) and done == dones[0]
+        assert np.allclose(env_info['pos'], env_infos[0]['pos'])
+
+        is_done |= dones
+        if is_done[0]:
+            break
+        env.reset_cars(np.nonzero(dones)[0])
+    assert is_done.any()
+
+
+def test_gcg_kinematic_car_env():
+    try:
+        import tensorflow
+    except ImportError:
+        raise unittest.SkipTest('tensorflow is not installed')
+    import shutil
+    import tempfile
+    import yaml
+
+    import rllab.misc.logger as logger
+    from sandbox.gkahn.gcg.algos.gcg import run_gcg
+
+    yaml_path = os.path.join(os.path.dirname(__file__), '..', '..', 'sandbox', 'gkahn', 'gcg', 'yamls', 'ours.yaml')
+    with open(yaml_path, 'r') as f:
+        params = yaml.load(f)
+    params['txt'] = ''
+    env_str = "KinematicCarEnv(params={{'layout': 'cylinder', 'obs_mode': 'raycast', 'do_back_up': False, " \
+              "'collision_reward': {0}}})"
+    params['alg'].update({
+        'env': env_str.format(-1),
+        'env_eval': env_str.format(0),
+        'total_steps': 200,
+        'onpolicy_after_n_steps': 50,
+        'learn_after_n_steps': 50,
+        'eval_every_n_steps': 100,
+        'update_target_every_n_steps': 100,
+        'update_preprocess_every_n_steps': 100,
+        'save_every_n_steps': 100,
+        'log_every_n_steps': 100,
+        'replay_pool_size': 1000,
+    })
+    params['policy'].update({'N': 4, 'H': 4, 'gpu_device': ''})
+    for get_action in ('get_action_test', 'get_action_target'):
+        params['policy'][get_action].update({'H': 4, 'type': 'random'})
+        params['policy'][get_action]['random']['K'] = 16
+
+    snapshot_dir, snapshot_mode = logger.get_snapshot_dir(), logger.get_snapshot_mode()
+    folder = tempfile.mkdtemp()
+    try:
+        logger.set_snapshot_dir(folder)
+        logger.set_snapshot_mode('all')
+        with tensorflow.Graph().as_default():
+            run_gcg(params)
+        assert os.path.exists(os.path.join(folder, 'itr_0.pkl'))
+    finally:
+        logger.set_snapshot_dir(snapshot_dir)
+        logger.set_snapshot_mode(snapshot_mode)
+        shutil.rmtree(folder)
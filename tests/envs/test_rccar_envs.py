@@ -0,0 +1,129 @@
+import unittest
+
+
+def test_tick_controller_matches_loop():
+    try:
+        import panda3d
+    except ImportError:
+        raise unittest.SkipTest('panda3d is not installed')
+    from sandbox.gkahn.gcg.envs.rccar.benchmark_envs import compare_controllers
+
+    ### both controllers start from the same get_state and take the same actions
+    assert(compare_controllers('SquareClutteredEnv', ['loop', 'tick'], 200, tol=1e-3))
+
+SEEDED_ENV_STR = "SquareClutteredEnv(params={'hfov': 120, 'obs_mode': 'raycast', 'random_seed': 5})"
+
+
+def _rollouts(env_str, steps, queue):
+    """
+    Steps random actions (resetting on done), and puts the rollouts as saved by the sampler on queue
+    """
+    from sandbox.gkahn.gcg.envs.env_utils import create_env
+    import numpy as np
+
+    env = create_env(env_str, is_normalize=False)
+    rng = np.random.RandomState(0)
+    rollouts = []
+    observation = env.reset()
+    for _ in range(steps):
+        if len(rollouts) == 0 or rollouts[-1]['dones'][-1]:
+            rollouts.append({'start_state': None, 'observations': [], 'actions': [], 'rewards': [], 'dones': [],
+                             'positions': []})
+        rollout = rollouts[-1]
+        action = rng.uniform(-1., 1., size=2)
+        rollout['observations'].append(env.observation_space.flatten(observation))
+        observation, reward, done, info = env.step(action)
+        if 'start_state' in info:
+            rollout['start_state'] = info['start_state']
+        rollout['actions'].append(action)
+        rollout['rewards'].append(reward)
+        rollout['dones'].append(done)
+        rollout['positions'].append(info['pos'])
+        if done:
+            observation = env.reset()
+    for rollout in rollouts:
+        for key in ('observations', 'actions', 'rewards', 'dones', 'positions'):
+            rollout[key] = np.array(rollout[key])
+    queue.put(rollouts)
+
+
+def test_same_seed_same_rollouts():
+    try:
+        import panda3d
+    except ImportError:
+        raise unittest.SkipTest('panda3d is not installed')
+    import multiprocessing
+    import numpy as np
+    from sandbox.gkahn.gcg.envs.rccar.benchmark_envs import _run_process
+
+    ### restarts and back-up noise only come from the env's random_seed
+    queue = multiprocessing.Queue()
+    rollouts = [_run_process(_rollouts, (SEEDED_ENV_STR, 300, queue), queue) for _ in range(2)]
+    assert(len(rollouts[0]) > 1) # also covers resets
+    assert(len(rollouts[0]) == len(rollouts[1]))
+    for rollout_0, rollout_1 in zip(*rollouts):
+        for key in ('observations', 'rewards', 'dones', 'positions'):
+            assert(np.array_equal(rollout_0[key], rollout_1[key]))
+
+
+def test_replay_rollouts_from_start_state():
+    try:
+        import panda3d
+    except ImportError:
+        raise unittest.SkipTest('panda3d is not installed')
+    import multiprocessing
+    import numpy as np
+    from sandbox.gkahn.gcg.envs.rccar.benchmark_envs import _run_process
+    from sandbox.gkahn.gcg.replay_rollouts import replay_rollouts
+
+    queue = multiprocessing.Queue()
+    rollouts = _run_process(_rollouts, (SEEDED_ENV_STR, 300, queue), queue)
+    assert(all([rollout['start_state'] is not None for rollout in rollouts]))
+
+    replayed_rollouts, num_mismatches = replay_rollouts(SEEDED_ENV_STR, False, rollouts)
+    assert(num_mismatches == 0)
+    for rollout, replayed_rollout in zip(rollouts, replayed_rollouts):
+        assert(np.array_equal(rollout['observations'], replayed_rollout['observations']))
+
+
+def _branches(env_name, steps, queue):
+    """
+    Steps the same actions twice from one get_state, and puts the positions and observations of both on queue
+    """
+    from sandbox.gkahn.gcg.envs.rccar.benchmark_envs import _create_env
+    import numpy as np
+
+    env = _create_env(env_name, 'raycast')
+    env.reset()
+    rng = np.random.RandomState(0)
+    for _ in range(10):
+        env.step(rng.uniform(-1., 1., size=2))
+    state = env.get_state()
+    actions = rng.uniform(-1., 1., size=(steps, 2))
+
+    branches = []
+    for _ in range(2):
+        env.set_state(state)
+        positions, observations = [], []
+        for action in actions:
+            observation, _, _, info = env.step(action)
+            positions.append(info['pos'])
+            observations.append(observation)
+        branches.append((np.array(positions), np.array(observations)))
+    queue.put(branches)
+
+
+def test_set_state_branches_identically():
+    try:
+        import panda3d
+    except ImportError:
+        raise unittest.SkipTest('panda3d is not installed')
+    import multiprocessing
+    import numpy as np
+    from sandbox.gkahn.gcg.envs.rccar.benchmark_envs import _run_process
+
+    queue = multiprocessing.Queue()
+    (positions_0, observations_0), (positions_1, observations_1) = \
+        _run_process(_branches, ('SquareClutteredEnv', 50, queue), queue)
+    assert(np.array_equal(positions_0, positions_1))
+    assert(np.array_equal(observations_0, observations_1))
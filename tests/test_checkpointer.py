@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+
+def test_checkpointer_write_failure():
+    from sandbox.gkahn.gcg.utils.checkpointer import Checkpointer
+
+    folder = tempfile.mkdtemp()
+    try:
+        checkpointer = Checkpointer(folder)
+
+        def _write(itr, values):
+            raise IOError('disk full')
+        checkpointer._write = _write
+
+        values = {'var': np.zeros(3)}
+        checkpointer.save(0, values)
+        ### the failed write is raised from a later save (or close), which never block
+        try:
+            for itr in range(1, 10):
+                checkpointer.save(itr, values)
+            checkpointer.close()
+        except IOError as e:
+            assert str(e) == 'disk full'
+        else:
+            assert False, 'write failure was not raised'
+
+        try:
+            checkpointer.close()
+        except IOError:
+            pass
+        else:
+            assert False, 'write failure was not raised on close'
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_checkpointer_keep():
+    from sandbox.gkahn.gcg.utils.checkpointer import Checkpointer
+
+    folder = tempfile.mkdtemp()
+    try:
+        checkpointer = Checkpointer(folder, keep_last=2, keep_every=5)
+        for itr in range(8):
+            checkpointer.save(itr, {'var': np.ones(3) * itr})
+        checkpointer.close()
+
+        for itr in range(8):
+            fname = Checkpointer.checkpoint_file(folder, itr)
+            kept = itr in (0, 5, 6, 7)
+            assert kept == os.path.exists(fname)
+        assert np.all(Checkpointer.load(Checkpointer.checkpoint_file(folder, 7))['var'] == 7)
+    finally:
+        shutil.rmtree(folder)
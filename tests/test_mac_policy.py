@@ -0,0 +1,151 @@
+import os
+import unittest
+
+import numpy as np
+
+YAML_PATH = os.path.join(os.path.dirname(__file__), '..', 'sandbox', 'gkahn', 'gcg', 'yamls', 'ours.yaml')
+ENV_STR = "KinematicCarEnv(params={'layout': 'cylinder', 'obs_mode': 'raycast', 'random_seed': 0})"
+
+
+def _create_policy(get_action_random=None, **policy_params):
+    """
+    :param get_action_random: updates the random action selection params of get_action_test
+    :return: small RCcarMACPolicy (from ours.yaml) on KinematicCarEnv, its env
+    """
+    try:
+        import tensorflow
+    except ImportError:
+        raise unittest.SkipTest('tensorflow is not installed')
+    import yaml
+    from sandbox.gkahn.gcg.envs.env_utils import create_env
+    from sandbox.gkahn.gcg.policies.rccar_mac_policy import RCcarMACPolicy
+
+    with open(YAML_PATH, 'r') as f:
+        params = yaml.load(f)
+    params['policy'].update({'N': 4, 'H': 4, 'gpu_device': ''})
+    for get_action in ('get_action_test', 'get_action_target'):
+        params['policy'][get_action].update({'H': 4, 'type': 'random'})
+        params['policy'][get_action]['random']['K'] = 16
+    params['policy']['get_action_test']['random'].update(get_action_random or {})
+    params['policy'].update(policy_params)
+
+    env = create_env(ENV_STR, is_normalize=False, seed=0)
+    policy = RCcarMACPolicy(
+        env_spec=env.spec,
+        exploration_strategies=params['alg']['exploration_strategies'],
+        **params['policy']['RCcarMACPolicy'],
+        **params['policy']
+    )
+    return policy, env
+
+
+def _batch(policy, env, batch_size, rng):
+    """
+    :return: random training batch as sampled from the replay pool (steps, observations, actions, rewards, dones)
+    """
+    N, obs_history_len = policy.N, policy._obs_history_len
+    obs_dim = env.observation_space.flat_dim
+    action_dim = env.action_space.flat_dim
+    steps = rng.randint(0, 1000, size=(batch_size, 1)) + np.arange(N + 1)
+    observations = rng.randint(0, 256, size=(batch_size, N + obs_history_len, obs_dim)).astype(np.uint8)
+    actions = rng.uniform(-1., 1., size=(batch_size, N + 1, action_dim))
+    dones = rng.rand(batch_size, N + 1) < 0.1
+    rewards = -1. * dones
+    return steps, observations, actions, rewards, dones
+
+
+def test_train_steps_matches_train_step():
+    k = 3
+    policy, env = _create_policy(train_steps_per_run=k)
+    import tensorflow as tf
+    sess = policy._tf_dict['sess']
+    tf_vars = sess.graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES)
+    ### includes Adam's slots and beta powers, and the global step
+    assert any(['beta1_power' in var.name for var in tf_vars])
+    init_values = sess.run(tf_vars)
+
+    rng = np.random.RandomState(0)
+    batches = [_batch(policy, env, 8, rng) for _ in range(k)]
+
+    for steps, observations, actions, rewards, dones in batches:
+        policy.train_step(0, steps, observations, actions, rewards, None, dones, None, use_target=False)
+    train_step_values = sess.run(tf_vars)
+
+    for var, value in zip(tf_vars, init_values):
+        var.load(value, sess)
+    steps, observations, actions, rewards, dones = [np.stack(x) for x in zip(*batches)]
+    policy.train_steps(0, steps, observations, actions, rewards, None, dones, None, use_target=False)
+    train_steps_values = sess.run(tf_vars)
+
+    for var, value, value_steps in zip(tf_vars, train_step_values, train_steps_values):
+        assert np.allclose(value, value_steps, rtol=1e-4, atol=1e-6), var.name
+
+
+def test_export_inference_graph():
+    import shutil
+    import tempfile
+    from sandbox.gkahn.gcg.policies.frozen_mac_policy import FrozenMACPolicy
+
+    policy, env = _create_policy()
+    rng = np.random.RandomState(0)
+    observations = [rng.randint(0, 256, size=(policy.obs_history_len, env.observation_space.flat_dim)).astype(np.uint8)
+                    for _ in range(3)]
+
+    folder = tempfile.mkdtemp()
+    try:
+        fname = os.path.join(folder, 'inference.pkl')
+        policy.export_inference_graph(fname)
+        frozen_policy = FrozenMACPolicy(fname, gpu_device='')
+    finally:
+        shutil.rmtree(folder)
+
+    ### the random candidates are seeded (create_env sets the graph seed), and neither graph sampled yet
+    actions, values, _, _ = policy.get_actions([0, 1, 2], [0, 0, 0], observations, explore=False)
+    frozen_actions, frozen_values, _, _ = frozen_policy.get_actions([0, 1, 2], [0, 0, 0], observations, explore=False)
+    assert np.allclose(actions, frozen_actions, atol=1e-5)
+    assert np.allclose(values, frozen_values, atol=1e-5)
+
+
+def test_update_preprocess_bumps_target_version():
+    from sandbox.gkahn.gcg.sampler.replay_pool import RNNCriticReplayPool
+
+    policy, env = _create_policy()
+    replay_pool = RNNCriticReplayPool(env.spec, env.horizon, policy.N, policy.gamma, 100, policy.obs_history_len,
+                                      'uniform')
+    observation = env.reset()
+    for step in range(20):
+        replay_pool.store_observation(step, observation)
+        action = env.action_space.sample()
+        observation, reward, done, _ = env.step(action)
+        replay_pool.store_effect(action, reward, done, None, np.nan, np.nan)
+        if done:
+            observation = env.reset()
+
+    ### cached target embeddings depend on the preprocessing
+    target_version = policy.target_version
+    policy.update_preprocess(replay_pool.statistics)
+    assert policy.target_version > target_version
+
+
+def test_action_bank_recomputed_after_target_update():
+    policy, env = _create_policy(get_action_random={'bank_size': 32}, use_target=True)
+    sess = policy._tf_dict['sess']
+    tf_bank_vars = [var for var in policy.get_params_internal() if 'action_bank' in var.name]
+    assert len(tf_bank_vars) == 2
+    assert all([var.name.startswith('policy/action_bank/') for var in tf_bank_vars])
+    tf_embeddings = [var for var in tf_bank_vars if 'embeddings' in var.name][0]
+
+    rng = np.random.RandomState(0)
+    observations = [rng.randint(0, 256, size=(policy.obs_history_len, env.observation_space.flat_dim)).astype(np.uint8)]
+    policy.get_actions([0], [0], observations, explore=False)
+    embeddings = sess.run(tf_embeddings)
+
+    ### not recomputed after every train step
+    steps, batch_observations, actions, rewards, dones = _batch(policy, env, 8, rng)
+    policy.train_step(0, steps, batch_observations, actions, rewards, None, dones, None, use_target=True)
+    policy.get_actions([1], [1], observations, explore=False)
+    assert np.array_equal(embeddings, sess.run(tf_embeddings))
+
+    policy.update_target()
+    policy.get_actions([2], [2], observations, explore=False)
+    assert not np.array_equal(embeddings, sess.run(tf_embeddings))
@@ -13,3 +13,46 @@ def test_gru_network():
         outputs=L.get_output(network.output_layer)
     )
     assert f_output(np.zeros((6, 8, 2, 3))).shape == (6, 8, 5)
+
+
+def test_fused_rnn_matches_dynamic_rnn():
+    import unittest
+    try:
+        import tensorflow as tf
+    except ImportError:
+        raise unittest.SkipTest('tensorflow is not installed')
+    import numpy as np
+    from sandbox.gkahn.gcg.tf.networks import rnn
+
+    ### fused rnn should match dynamic rnn with the same variables and dropout masks
+    rng = np.random.RandomState(0)
+    batch_size, T, num_inputs, num_units, num_cells = 8, 16, 5, 4, 2
+    inputs_np = rng.random_sample((batch_size, T, num_inputs)).astype(np.float32)
+    with tf.Graph().as_default():
+        tf.set_random_seed(0)
+        sess = tf.Session()
+        for cell_type, states_per_cell in (('rnn', 1), ('mulint_rnn', 1), ('lstm', 2), ('mulint_lstm', 2)):
+            for use_layer_norm in ((False, True) if cell_type == 'mulint_lstm' else (False,)):
+                params = {
+                    'num_cells': num_cells,
+                    'cell_type': cell_type,
+                    'cell_args': {'use_layer_norm': use_layer_norm} if cell_type == 'mulint_lstm' else {},
+                    'dropout': 0.5
+                }
+                scope = 'rnn_{0}_{1}'.format(cell_type, use_layer_norm)
+                inputs = tf.constant(inputs_np)
+                initial_state = tf.constant(rng.random_sample((batch_size, states_per_cell * num_cells * num_units)),
+                                            dtype=tf.float32)
+                outputs, dp_masks, state = rnn(inputs, params, initial_state=initial_state, scope=scope,
+                                               return_final_state=True)
+                # reuse=True fails if the variables differ
+                outputs_fused, _, state_fused = rnn(inputs, dict(params, fused=True), initial_state=initial_state,
+                                                    dp_masks=dp_masks, scope=scope, reuse=True,
+                                                    return_final_state=True)
+
+                sess.run(tf.global_variables_initializer())
+                outputs_eval, outputs_fused_eval, state_eval, state_fused_eval = \
+                    sess.run([outputs, outputs_fused, state, state_fused])
+                assert np.allclose(outputs_eval, outputs_fused_eval, atol=1e-5), (cell_type, use_layer_norm)
+                assert np.allclose(state_eval, state_fused_eval, atol=1e-5), (cell_type, use_layer_norm)
+        sess.close()
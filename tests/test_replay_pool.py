@@ -0,0 +1,33 @@
+import numpy as np
+
+
+def _create_replay_pool(N, obs_history_len, size=100):
+    from rllab.envs.env_spec import EnvSpec
+    from rllab.spaces.box import Box
+    from sandbox.gkahn.gcg.sampler.replay_pool import RNNCriticReplayPool
+
+    obs_dim = 2
+    env_spec = EnvSpec(Box(low=-1., high=1., shape=(obs_dim,)), Box(low=-1., high=1., shape=(1,)))
+    return RNNCriticReplayPool(env_spec, 1000, N, 0.99, size, obs_history_len, 'uniform',
+                               target_embedding_dim=obs_history_len * obs_dim)
+
+
+def test_cached_target_embeddings_match_sampled_windows():
+    N, obs_history_len = 4, 3
+    replay_pool = _create_replay_pool(N, obs_history_len)
+    rng = np.random.RandomState(0)
+    for step in range(80):
+        replay_pool.store_observation(step, rng.uniform(1., 2., size=2)) # nonzero, so zeroing shows
+        done = (step % 7 == 6)
+        replay_pool.store_effect(np.zeros(1), -float(done), done, None, np.nan, np.nan)
+
+    ### the target network embeds the N+1 overlapping windows of the sampled observations when not cached
+    target_embeddings_fn = lambda observations: observations.reshape((len(observations), -1)).astype(np.float32)
+    np.random.seed(0)
+    for target_version in (0, 0, 1):
+        steps, observations, actions, rewards, values, dones, logprobs, target_embeddings = \
+            replay_pool.sample(32, target_embeddings_fn=target_embeddings_fn, target_version=target_version)
+        assert np.any(dones[:, :-1])
+        for j in range(N + 1):
+            assert np.allclose(target_embeddings[:, j],
+                               target_embeddings_fn(observations[:, j:j + obs_history_len]))